@@ -64,7 +64,7 @@ class ExecutableSerialisation:
 
 class TestSerialisation:
     def __init__(self, name, suite, fname, is_cross, exe_wrapper, is_parallel, cmd_args, env,
-                 should_fail, timeout, workdir, extra_paths):
+                 should_fail, timeout, workdir, extra_paths, depends, weight, memory):
         self.name = name
         self.suite = suite
         self.fname = fname
@@ -77,6 +77,12 @@ class TestSerialisation:
         self.timeout = timeout
         self.workdir = workdir
         self.extra_paths = extra_paths
+        # Files other than the ones on the command line whose contents
+        # affect the result, such as the shared libraries the test uses.
+        self.depends = depends
+        # How many CPUs and how many megabytes of memory the test uses
+        self.weight = weight
+        self.memory = memory
 
 class OptionProxy:
     def __init__(self, name, value):
@@ -103,9 +109,11 @@ class Backend:
         self.build = build
         self.environment = build.environment
         self.processed_targets = {}
+        # Unity source files of each target by compiler language
+        self.unity_files = {}
         self.build_to_src = os.path.relpath(self.environment.get_source_dir(),
                                             self.environment.get_build_dir())
-        for t in self.build.targets:
+        for t in self.build.targets.values():
             priv_dirname = self.get_target_private_dir_abs(t)
             os.makedirs(priv_dirname, exist_ok=True)
 
@@ -169,16 +177,20 @@ class Backend:
         # target that the GeneratedList is used in
         return os.path.join(self.get_target_private_dir(target), src)
 
-    def get_unity_source_filename(self, target, suffix):
-        return target.name + '-unity.' + suffix
+    def get_unity_source_filename(self, target, suffix, number=None):
+        if number is None:
+            return target.name + '-unity.' + suffix
+        return '%s-unity%d.%s' % (target.name, number, suffix)
 
     def generate_unity_files(self, target, unity_src):
         abs_files = []
         result = []
         compsrcs = classify_unity_sources(target.compilers.values(), unity_src)
+        unity_size = self.get_option_for_target('unity_size', target)
+        self.unity_files[target.get_id()] = {}
 
-        def init_language_file(suffix):
-            unity_src_name = self.get_unity_source_filename(target, suffix)
+        def init_language_file(suffix, number):
+            unity_src_name = self.get_unity_source_filename(target, suffix, number)
             unity_src_subdir = self.get_target_private_dir_abs(target)
             outfilename = os.path.join(unity_src_subdir,
                                        unity_src_name)
@@ -192,11 +204,23 @@ class Backend:
             result.append(mesonlib.File(True, unity_src_subdir, unity_src_name))
             return open(outfileabs_tmp, 'w')
 
-        # For each language, generate a unity source file and return the list
+        # For each language, generate unity source files of at most
+        # unity_size sources each, so that they can be compiled in parallel,
+        # and return the list. The sources are split in the order they are
+        # given so that editing one of them only changes one unity file.
         for comp, srcs in compsrcs.items():
-            with init_language_file(comp.get_default_suffix()) as ofile:
-                for src in srcs:
-                    ofile.write('#include<%s>\n' % src)
+            first = len(result)
+            if unity_size > 0:
+                chunks = [srcs[i:i + unity_size] for i in range(0, len(srcs), unity_size)]
+                numbers = range(len(chunks))
+            else:
+                chunks = [srcs]
+                numbers = [None]
+            for (number, chunk) in zip(numbers, chunks):
+                with init_language_file(comp.get_default_suffix(), number) as ofile:
+                    for src in chunk:
+                        ofile.write('#include<%s>\n' % src)
+            self.unity_files[target.get_id()][comp.get_language()] = result[first:]
         [mesonlib.replace_if_different(x, x + '.tmp') for x in abs_files]
         return result
 
@@ -302,19 +326,23 @@ class Backend:
     def determine_ext_objs(self, target, extobj, proj_dir_to_build_root):
         result = []
         targetdir = self.get_target_private_dir(extobj.target)
-        # With unity builds, there's just one object that contains all the
+        # With unity builds, the objects of the unity files contain all the
         # sources, and we only support extracting all the objects in this mode,
-        # so just return that.
+        # so just return those.
         if self.get_option_for_target('unity', target):
             comp = get_compiler_for_source(extobj.target.compilers.values(),
                                            extobj.srclist[0])
+            # The unity files are known once the target has been generated.
             # There is a potential conflict here, but it is unlikely that
             # anyone both enables unity builds and has a file called foo-unity.cpp.
-            osrc = self.get_unity_source_filename(extobj.target,
-                                                  comp.get_default_suffix())
-            objname = self.object_filename_from_source(extobj.target, osrc, True)
-            objpath = os.path.join(proj_dir_to_build_root, targetdir, objname)
-            return [objpath]
+            try:
+                unity_files = self.unity_files[extobj.target.get_id()][comp.get_language()]
+            except KeyError:
+                raise MesonException('Objects of target %s extracted before it was generated.' % extobj.target.name)
+            for osrc in unity_files:
+                objname = self.object_filename_from_source(extobj.target, osrc, True)
+                result.append(os.path.join(proj_dir_to_build_root, targetdir, objname))
+            return result
         for osrc in extobj.srclist:
             objname = self.object_filename_from_source(extobj.target, osrc, False)
             objpath = os.path.join(proj_dir_to_build_root, targetdir, objname)
@@ -487,6 +515,9 @@ class Backend:
                 extra_paths = self.determine_windows_extra_paths(exe)
             else:
                 extra_paths = []
+            depends = []
+            if isinstance(exe, build.BuildTarget):
+                depends += [self.get_target_filename_abs(ld) for ld in exe.get_transitive_link_deps()]
             cmd_args = []
             for a in t.cmd_args:
                 if hasattr(a, 'held_object'):
@@ -498,14 +529,35 @@ class Backend:
                     cmd_args.append(a)
                 elif isinstance(a, build.Target):
                     cmd_args.append(self.get_target_filename(a))
+                    if isinstance(a, build.BuildTarget):
+                        depends += [self.get_target_filename_abs(ld) for ld in a.get_transitive_link_deps()]
                 else:
                     raise MesonException('Bad object in test command.')
             ts = TestSerialisation(t.get_name(), t.suite, cmd, is_cross, exe_wrapper,
                                    t.is_parallel, cmd_args, t.env, t.should_fail,
-                                   t.timeout, t.workdir, extra_paths)
+                                   t.timeout, t.workdir, extra_paths, depends,
+                                   t.weight, t.memory)
             arr.append(ts)
         pickle.dump(arr, datafile)
 
+    # http://clang.llvm.org/docs/JSONCompilationDatabase.html
+    def write_compdb(self, entries):
+        '''Write compile_commands.json from an iterable of
+        (directory, command, file) tuples. Entries are streamed to a
+        temporary file which then atomically replaces the old database.'''
+        outfilename = os.path.join(self.environment.get_build_dir(), 'compile_commands.json')
+        tempfilename = outfilename + '~'
+        templ = '  {\n    "directory": %s,\n    "command": %s,\n    "file": %s\n  }'
+        with open(tempfilename, 'w', encoding='utf-8') as f:
+            f.write('[')
+            separator = '\n'
+            for directory, command, fname in entries:
+                f.write(separator)
+                f.write(templ % (json.dumps(directory), json.dumps(command), json.dumps(fname)))
+                separator = ',\n'
+            f.write('\n]\n')
+        os.replace(tempfilename, outfilename)
+
     def generate_depmf_install(self, d):
         if self.build.dep_manifest_name is None:
             return
@@ -25,7 +25,7 @@ from ..mesonlib import get_meson_script, get_compiler_for_source, Popen_safe
 from .backends import CleanTrees, InstallData
 from ..build import InvalidArguments
 import os, sys, pickle, re
-import subprocess, shutil
+import shutil
 from collections import OrderedDict
 
 if mesonlib.is_windows():
@@ -40,6 +40,68 @@ else:
 def ninja_quote(text):
     return text.replace(' ', '$ ').replace(':', '$:')
 
+# The same paths and compiler arguments appear in the build statements of
+# many targets (include directories, common flags, libraries), so their
+# quoted forms are remembered instead of being recomputed for every use.
+quoted_paths = {}
+quoted_args = {}
+
+def quote_path(path):
+    try:
+        return quoted_paths[path]
+    except KeyError:
+        pass
+    # This is the only way I could find to make this work on all
+    # platforms including Windows command shell. Slash is a dir separator
+    # on Windows, too, so all characters are unambiguous and, more importantly,
+    # do not require quoting.
+    quoted = ninja_quote(path).replace('\\', '/')
+    quoted_paths[path] = quoted
+    return quoted
+
+def quote_value(value):
+    value = value.replace('\\', '\\\\')
+    if quote_char == '"':
+        value = value.replace('"', '\\"')
+    return ninja_quote(value)
+
+def quote_arg(arg):
+    try:
+        return quoted_args[arg]
+    except KeyError:
+        pass
+    if arg == '&&': # Hackety hack hack
+        quoted = arg
+    else:
+        quoted = quote_char + quote_value(arg) + quote_char
+    quoted_args[arg] = quoted
+    return quoted
+
+ninja_var_regex = re.compile(r'\$(\$|:| |\n|\{([a-zA-Z0-9_.-]+)\}|([a-zA-Z0-9_-]+))')
+
+def ninja_expand(text, variables):
+    def replace(match):
+        escaped = match.group(1)
+        if escaped in ('$', ':', ' '):
+            return escaped
+        if escaped == '\n':
+            return ''
+        return variables.get(match.group(2) or match.group(3), '')
+    return ninja_var_regex.sub(replace, text)
+
+shell_unsafe_regex = re.compile(r'[^A-Za-z0-9_+\-./]')
+
+def ninja_shell_escape(path):
+    # Matches how Ninja escapes the paths it substitutes for $in and $out.
+    path = path.replace('\\', '/')
+    if mesonlib.is_windows():
+        if ' ' not in path and '\t' not in path and '"' not in path:
+            return path
+        return '"' + path.replace('"', '\\"') + '"'
+    if not shell_unsafe_regex.search(path):
+        return path
+    return "'" + path.replace("'", "'\\''") + "'"
+
 class RawFilename:
     """
     Used when a filename is already relative to the root build directory, so
@@ -75,6 +137,7 @@ class NinjaBuildElement:
         self.deps = []
         self.orderdeps = []
         self.elems = []
+        self.formatted_items = None
         self.all_outputs = all_outputs
 
     def add_dep(self, dep):
@@ -93,47 +156,46 @@ class NinjaBuildElement:
         if isinstance(elems, str):
             elems = [elems]
         self.elems.append((name, elems))
+        self.formatted_items = None
 
     def write(self, outfile):
         self.check_outputs()
-        line = 'build %s: %s %s' % (
-            ' '.join([ninja_quote(i) for i in self.outfilenames]),
-            self.rule,
-            ' '.join([ninja_quote(i) for i in self.infilenames]))
+        # The whole statement is collected into one list and handed to the
+        # writer with a single call.
+        parts = ['build ', ' '.join([quote_path(i) for i in self.outfilenames]),
+                 ': ', self.rule, ' ', ' '.join([quote_path(i) for i in self.infilenames])]
         if len(self.deps) > 0:
-            line += ' | ' + ' '.join([ninja_quote(x) for x in self.deps])
+            parts += [' | ', ' '.join([quote_path(x) for x in self.deps])]
         if len(self.orderdeps) > 0:
-            line += ' || ' + ' '.join([ninja_quote(x) for x in self.orderdeps])
-        line += '\n'
-        # This is the only way I could find to make this work on all
-        # platforms including Windows command shell. Slash is a dir separator
-        # on Windows, too, so all characters are unambiguous and, more importantly,
-        # do not require quoting.
-        line = line.replace('\\', '/')
-        outfile.write(line)
-
-        for e in self.elems:
-            (name, elems) = e
-            should_quote = True
-            if name == 'DEPFILE' or name == 'DESC' or name == 'pool':
-                should_quote = False
-            line = ' %s = ' % name
-            q_templ = quote_char + "%s" + quote_char
-            noq_templ = "%s"
-            newelems = []
-            for i in elems:
-                if not should_quote or i == '&&': # Hackety hack hack
-                    templ = noq_templ
-                else:
-                    templ = q_templ
-                i = i.replace('\\', '\\\\')
-                if quote_char == '"':
-                    i = i.replace('"', '\\"')
-                newelems.append(templ % ninja_quote(i))
-            line += ' '.join(newelems)
-            line += '\n'
-            outfile.write(line)
-        outfile.write('\n')
+            parts += [' || ', ' '.join([quote_path(x) for x in self.orderdeps])]
+        parts.append('\n')
+        for (name, value) in self.get_formatted_items():
+            parts += [' ', name, ' = ', value, '\n']
+        parts.append('\n')
+        outfile.write(''.join(parts))
+
+    def get_formatted_items(self):
+        if self.formatted_items is None:
+            self.formatted_items = [(name, self.format_item(name, elems)) for (name, elems) in self.elems]
+        return self.formatted_items
+
+    @staticmethod
+    def format_item(name, elems):
+        if name == 'DEPFILE' or name == 'DESC' or name == 'pool':
+            return ' '.join([quote_value(i) for i in elems])
+        return ' '.join([quote_arg(i) for i in elems])
+
+    def evaluate_command(self, command):
+        """
+        Expand a rule's command line for this build statement the same
+        way Ninja would when running it.
+        """
+        variables = {}
+        for (name, value) in self.get_formatted_items():
+            variables[name] = ninja_expand(value, {})
+        variables['in'] = ' '.join([ninja_shell_escape(i) for i in self.infilenames])
+        variables['out'] = ' '.join([ninja_shell_escape(i) for i in self.outfilenames])
+        return ninja_expand(command, variables)
 
     def check_outputs(self):
         for n in self.outfilenames:
@@ -150,6 +212,8 @@ class NinjaBackend(backends.Backend):
         self.target_arg_cache = {}
         self.fortran_deps = {}
         self.all_outputs = {}
+        self.compdb_rules = {}
+        self.compdb_entries = []
 
     def detect_vs_dep_prefix(self, tempfilename):
         '''VS writes its dependency in a locale dependent format.
@@ -205,23 +269,23 @@ int dummy;
             self.generate_utils(outfile)
             self.generate_ending(outfile)
         # Only ovewrite the old build file after the new one has been
-        # fully created.
-        os.replace(tempfilename, outfilename)
+        # fully created. If nothing changed, for instance after an edit to
+        # a comment, the old one is kept and Ninja does not reload it.
+        if not mesonlib.replace_if_different(outfilename, tempfilename):
+            mlog.log('Build definition unchanged, keeping', mlog.bold(self.ninja_filename))
         self.generate_compdb()
 
-    # http://clang.llvm.org/docs/JSONCompilationDatabase.html
+    def add_compdb_entry(self, elem):
+        '''Record the compile command of a build statement that uses one
+        of the compiler rules, in the order it is written out.'''
+        if elem.rule not in self.compdb_rules or len(elem.infilenames) == 0:
+            return
+        command = elem.evaluate_command(self.compdb_rules[elem.rule])
+        self.compdb_entries.append((self.environment.get_build_dir(), command,
+                                    elem.infilenames[0].replace('\\', '/')))
+
     def generate_compdb(self):
-        ninja_exe = environment.detect_ninja()
-        native_compilers = ['%s_COMPILER' % i for i in self.build.compilers]
-        cross_compilers = ['%s_CROSS_COMPILER' % i for i in self.build.cross_compilers]
-        ninja_compdb = [ninja_exe, '-t', 'compdb'] + native_compilers + cross_compilers
-        builddir = self.environment.get_build_dir()
-        try:
-            jsondb = subprocess.check_output(ninja_compdb, cwd=builddir)
-            with open(os.path.join(builddir, 'compile_commands.json'), 'wb') as f:
-                f.write(jsondb)
-        except Exception:
-            mlog.warning('Could not create compilation database.')
+        self.write_compdb(self.compdb_entries)
 
     # Get all generated headers. Any source file might need them so
     # we need to add an order dependency to them.
@@ -445,6 +509,12 @@ int dummy;
             tname = t.get_basename() + t.type_suffix()
             if tname not in self.processed_targets:
                 self.generate_target(t, outfile)
+        # The objects of a unity build are only known once its unity
+        # files have been written.
+        if isinstance(target, build.BuildTarget):
+            for obj in target.get_objects():
+                if isinstance(obj, build.ExtractedObjects):
+                    self.generate_target(obj.target, outfile)
 
     def custom_target_generator_inputs(self, target, outfile):
         for s in target.sources:
@@ -785,7 +855,8 @@ int dummy;
              quote_char + ninja_quote(self.environment.get_build_dir()) + quote_char)
         outfile.write(" command = %s %s %s %s %s %s --backend ninja\n" % c)
         outfile.write(' description = Regenerating build files\n')
-        outfile.write(' generator = 1\n\n')
+        outfile.write(' generator = 1\n')
+        outfile.write(' restat = 1\n\n')
         outfile.write('\n')
 
     def generate_phony(self, outfile):
@@ -877,6 +948,7 @@ int dummy;
         elem.add_dep(deps)
         elem.add_item('ARGS', commands)
         elem.write(outfile)
+        self.add_compdb_entry(elem)
 
     def generate_single_java_compile(self, src, target, compiler, outfile):
         args = []
@@ -894,6 +966,7 @@ int dummy;
         element = NinjaBuildElement(self.all_outputs, rel_obj, compiler.get_language() + '_COMPILER', rel_src)
         element.add_item('ARGS', args)
         element.write(outfile)
+        self.add_compdb_entry(element)
         return plain_class_path
 
     def generate_java_link(self, outfile):
@@ -1071,6 +1144,7 @@ int dummy;
         element.add_item('ARGS', args)
         element.add_dep(extra_dep_files)
         element.write(outfile)
+        self.add_compdb_entry(element)
         return other_src[0], other_src[1], vala_c_src
 
     def generate_rust_target(self, target, outfile):
@@ -1110,6 +1184,7 @@ int dummy;
         element.add_item('targetdep', depfile)
         element.add_item('cratetype', cratetype)
         element.write(outfile)
+        self.add_compdb_entry(element)
 
     def swift_module_file_name(self, target):
         return os.path.join(self.get_target_private_dir(target),
@@ -1206,6 +1281,7 @@ int dummy;
         elem.add_item('ARGS', compile_args + header_imports + abs_generated + module_includes)
         elem.add_item('RUNDIR', rundir)
         elem.write(outfile)
+        self.add_compdb_entry(elem)
         elem = NinjaBuildElement(self.all_outputs, out_module_name,
                                  'swift_COMPILER',
                                  abssrc)
@@ -1213,6 +1289,7 @@ int dummy;
         elem.add_item('ARGS', compile_args + abs_generated + module_includes + swiftc.get_mod_gen_args())
         elem.add_item('RUNDIR', rundir)
         elem.write(outfile)
+        self.add_compdb_entry(elem)
         if isinstance(target, build.StaticLibrary):
             elem = self.generate_link(target, outfile, self.get_target_filename(target),
                                       rel_objects, self.build.static_linker)
@@ -1331,6 +1408,7 @@ int dummy;
     def generate_java_compile_rule(self, compiler, outfile):
         rule = 'rule %s_COMPILER\n' % compiler.get_language()
         invoc = ' '.join([ninja_quote(i) for i in compiler.get_exelist()])
+        self.compdb_rules[compiler.get_language() + '_COMPILER'] = '%s $ARGS $in' % invoc
         command = ' command = %s $ARGS $in\n' % invoc
         description = ' description = Compiling Java object $in.\n'
         outfile.write(rule)
@@ -1341,6 +1419,7 @@ int dummy;
     def generate_cs_compile_rule(self, compiler, outfile):
         rule = 'rule %s_COMPILER\n' % compiler.get_language()
         invoc = ' '.join([ninja_quote(i) for i in compiler.get_exelist()])
+        self.compdb_rules[compiler.get_language() + '_COMPILER'] = '%s $ARGS $in' % invoc
         command = ' command = %s $ARGS $in\n' % invoc
         description = ' description = Compiling cs target $out.\n'
         outfile.write(rule)
@@ -1351,6 +1430,7 @@ int dummy;
     def generate_vala_compile_rules(self, compiler, outfile):
         rule = 'rule %s_COMPILER\n' % compiler.get_language()
         invoc = ' '.join([ninja_quote(i) for i in compiler.get_exelist()])
+        self.compdb_rules[compiler.get_language() + '_COMPILER'] = '%s $ARGS $in' % invoc
         command = ' command = %s $ARGS $in\n' % invoc
         description = ' description = Compiling Vala source $in.\n'
         restat = ' restat = 1\n' # ValaC does this always to take advantage of it.
@@ -1363,6 +1443,7 @@ int dummy;
     def generate_rust_compile_rules(self, compiler, outfile):
         rule = 'rule %s_COMPILER\n' % compiler.get_language()
         invoc = ' '.join([ninja_quote(i) for i in compiler.get_exelist()])
+        self.compdb_rules[compiler.get_language() + '_COMPILER'] = '%s $ARGS $in' % invoc
         command = ' command = %s $ARGS $in\n' % invoc
         description = ' description = Compiling Rust source $in.\n'
         depfile = ' depfile = $targetdep\n'
@@ -1383,6 +1464,7 @@ int dummy;
                     'dirchanger',
                     '$RUNDIR'] + compiler.get_exelist()
         invoc = ' '.join([ninja_quote(i) for i in full_exe])
+        self.compdb_rules[compiler.get_language() + '_COMPILER'] = '%s $ARGS $in' % invoc
         command = ' command = %s $ARGS $in\n' % invoc
         description = ' description = Compiling Swift source $in.\n'
         outfile.write(rule)
@@ -1479,13 +1561,18 @@ rule FORTRAN_DEP_HACK
 '''
         else:
             command_template = ' command = {executable} {cross_args} $ARGS {dep_args} {output_args} {compile_only_args} $in\n'
-        command = command_template.format(
+        command_args = dict(
             executable=' '.join([ninja_quote(i) for i in compiler.get_exelist()]),
             cross_args=' '.join(cross_args),
             dep_args=' '.join(quoted_depargs),
             output_args=' '.join(compiler.get_output_args('$out')),
             compile_only_args=' '.join(compiler.get_compile_only_args())
         )
+        command = command_template.format(**command_args)
+        # The compilation database gets the full command line even when
+        # Ninja passes the arguments through a response file.
+        compdb_template = '{executable} {cross_args} $ARGS {dep_args} {output_args} {compile_only_args} $in'
+        self.compdb_rules['%s%s_COMPILER' % (langname, crstr)] = compdb_template.format(**command_args)
         description = ' description = Compiling %s object $out\n' % langname
         if compiler.get_id() == 'msvc':
             deps = ' deps = msvc\n'
@@ -1883,29 +1970,36 @@ rule FORTRAN_DEP_HACK
         # Finally add the private dir for the target to the include path. This
         # must override everything else and must be the final path added.
         commands += compiler.get_include_args(self.get_target_private_dir(target), False)
+        # Add MSVC debug file generation compile flags: /Fd /FS
+        # With PCH these point to the target PDB and are the same for all
+        # sources, otherwise they are added per-object by the caller.
+        if target.has_pch():
+            commands += self.get_compile_debugfile_args(compiler, target, None)
+        # PCH handling
+        if self.environment.coredata.base_options.get('b_pch', False):
+            commands += self.get_pch_include_args(compiler, target)
+        if compiler.get_language() == 'fortran':
+            commands += compiler.get_module_outdir_args(self.get_target_private_dir(target))
         return commands
 
     def generate_single_compile(self, target, outfile, src, is_generated=False, header_deps=[], order_deps=[]):
         """
         Compiles C/C++, ObjC/ObjC++, Fortran, and D sources
         """
-        if isinstance(src, str) and src.endswith('.h'):
-            raise AssertionError('BUG: sources should not contain headers {!r}'.format(src))
-        if isinstance(src, RawFilename) and src.fname.endswith('.h'):
-            raise AssertionError('BUG: sources should not contain headers {!r}'.format(src.fname))
-
         if isinstance(src, str) and src.endswith('.h'):
             raise AssertionError('BUG: sources should not contain headers {!r}'.format(src))
         if isinstance(src, RawFilename) and src.fname.endswith('.h'):
             raise AssertionError('BUG: sources should not contain headers {!r}'.format(src.fname))
         compiler = get_compiler_for_source(target.compilers.values(), src)
+        # All arguments that do not depend on the source file are computed,
+        # de-duplicated and converted to the native form of the compiler once
+        # per target and compiler. The cached list is shared by all sources,
+        # so it must not be mutated.
         key = (target, compiler, is_generated)
-        if key in self.target_arg_cache:
-            commands = self.target_arg_cache[key]
-        else:
+        if key not in self.target_arg_cache:
             commands = self._generate_single_compile(target, compiler, is_generated)
-            self.target_arg_cache[key] = commands
-        commands = CompilerArgs(commands.compiler, commands)
+            self.target_arg_cache[key] = commands.to_native()
+        commands = self.target_arg_cache[key]
 
         # FIXME: This file handling is atrocious and broken. We need to
         # replace it with File objects used consistently everywhere.
@@ -1939,11 +2033,13 @@ rule FORTRAN_DEP_HACK
         dep_file = compiler.depfile_for_object(rel_obj)
 
         # Add MSVC debug file generation compile flags: /Fd /FS
-        commands += self.get_compile_debugfile_args(compiler, target, rel_obj)
+        if not target.has_pch():
+            debug_args = self.get_compile_debugfile_args(compiler, target, rel_obj)
+            if debug_args:
+                commands = commands + compiler.unix_args_to_native(debug_args)
 
         # PCH handling
         if self.environment.coredata.base_options.get('b_pch', False):
-            commands += self.get_pch_include_args(compiler, target)
             pchlist = target.get_pch(compiler.language)
         else:
             pchlist = []
@@ -1977,7 +2073,6 @@ rule FORTRAN_DEP_HACK
                 if srcfile == src:
                     depelem = NinjaBuildElement(self.all_outputs, modfile, 'FORTRAN_DEP_HACK', rel_obj)
                     depelem.write(outfile)
-            commands += compiler.get_module_outdir_args(self.get_target_private_dir(target))
 
         element = NinjaBuildElement(self.all_outputs, rel_obj, compiler_name, rel_src)
         for d in header_deps:
@@ -1995,14 +2090,12 @@ rule FORTRAN_DEP_HACK
                 d = os.path.join(self.get_target_private_dir(target), d)
             element.add_orderdep(d)
         element.add_orderdep(pch_dep)
-        # Convert from GCC-style link argument naming to the naming used by the
-        # current compiler.
-        commands = commands.to_native()
         for i in self.get_fortran_orderdeps(target, compiler):
             element.add_orderdep(i)
         element.add_item('DEPFILE', dep_file)
         element.add_item('ARGS', commands)
         element.write(outfile)
+        self.add_compdb_entry(element)
         return rel_obj
 
     def has_dir_part(self, fname):
@@ -14,6 +14,7 @@
 
 import os, sys
 import pickle
+import subprocess
 import xml.dom.minidom
 import xml.etree.ElementTree as ET
 
@@ -86,6 +87,7 @@ class Vs2010Backend(backends.Backend):
         self.platform_toolset = None
         self.vs_version = '2010'
         self.windows_target_platform_version = None
+        self.compdb_entries = []
 
     def object_filename_from_source(self, target, source, is_unity=False):
         basename = os.path.basename(source.fname)
@@ -183,6 +185,7 @@ class Vs2010Backend(backends.Backend):
         self.gen_testproj('RUN_TESTS', os.path.join(self.environment.get_build_dir(), 'RUN_TESTS.vcxproj'))
         self.gen_regenproj('REGEN', os.path.join(self.environment.get_build_dir(), 'REGEN.vcxproj'))
         self.generate_solution(sln_filename, projlist)
+        self.write_compdb(self.compdb_entries)
         self.generate_regen_info()
         Vs2010Backend.touch_regen_timestamp(self.environment.get_build_dir())
 
@@ -496,6 +499,12 @@ class Vs2010Backend(backends.Backend):
         dirs = file_inc_dirs[lang]
         ET.SubElement(parent_node, "AdditionalIncludeDirectories").text = ';'.join(dirs)
 
+    def add_compdb_entry(self, directory, compdb_args, lang, src):
+        if lang not in compdb_args:
+            return
+        command = subprocess.list2cmdline(compdb_args[lang] + ['/c', src])
+        self.compdb_entries.append((directory, command, src))
+
     @staticmethod
     def has_objects(objects, additional_objects, generated_objects):
         # Ignore generated objects, those are automatically used by MSBuild because they are part of
@@ -970,6 +979,17 @@ class Vs2010Backend(backends.Backend):
                 relpath = os.path.join(proj_to_src_dir, h)
                 ET.SubElement(inc_hdrs, 'CLInclude', Include=relpath)
 
+        # Equivalent cl command lines for the compilation database, relative
+        # to the directory of the vcxproj like everything else in it.
+        compdb_dir = os.path.join(self.environment.get_build_dir(), self.get_target_dir(target))
+        compdb_args = {}
+        for lang, args in file_args.items():
+            cmd = target.compilers[lang].get_exelist() + buildtype_args
+            cmd += [a for a in args.to_native() + target_args if not a.startswith('%(')]
+            cmd += ['/D' + d for d in target_defines + file_defines[lang] if not d.startswith('%(')]
+            cmd += ['/I' + i for i in target_inc_dirs + file_inc_dirs[lang] if not i.startswith('%(')]
+            compdb_args[lang] = cmd
+
         if len(sources) + len(gen_src) + len(pch_sources) > 0:
             inc_src = ET.SubElement(root, 'ItemGroup')
             for s in sources:
@@ -983,6 +1003,7 @@ class Vs2010Backend(backends.Backend):
                 basename = os.path.basename(s.fname)
                 if basename in self.sources_conflicts[target.get_id()]:
                     ET.SubElement(inc_cl, 'ObjectFileName').text = "$(IntDir)" + self.object_filename_from_source(target, s)
+                self.add_compdb_entry(compdb_dir, compdb_args, lang, relpath)
             for s in gen_src:
                 inc_cl = ET.SubElement(inc_src, 'CLCompile', Include=s)
                 lang = Vs2010Backend.lang_from_source_file(s)
@@ -990,6 +1011,7 @@ class Vs2010Backend(backends.Backend):
                 self.add_additional_options(lang, inc_cl, file_args)
                 self.add_preprocessor_defines(lang, inc_cl, file_defines)
                 self.add_include_dirs(lang, inc_cl, file_inc_dirs)
+                self.add_compdb_entry(compdb_dir, compdb_args, lang, s)
             for lang in pch_sources:
                 header, impl, suffix = pch_sources[lang]
                 relpath = os.path.join(proj_to_src_dir, impl)
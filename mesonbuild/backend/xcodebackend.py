@@ -15,7 +15,7 @@
 from . import backends
 from .. import build
 from .. import mesonlib
-import uuid, os, sys
+import uuid, os, sys, shlex
 
 from ..mesonlib import MesonException
 
@@ -50,6 +50,7 @@ class XCodeBackend(backends.Backend):
         self.test_id = self.gen_id()
         self.test_command_id = self.gen_id()
         self.test_buildconf_id = self.gen_id()
+        self.compdb_entries = []
 
     def gen_id(self):
         return str(uuid.uuid4()).upper().replace('-', '')[:24]
@@ -100,6 +101,7 @@ class XCodeBackend(backends.Backend):
             self.generate_xc_build_configuration()
             self.generate_xc_configurationList()
             self.generate_suffix()
+        self.write_compdb(self.compdb_entries)
 
     def get_xcodetype(self, fname):
         return self.xcodetypemap[fname.split('.')[-1]]
@@ -652,6 +654,8 @@ class XCodeBackend(backends.Backend):
                     args = gargs + targs
                     if len(args) > 0:
                         langargs[langnamemap[lang]] = args
+                if buildtype == self.buildtypes[0]:
+                    self.add_compdb_entries(target, headerdirs)
                 symroot = os.path.join(self.environment.get_build_dir(), target.subdir)
                 self.write_line('%s /* %s */ = {' % (valid, buildtype))
                 self.indent_level += 1
@@ -696,6 +700,25 @@ class XCodeBackend(backends.Backend):
                 self.write_line('};')
         self.ofile.write('/* End XCBuildConfiguration section */\n')
 
+    def add_compdb_entries(self, target, headerdirs):
+        # The same flags as written to HEADER_SEARCH_PATHS and OTHER_*FLAGS
+        # above, with absolute paths so the directory does not matter.
+        srcdir = self.environment.get_source_dir()
+        builddir = self.environment.get_build_dir()
+        for s in target.sources:
+            if not isinstance(s, mesonlib.File):
+                continue
+            for lang, compiler in target.compilers.items():
+                if compiler.can_compile(s):
+                    break
+            else:
+                continue
+            src = s.absolute_path(srcdir, builddir)
+            cmd = compiler.get_exelist() + ['-I' + i for i in headerdirs]
+            cmd += self.build.global_args.get(lang, []) + target.get_extra_args(lang)
+            cmd += ['-c', src]
+            self.compdb_entries.append((builddir, ' '.join([shlex.quote(i) for i in cmd]), src))
+
     def generate_xc_configurationList(self):
         self.ofile.write('\n/* Begin XCConfigurationList section */\n')
         self.write_line('%s /* Build configuration list for PBXProject "%s" */ = {' % (self.project_conflist, self.build.project_name))
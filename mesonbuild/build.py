@@ -15,6 +15,7 @@
 import copy, os, re
 from collections import OrderedDict
 
+from . import coredata
 from . import environment
 from . import dependencies
 from . import mlog
@@ -73,10 +74,19 @@ known_lib_kwargs.update({'version': True, # Only for shared libs
 class InvalidArguments(MesonException):
     pass
 
-class Build:
+class Build(coredata.SectionedData):
     """A class that holds the status of one build including
     all dependencies and so on.
     """
+    # Test setups come first so that mesontest can read them without
+    # loading anything else.
+    data_sections = (('test_setups', ('test_setups',)),
+                     ('environment', ('environment',)),
+                     ('targets', ('targets',)),
+                     ('tests', ('tests', 'benchmarks')),
+                     ('install', ('headers', 'man', 'data', 'install_scripts',
+                                  'install_dirs')))
+    default_section = 'project'
 
     def __init__(self, environment):
         self.project_name = 'name of master project'
@@ -1583,3 +1593,9 @@ def get_sources_string_names(sources):
         else:
             raise AssertionError('Unknown source type: {!r}'.format(s))
     return names
+
+def load(filename):
+    return coredata.load_sections(Build, filename)
+
+def save(obj, filename):
+    coredata.save_sections(obj, filename)
@@ -16,6 +16,9 @@ import shutil
 import contextlib
 import subprocess, os.path
 import tempfile
+import hashlib
+import pickle
+import threading
 from .import mesonlib
 from . import mlog
 from .mesonlib import EnvironmentException, MesonException, version_compare, Popen_safe
@@ -339,6 +342,104 @@ class RunResult:
         self.stdout = stdout
         self.stderr = stderr
 
+class CachedCompileResult:
+    '''
+    Stand-in for the process object yielded by Compiler.compile() when a check
+    is answered from the CompilerCheckCache. Only the fields that the checks
+    inspect are stored; there is no input or output file.
+    '''
+    def __init__(self, returncode, stdo, stde):
+        self.returncode = returncode
+        self.stdo = stdo
+        self.stde = stde
+        self.input_name = None
+        self.output_name = None
+
+class CompilerCheckCache:
+    '''
+    Persistent store of compiler check results, kept in the private directory
+    of the build tree so that reconfiguring does not have to spawn the compiler
+    again for checks that have already been answered.
+
+    Results are content-addressed: the key is a hash of the compiler (exelist
+    and version), the code that was checked, the full argument list and the
+    mode. Anything that can change the outcome without changing one of those
+    (for instance installing a new header in a system directory) is not
+    noticed, which is why the cache can be cleared with --clear-check-cache.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.results = {}
+        self.hits = 0
+        self.misses = 0
+        # Checks may be run from several threads at once, see
+        # CompilerHolder.run_checks()
+        self.lock = threading.Lock()
+        self.load()
+
+    def __getstate__(self):
+        # The environment, and us with it, gets pickled into build.dat
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                obj = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except (EOFError, AttributeError, pickle.UnpicklingError):
+            mlog.debug('Compiler check cache {!r} is corrupted, ignoring it.'.format(self.filename))
+            return
+        # Results recorded by a different Meson version may have been produced
+        # by different check code, so they are never reused.
+        if isinstance(obj, tuple) and len(obj) == 2 and obj[0] == coredata.version:
+            self.results = obj[1]
+
+    def save(self):
+        tmpname = self.filename + '~'
+        with open(tmpname, 'wb') as f:
+            pickle.dump((coredata.version, self.results), f)
+        os.replace(tmpname, self.filename)
+
+    def clear(self):
+        self.results = {}
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    @staticmethod
+    def make_key(compiler, code, args, mode):
+        if isinstance(code, mesonlib.File):
+            # The file is compiled in place, so both its location and its
+            # contents matter.
+            with open(code.fname, 'rb') as f:
+                code = (code.fname, hashlib.sha256(f.read()).hexdigest())
+        ident = (compiler.exelist, compiler.version, code, list(args), mode)
+        return hashlib.sha256(repr(ident).encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        with self.lock:
+            try:
+                result = self.results[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return result
+
+    def store(self, key, result):
+        with self.lock:
+            self.results[key] = result
+
+# Placeholder for arguments that were removed again while adding arguments to
+# a CompilerArgs
+_removed = object()
+
 class CompilerArgs(list):
     '''
     Class derived from list() that manages a list of compiler arguments. Should
@@ -456,11 +557,27 @@ class CompilerArgs(list):
         '''
         Add two CompilerArgs while taking into account overriding of arguments
         and while preserving the order of arguments as much as possible
+
+        This runs in time linear in the length of both lists: membership is
+        tracked in dicts and sets instead of searching the lists, and the
+        result is assembled in a single pass at the end.
         '''
-        pre = []
-        post = []
         if not isinstance(args, list):
             raise TypeError('can only concatenate list (not "{}") to list'.format(args))
+        pre = []
+        post = []
+        # Position in pre or post of the one live occurrence of every
+        # de-dupable (dedup == 2) argument that has been added so far.
+        # Removing it from there leaves a _removed placeholder behind.
+        positions = {}
+        # Arguments that may only be present once (dedup == 1) that have been
+        # added to pre or post
+        added = set()
+        # Set of our own arguments, only computed when needed
+        existing = None
+        # For every dedup == 2 argument, how many of its first occurrences
+        # must be removed from our own arguments
+        to_remove = {}
         for arg in args:
             # If the argument can be de-duped, do it either by removing the
             # previous occurance of it and adding a new one, or not adding the
@@ -468,24 +585,38 @@ class CompilerArgs(list):
             dedup = self._can_dedup(arg)
             if dedup == 1:
                 # Argument already exists and adding a new instance is useless
-                if arg in self or arg in pre or arg in post:
+                if existing is None:
+                    existing = set(self)
+                if arg in existing or arg in added:
                     continue
-            if dedup == 2:
+                added.add(arg)
+            elif dedup == 2:
                 # Remove all previous occurances of the arg and add it anew
-                if arg in self:
-                    self.remove(arg)
-                if arg in pre:
-                    pre.remove(arg)
-                if arg in post:
-                    post.remove(arg)
+                to_remove[arg] = to_remove.get(arg, 0) + 1
+                if arg in positions:
+                    l, i = positions[arg]
+                    l[i] = _removed
             if self._should_prepend(arg):
-                pre.append(arg)
+                l = pre
             else:
-                post.append(arg)
-        # Insert at the beginning
-        self[:0] = pre
-        # Append to the end
-        super().__iadd__(post)
+                l = post
+            if dedup == 2:
+                positions[arg] = (l, len(l))
+            l.append(arg)
+        if not to_remove and not pre:
+            # Nothing to remove and nothing to insert at the beginning
+            super().__iadd__(post)
+            return self
+        kept = []
+        for arg in self:
+            count = to_remove.get(arg)
+            if count:
+                to_remove[arg] = count - 1
+                continue
+            kept.append(arg)
+        # Insert at the beginning and append to the end
+        self[:] = [a for a in pre if a is not _removed] + kept + \
+            [a for a in post if a is not _removed]
         return self
 
     def __radd__(self, args):
@@ -690,6 +821,32 @@ class Compiler:
             # catch OSError because the directory is then no longer empty.
             pass
 
+    @contextlib.contextmanager
+    def cached_compile(self, code, env, extra_args=None, mode='link'):
+        '''
+        Like compile(), but answers from the compiler check cache of the
+        environment when possible. Only for checks that look at the return
+        code and output of the compiler, never at the files it produced.
+        '''
+        if extra_args is None:
+            extra_args = []
+        cache = getattr(env, 'check_cache', None)
+        if cache is None:
+            with self.compile(code, extra_args, mode) as p:
+                yield p
+            return
+        key = cache.make_key(self, code, extra_args, mode)
+        result = cache.lookup(key)
+        if result is not None:
+            mlog.debug('Using cached compile result {}:'.format(key))
+            mlog.debug('Code:\n', code)
+            mlog.debug('Cached return code:', result.returncode)
+            yield result
+            return
+        with self.compile(code, extra_args, mode) as p:
+            cache.store(key, CachedCompileResult(p.returncode, p.stdo, p.stde))
+            yield p
+
     def get_colorout_args(self, colortype):
         return []
 
@@ -970,7 +1127,7 @@ class CCompiler(Compiler):
     def compiles(self, code, env, extra_args=None, dependencies=None, mode='compile'):
         args = self._get_compiler_check_args(env, extra_args, dependencies, mode)
         # We only want to compile; not link
-        with self.compile(code, args.to_native(), mode) as p:
+        with self.cached_compile(code, env, args.to_native(), mode) as p:
             return p.returncode == 0
 
     def _links_wrapper(self, code, env, extra_args, dependencies):
@@ -979,7 +1136,8 @@ class CCompiler(Compiler):
         return self.compile(code, args.to_native())
 
     def links(self, code, env, extra_args=None, dependencies=None):
-        with self._links_wrapper(code, env, extra_args, dependencies) as p:
+        args = self._get_compiler_check_args(env, extra_args, dependencies, mode='link')
+        with self.cached_compile(code, env, args.to_native()) as p:
             return p.returncode == 0
 
     def run(self, code, env, extra_args=None, dependencies=None):
@@ -1007,6 +1165,32 @@ class CCompiler(Compiler):
         mlog.debug(se)
         return RunResult(True, pe.returncode, so, se)
 
+    def _cached_run(self, code, env, extra_args, dependencies):
+        '''
+        Like run(), but answers from the compiler check cache when possible.
+        Only used for our own check programs (sizeof, alignment, compute_int)
+        that print a property of the toolchain and nothing else. Arbitrary
+        user code passed to run() may depend on anything, so it is never
+        cached.
+        '''
+        cache = getattr(env, 'check_cache', None)
+        if cache is None:
+            return self.run(code, env, extra_args, dependencies)
+        args = self._get_compiler_check_args(env, extra_args, dependencies, mode='link')
+        key = cache.make_key(self, code, args.to_native() + (self.exe_wrapper or []), 'run')
+        res = cache.lookup(key)
+        if res is not None:
+            mlog.debug('Using cached run result {}:'.format(key))
+            mlog.debug('Code:\n', code)
+            mlog.debug('Cached program stdout:\n', res.stdout)
+            return res
+        res = self.run(code, env, extra_args, dependencies)
+        # Failures to compile or run are not recorded so that they are
+        # retried and diagnosed in the log the next time around.
+        if res.compiled and res.returncode == 0:
+            cache.store(key, res)
+        return res
+
     def _compile_int(self, expression, prefix, env, extra_args, dependencies):
         fargs = {'prefix': prefix, 'expression': expression}
         t = '''#include <stdio.h>
@@ -1046,7 +1230,7 @@ class CCompiler(Compiler):
             printf("%ld\\n", (long)({expression}));
             return 0;
         }};'''
-        res = self.run(t.format(**fargs), env, extra_args, dependencies)
+        res = self._cached_run(t.format(**fargs), env, extra_args, dependencies)
         if not res.compiled:
             return -1
         if res.returncode != 0:
@@ -1078,7 +1262,7 @@ class CCompiler(Compiler):
             printf("%ld\\n", (long)(sizeof({type})));
             return 0;
         }};'''
-        res = self.run(t.format(**fargs), env, extra_args, dependencies)
+        res = self._cached_run(t.format(**fargs), env, extra_args, dependencies)
         if not res.compiled:
             return -1
         if res.returncode != 0:
@@ -1121,7 +1305,7 @@ class CCompiler(Compiler):
             printf("%d", (int)offsetof(struct tmp, target));
             return 0;
         }}'''
-        res = self.run(t.format(**fargs), env, extra_args, dependencies)
+        res = self._cached_run(t.format(**fargs), env, extra_args, dependencies)
         if not res.compiled:
             raise EnvironmentException('Could not compile alignment test.')
         if res.returncode != 0:
@@ -1142,7 +1326,7 @@ class CCompiler(Compiler):
         {delim}\n{define}'''
         args = self._get_compiler_check_args(env, extra_args, dependencies,
                                              mode='preprocess').to_native()
-        with self.compile(code.format(**fargs), args, 'preprocess') as p:
+        with self.cached_compile(code.format(**fargs), env, args, 'preprocess') as p:
             if p.returncode != 0:
                 raise EnvironmentException('Could not get define {!r}'.format(dname))
         # Get the preprocessed value after the delimiter,
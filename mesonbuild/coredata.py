@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import pickle, os, uuid
+import pickle, os, uuid, io, struct
 from pathlib import PurePath
 from collections import OrderedDict
 from .mesonlib import MesonException, commonpath
@@ -22,6 +22,180 @@ import ast
 version = '0.40.0.dev1'
 backendlist = ['ninja', 'vs', 'vs2010', 'vs2015', 'vs2017', 'xcode']
 
+# coredata.dat and build.dat start with this magic line followed by the
+# length of a pickled header and the header itself. The header lists the
+# sections of the file, each of which is a separate pickle, so that tools
+# which only need a few fields do not have to unpickle everything.
+data_file_magic = b'MESON-DATA\n'
+data_file_format = 1
+data_file_header = struct.Struct('<Q')
+
+def data_load_fail_msg(filename):
+    return 'Data file {!r} is corrupted. Try with a fresh build tree.'.format(filename)
+
+def data_version_fail_msg(file_version):
+    return 'Build directory has been generated with Meson version %s, which is incompatible with current version %s.\nPlease delete this build directory AND create a new one.' % (file_version, version)
+
+class SectionPickler(pickle.Pickler):
+    '''
+    Pickles one section of a data file. Objects that were already stored in
+    an earlier section are written as references to that section so that
+    object identity is preserved when the sections are loaded again.
+    '''
+    def __init__(self, file, earlier):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.earlier = earlier
+
+    def persistent_id(self, obj):
+        # Builtin values are cheap to duplicate and referencing them would
+        # make every section depend on all the ones before it.
+        if isinstance(obj, type) or type(obj).__module__ == 'builtins':
+            return None
+        entry = self.earlier.get(id(obj))
+        if entry is None or entry[0] is not obj:
+            return None
+        return entry[1]
+
+class SectionUnpickler(pickle.Unpickler):
+    def __init__(self, file, reader):
+        super().__init__(file)
+        self.reader = reader
+
+    def persistent_load(self, pid):
+        (section, index) = pid
+        return self.reader.get_memo(section)[index]
+
+class DataFileReader:
+    '''
+    Reads the header of a sectioned data file and unpickles the sections on
+    demand, loading the sections they refer to as needed.
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, 'rb') as f:
+                if f.read(len(data_file_magic)) != data_file_magic:
+                    raise MesonException(data_load_fail_msg(filename))
+                (size,) = data_file_header.unpack(f.read(data_file_header.size))
+                header = pickle.loads(f.read(size))
+                offset = f.tell()
+        except (pickle.UnpicklingError, struct.error, EOFError):
+            raise MesonException(data_load_fail_msg(filename))
+        if header.get('format') != data_file_format:
+            raise MesonException(data_load_fail_msg(filename))
+        if header['version'] != version:
+            raise MesonException(data_version_fail_msg(header['version']))
+        self.class_name = header['class']
+        self.sections = OrderedDict()
+        for (name, size) in header['sections']:
+            self.sections[name] = (offset, size)
+            offset += size
+        self.loaded = {}
+
+    def load(self, section):
+        if section in self.loaded:
+            return self.loaded[section][0]
+        if section not in self.sections:
+            raise MesonException(data_load_fail_msg(self.filename))
+        (offset, size) = self.sections[section]
+        with open(self.filename, 'rb') as f:
+            f.seek(offset)
+            blob = f.read(size)
+        unpickler = SectionUnpickler(io.BytesIO(blob), self)
+        try:
+            attrs = unpickler.load()
+        except (pickle.UnpicklingError, EOFError):
+            raise MesonException(data_load_fail_msg(self.filename))
+        self.loaded[section] = (attrs, unpickler.memo.copy())
+        return attrs
+
+    def get_memo(self, section):
+        self.load(section)
+        return self.loaded[section][1]
+
+class SectionedData:
+    '''
+    Base class for objects that are saved with save_sections(). After
+    load_sections() the attributes of each section are unpickled the first
+    time one of them is accessed.
+    '''
+    # Tuples of (section name, attribute names) in the order they are
+    # stored. Attributes not listed here go to the default section, which
+    # is stored last.
+    data_sections = ()
+    default_section = 'core'
+
+    def __getattr__(self, name):
+        reader = self.__dict__.get('_data_reader')
+        if reader is None or name.startswith('__'):
+            raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+        # The section may already have been loaded because another section
+        # refers to it, so always merge it in.
+        attrs = reader.load(self.get_data_section(name))
+        if name in attrs:
+            for (key, value) in attrs.items():
+                self.__dict__.setdefault(key, value)
+            return self.__dict__[name]
+        raise AttributeError("'{}' object has no attribute '{}'".format(type(self).__name__, name))
+
+    @classmethod
+    def get_data_section(cls, name):
+        for (section, attrs) in cls.data_sections:
+            if name in attrs:
+                return section
+        return cls.default_section
+
+    def load_all_sections(self):
+        reader = self.__dict__.pop('_data_reader', None)
+        if reader is None:
+            return
+        for section in reader.sections:
+            for (key, value) in reader.load(section).items():
+                self.__dict__.setdefault(key, value)
+
+    def __getstate__(self):
+        self.load_all_sections()
+        return self.__dict__.copy()
+
+def save_sections(obj, filename):
+    sections = OrderedDict()
+    for (section, attrs) in obj.data_sections:
+        sections[section] = {}
+    sections[obj.default_section] = {}
+    for (name, value) in obj.__getstate__().items():
+        sections[obj.get_data_section(name)][name] = value
+    earlier = {}
+    blobs = []
+    for (section, attrs) in sections.items():
+        buf = io.BytesIO()
+        pickler = SectionPickler(buf, earlier)
+        pickler.dump(attrs)
+        # The objects are kept alive along with their references, ids of
+        # objects that have been freed could be reused by unrelated ones.
+        for (key, (index, memo_obj)) in pickler.memo.copy().items():
+            earlier.setdefault(key, (memo_obj, (section, index)))
+        blobs.append((section, buf.getvalue()))
+    header = pickle.dumps({'format': data_file_format,
+                           'version': version,
+                           'class': type(obj).__name__,
+                           'sections': [(section, len(blob)) for (section, blob) in blobs]})
+    tempfilename = filename + '~'
+    with open(tempfilename, 'wb') as f:
+        f.write(data_file_magic)
+        f.write(data_file_header.pack(len(header)))
+        f.write(header)
+        for (_, blob) in blobs:
+            f.write(blob)
+    os.replace(tempfilename, filename)
+
+def load_sections(cls, filename):
+    reader = DataFileReader(filename)
+    if reader.class_name != cls.__name__:
+        raise MesonException(data_load_fail_msg(filename))
+    obj = cls.__new__(cls)
+    obj.__dict__['_data_reader'] = reader
+    return obj
+
 class UserOption:
     def __init__(self, name, description, choices):
         super().__init__()
@@ -85,6 +259,39 @@ class UserBooleanOption(UserOption):
     def validate_value(self, value):
         return self.tobool(value)
 
+class UserIntegerOption(UserOption):
+    def __init__(self, name, description, min_value, max_value, value):
+        super().__init__(name, description, None)
+        self.min_value = min_value
+        self.max_value = max_value
+        self.set_value(value)
+
+    def toint(self, valuestring):
+        try:
+            return int(valuestring)
+        except ValueError:
+            raise MesonException('Value "%s" for integer option "%s" is not an integer.' % (valuestring, self.name))
+
+    def validate(self, value):
+        if isinstance(value, str):
+            value = self.toint(value)
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise MesonException('Value "%s" for integer option "%s" is not an integer.' % (str(value), self.name))
+        if self.min_value is not None and value < self.min_value:
+            raise MesonException('Value %d for integer option "%s" is less than the minimum %d.' % (value, self.name, self.min_value))
+        if self.max_value is not None and value > self.max_value:
+            raise MesonException('Value %d for integer option "%s" is more than the maximum %d.' % (value, self.name, self.max_value))
+        return value
+
+    def set_value(self, newvalue):
+        self.value = self.validate(newvalue)
+
+    def parse_string(self, valuestring):
+        return self.toint(valuestring)
+
+    def validate_value(self, value):
+        return self.validate(value)
+
 class UserComboOption(UserOption):
     def __init__(self, name, description, choices, value):
         super().__init__(name, description, choices)
@@ -136,7 +343,12 @@ class UserStringArrayOption(UserOption):
 # invocations of Meson. It is roughly the same thing as
 # cmakecache.
 
-class CoreData:
+class CoreData(SectionedData):
+    data_sections = (('options', ('builtins', 'user_options', 'compiler_options',
+                                  'base_options', 'external_preprocess_args',
+                                  'external_args', 'external_link_args')),
+                     ('compilers', ('compilers', 'cross_compilers')),
+                     ('deps', ('deps',)))
 
     def __init__(self, options):
         self.guid = str(uuid.uuid4()).upper()
@@ -241,24 +453,12 @@ class CoreData:
         raise MesonException('Tried to validate unknown option %s.' % option_name)
 
 def load(filename):
-    load_fail_msg = 'Coredata file {!r} is corrupted. Try with a fresh build tree.'.format(filename)
-    try:
-        with open(filename, 'rb') as f:
-            obj = pickle.load(f)
-    except pickle.UnpicklingError:
-        raise MesonException(load_fail_msg)
-    if not isinstance(obj, CoreData):
-        raise MesonException(load_fail_msg)
-    if obj.version != version:
-        raise MesonException('Build directory has been generated with Meson version %s, which is incompatible with current version %s.\nPlease delete this build directory AND create a new one.' %
-                             (obj.version, version))
-    return obj
+    return load_sections(CoreData, filename)
 
 def save(obj, filename):
     if obj.version != version:
         raise MesonException('Fatal version mismatch corruption.')
-    with open(filename, 'wb') as f:
-        pickle.dump(obj, f)
+    save_sections(obj, filename)
 
 def get_builtin_options():
     return list(builtin_options.keys())
@@ -268,7 +468,7 @@ def is_builtin_option(optname):
 
 def get_builtin_option_choices(optname):
     if is_builtin_option(optname):
-        if builtin_options[optname][0] == UserStringOption:
+        if builtin_options[optname][0] in (UserStringOption, UserIntegerOption):
             return None
         elif builtin_options[optname][0] == UserBooleanOption:
             return [True, False]
@@ -288,6 +488,8 @@ def get_builtin_option_default(optname):
         o = builtin_options[optname]
         if o[0] == UserComboOption:
             return o[3]
+        if o[0] == UserIntegerOption:
+            return o[4]
         return o[2]
     else:
         raise RuntimeError('Tried to get the default value for an unknown builtin option \'%s\'.' % optname)
@@ -296,6 +498,7 @@ builtin_options = {
     'buildtype':  [UserComboOption, 'Build type to use.', ['plain', 'debug', 'debugoptimized', 'release', 'minsize'], 'debug'],
     'strip':      [UserBooleanOption, 'Strip targets on install.', False],
     'unity':      [UserBooleanOption, 'Unity build.', False],
+    'unity_size': [UserIntegerOption, 'Number of sources per unity file, 0 for no limit.', 0, None, 0],
     'prefix':     [UserStringOption, 'Installation prefix.', default_prefix()],
     'libdir':     [UserStringOption, 'Library directory.', default_libdir()],
     'libexecdir': [UserStringOption, 'Library executable directory.', default_libexecdir()],
@@ -22,17 +22,174 @@
 import re
 import sys
 import os, stat, glob, shutil
+import copy
+import hashlib
+import pickle
 import subprocess
 import sysconfig
+import time
 from collections import OrderedDict
 from . mesonlib import MesonException, version_compare, version_compare_many, Popen_safe
 from . import mlog
 from . import mesonlib
+from . import pcresolver
+from . import coredata
 from .environment import detect_cpu_family, for_windows
 
 class DependencyException(MesonException):
     '''Exceptions raised while trying to find dependencies'''
 
+class LookupRecord:
+    '''The files, directories and programs consulted by one dependency lookup.'''
+    def __init__(self):
+        self.files = set()
+        self.cacheable = True
+
+# The record of the lookup find_external_dependency() is currently doing.
+_lookup_record = None
+
+def record_consulted(*paths):
+    '''
+    Notes that the result of the current dependency lookup depends on the
+    given paths. Directories should be recorded when their contents were
+    listed or searched so that adding files to them is noticed.
+    '''
+    if _lookup_record is not None:
+        _lookup_record.files.update(p for p in paths if p)
+
+def record_program(name):
+    '''Notes that the current lookup searched PATH for program name.'''
+    if _lookup_record is None:
+        return
+    path = name if os.path.isabs(name) else shutil.which(name)
+    if path:
+        record_consulted(path)
+    else:
+        # Installing it anywhere in PATH has to be noticed
+        record_consulted(*os.environ.get('PATH', '').split(os.pathsep))
+
+def record_uncacheable():
+    '''The current lookup depends on things that are not recorded.'''
+    if _lookup_record is not None:
+        _lookup_record.cacheable = False
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, st.st_mtime_ns, st.st_size)
+
+class DependencyCache:
+    '''
+    Results of external dependency lookups shared by all build directories
+    of the user, so that configuring a new build directory does not have to
+    run pkg-config, wx-config, qmake etc. or scan the Boost directories again.
+
+    Entries are keyed on the dependency name and keyword arguments and on the
+    environment variables that influence lookups. Each entry carries the
+    modification time and size of every file, directory and program that the
+    lookup consulted, and is only reused while all of them are unchanged.
+    Only dependency classes that record what they consult are cached, and
+    never in cross builds.
+    '''
+    # Environment variables (or prefixes of them) that lookups depend on
+    env_vars = ('PATH', 'PKG_CONFIG', 'BOOST_', 'MESON_PKG_CONFIG')
+    # Entries unused for this long are dropped
+    max_age = 30 * 24 * 3600
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = None
+        self.new_entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def default_filename():
+        '''The cache file, or None if the cache is disabled with an empty
+        MESON_DEPENDENCY_CACHE environment variable.'''
+        if 'MESON_DEPENDENCY_CACHE' in os.environ:
+            return os.environ['MESON_DEPENDENCY_CACHE'] or None
+        if mesonlib.is_windows():
+            cachedir = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+        else:
+            cachedir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+        return os.path.join(cachedir, 'meson', 'dependency_cache.dat')
+
+    def __getstate__(self):
+        # The environment, and us with it, gets pickled into build.dat
+        state = self.__dict__.copy()
+        state['entries'] = None
+        state['new_entries'] = {}
+        return state
+
+    def read(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                obj = pickle.load(f)
+        except (OSError, EOFError, AttributeError, pickle.UnpicklingError):
+            return {}
+        # Pickled dependency objects of other versions may not even load
+        if isinstance(obj, tuple) and len(obj) == 2 and obj[0] == coredata.version:
+            return obj[1]
+        return {}
+
+    def save(self):
+        if not self.new_entries:
+            return
+        # Other build directories may have been configured in the meantime
+        entries = self.read()
+        entries.update(self.new_entries)
+        now = time.time()
+        entries = {k: v for k, v in entries.items() if now - v[2] < self.max_age}
+        os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+        tmpname = '{}.{}~'.format(self.filename, os.getpid())
+        with open(tmpname, 'wb') as f:
+            pickle.dump((coredata.version, entries), f)
+        os.replace(tmpname, self.filename)
+        self.new_entries = {}
+
+    def clear(self):
+        self.entries = {}
+        self.new_entries = {}
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    @classmethod
+    def make_key(cls, name, kwargs):
+        env = sorted((k, v) for k, v in os.environ.items() if k.startswith(cls.env_vars))
+        ident = (name, sorted(kwargs.items()), env)
+        return hashlib.sha256(repr(ident).encode('utf-8')).hexdigest()
+
+    def lookup(self, key, environment):
+        if self.entries is None:
+            self.entries = self.read()
+        entry = self.entries.get(key)
+        if entry is not None and all(_stamp(s[0]) == s for s in entry[0]):
+            try:
+                dep = pickle.loads(entry[1])
+            except Exception:
+                dep = None
+            if dep is not None:
+                dep.reattach(environment)
+                self.new_entries[key] = (entry[0], entry[1], time.time())
+                self.hits += 1
+                return dep
+        self.misses += 1
+        return None
+
+    def store(self, key, record, dep):
+        stamps = tuple(_stamp(p) for p in sorted(record.files))
+        dep = copy.copy(dep)
+        for attr in dep.cache_transient:
+            setattr(dep, attr, None)
+        try:
+            blob = pickle.dumps(dep)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        self.new_entries[key] = (stamps, blob, time.time())
+
 class Dependency:
     def __init__(self, type_name, kwargs):
         self.name = "null"
@@ -82,6 +239,16 @@ class Dependency:
     def get_pkgconfig_variable(self, variable_name):
         raise MesonException('Tried to get a pkg-config variable from a non-pkgconfig dependency.')
 
+    # Whether lookups of this class record everything they consult, see
+    # DependencyCache.
+    cacheable = False
+    # Attributes that are not stored in the DependencyCache
+    cache_transient = ()
+
+    def reattach(self, environment):
+        '''Called on a dependency that was taken from the DependencyCache.'''
+        pass
+
 class InternalDependency(Dependency):
     def __init__(self, version, incdirs, compile_args, link_args, libraries, sources, ext_deps):
         super().__init__('internal', {})
@@ -106,6 +273,7 @@ class PkgConfigDependency(Dependency):
     # The class's copy of the pkg-config path. Avoids having to search for it
     # multiple times in the same Meson invocation.
     class_pkgbin = None
+    cacheable = True
 
     def __init__(self, name, environment, kwargs):
         Dependency.__init__(self, 'pkgconfig', kwargs)
@@ -153,6 +321,7 @@ class PkgConfigDependency(Dependency):
 
         self.is_found = False
         if not self.pkgbin:
+            record_uncacheable()
             if self.required:
                 raise DependencyException('Pkg-config not found.')
             return
@@ -163,7 +332,7 @@ class PkgConfigDependency(Dependency):
 
         mlog.debug('Determining dependency {!r} with pkg-config executable '
                    '{!r}'.format(name, self.pkgbin))
-        ret, self.modversion = self._call_pkgbin(['--modversion', name])
+        ret, self.modversion = self._query('get_modversion', ['--modversion', name])
         if ret != 0:
             if self.required:
                 raise DependencyException('{} dependency {!r} not found'
@@ -212,8 +381,31 @@ class PkgConfigDependency(Dependency):
         p, out = Popen_safe([self.pkgbin] + args, env=os.environ)[0:2]
         return p.returncode, out.strip()
 
+    def _query(self, method, args, *method_args):
+        '''Answers a query with the in-process .pc resolver if possible and
+        with the pkg-config binary called with args otherwise. Flag lists
+        are returned as strings either way.'''
+        # Cross pkg-config binaries are usually wrappers that set up their
+        # own search path and sysroot, so always ask them.
+        resolver = None if self.want_cross else pcresolver.get_resolver(self.pkgbin)
+        if resolver is not None:
+            try:
+                out = getattr(resolver, method)(self.name, *method_args)
+            except pcresolver.PkgConfigNotFound as e:
+                record_consulted(self.pkgbin, *resolver.get_consulted_files(self.name))
+                return 1, str(e)
+            except pcresolver.PkgConfigUnsupported as e:
+                mlog.debug('Calling pkg-config for {!r}: {}'.format(self.name, e))
+            else:
+                record_consulted(self.pkgbin, *resolver.get_consulted_files(self.name))
+                if isinstance(out, list):
+                    out = ' '.join(out)
+                return 0, out
+        record_uncacheable()
+        return self._call_pkgbin(args)
+
     def _set_cargs(self):
-        ret, out = self._call_pkgbin(['--cflags', self.name])
+        ret, out = self._query('get_cflags', ['--cflags', self.name])
         if ret != 0:
             raise DependencyException('Could not generate cargs for %s:\n\n%s' %
                                       (self.name, out))
@@ -223,7 +415,7 @@ class PkgConfigDependency(Dependency):
         libcmd = [self.name, '--libs']
         if self.static:
             libcmd.append('--static')
-        ret, out = self._call_pkgbin(libcmd)
+        ret, out = self._query('get_libs', libcmd, self.static)
         if ret != 0:
             raise DependencyException('Could not generate libs for %s:\n\n%s' %
                                       (self.name, out))
@@ -244,7 +436,8 @@ class PkgConfigDependency(Dependency):
             self.libs.append(lib)
 
     def get_pkgconfig_variable(self, variable_name):
-        ret, out = self._call_pkgbin(['--variable=' + variable_name, self.name])
+        ret, out = self._query('get_variable', ['--variable=' + variable_name, self.name],
+                               variable_name)
         variable = ''
         if ret != 0:
             if self.required:
@@ -336,11 +529,14 @@ class PkgConfigDependency(Dependency):
 
 class WxDependency(Dependency):
     wx_found = None
+    cacheable = True
 
     def __init__(self, environment, kwargs):
         Dependency.__init__(self, 'wx', kwargs)
         self.is_found = False
         self.modversion = 'none'
+        for wxc in ['wx-config-3.0', 'wx-config']:
+            record_program(wxc)
         if WxDependency.wx_found is None:
             self.check_wxconfig()
         if not WxDependency.wx_found:
@@ -596,6 +792,8 @@ class BoostDependency(Dependency):
     # their sources and libraries. This dict maps
     # between the two.
     name2lib = {'test': 'unit_test_framework'}
+    cacheable = True
+    cache_transient = ('environment', 'cpp_compiler')
 
     def __init__(self, environment, kwargs):
         Dependency.__init__(self, 'boost', kwargs)
@@ -651,7 +849,14 @@ class BoostDependency(Dependency):
             raise DependencyException('Tried to use Boost but a C++ compiler is not defined.')
         self.cpp_compiler = self.environment.coredata.compilers['cpp']
 
+    def reattach(self, environment):
+        if 'cpp' not in environment.coredata.compilers:
+            raise DependencyException('Tried to use Boost but a C++ compiler is not defined.')
+        self.environment = environment
+        self.cpp_compiler = environment.coredata.compilers['cpp']
+
     def detect_win_root(self):
+        record_consulted('c:\\local')
         globtext = 'c:\\local\\boost_*'
         files = glob.glob(globtext)
         if len(files) > 0:
@@ -690,6 +895,7 @@ class BoostDependency(Dependency):
         return self.version
 
     def detect_version(self):
+        record_consulted(os.path.join(self.boost_inc_subdir, 'version.hpp'))
         try:
             ifile = open(os.path.join(self.boost_inc_subdir, 'version.hpp'))
         except FileNotFoundError:
@@ -705,6 +911,7 @@ class BoostDependency(Dependency):
         self.version = None
 
     def detect_src_modules(self):
+        record_consulted(self.boost_inc_subdir)
         for entry in os.listdir(self.boost_inc_subdir):
             entry = os.path.join(self.boost_inc_subdir, entry)
             if stat.S_ISDIR(os.stat(entry).st_mode):
@@ -726,6 +933,7 @@ class BoostDependency(Dependency):
             # Does anyone do Boost cross-compiling to other archs on Windows?
             gl = None
         # See if the libdir is valid
+        record_consulted(self.boost_root)
         if gl:
             libdir = glob.glob(os.path.join(self.boost_root, gl))
         else:
@@ -735,6 +943,7 @@ class BoostDependency(Dependency):
             return
         libdir = libdir[0]
         self.libdir = libdir
+        record_consulted(libdir)
         globber = 'boost_*-gd-*.lib' # FIXME
         for entry in glob.glob(os.path.join(libdir, globber)):
             (_, fname) = os.path.split(entry)
@@ -755,6 +964,7 @@ class BoostDependency(Dependency):
             libdirs = mesonlib.get_library_dirs()
         else:
             libdirs = [os.path.join(self.boost_root, 'lib')]
+        record_consulted(*libdirs)
         for libdir in libdirs:
             for entry in glob.glob(os.path.join(libdir, globber)):
                 lib = os.path.basename(entry)
@@ -952,6 +1162,8 @@ class GMockDependency(Dependency):
         return self.is_found
 
 class QtBaseDependency(Dependency):
+    cacheable = True
+
     def __init__(self, name, env, kwargs):
         Dependency.__init__(self, name, kwargs)
         self.name = name
@@ -1058,6 +1270,7 @@ class QtBaseDependency(Dependency):
 
     def _qmake_detect(self, mods, env, kwargs):
         for qmake in ('qmake-' + self.name, 'qmake'):
+            record_program(qmake)
             self.qmake = self._find_qmake(qmake, env)
             if not self.qmake.found():
                 continue
@@ -1097,14 +1310,17 @@ class QtBaseDependency(Dependency):
             self.cargs.append('-I' + mincdir)
             if for_windows(env.is_cross_build(), env):
                 libfile = os.path.join(libdir, self.qtpkgname + module + '.lib')
+                record_consulted(libfile)
                 if not os.path.isfile(libfile):
                     # MinGW can link directly to .dll
                     libfile = os.path.join(self.bindir, self.qtpkgname + module + '.dll')
+                    record_consulted(libfile)
                     if not os.path.isfile(libfile):
                         self.is_found = False
                         break
             else:
                 libfile = os.path.join(libdir, 'lib{}{}.so'.format(self.qtpkgname, module))
+                record_consulted(libfile)
                 if not os.path.isfile(libfile):
                     self.is_found = False
                     break
@@ -1112,6 +1328,7 @@ class QtBaseDependency(Dependency):
         return qmake
 
     def _framework_detect(self, qvars, modules, kwargs):
+        record_uncacheable()
         libdir = qvars['QT_INSTALL_LIBS']
         for m in modules:
             fname = 'Qt' + m
@@ -1340,6 +1557,8 @@ class GLDependency(Dependency):
 # There are three different ways of depending on SDL2:
 # sdl2-config, pkg-config and OSX framework
 class SDL2Dependency(Dependency):
+    cacheable = True
+
     def __init__(self, environment, kwargs):
         Dependency.__init__(self, 'sdl2', kwargs)
         self.is_found = False
@@ -1359,6 +1578,7 @@ class SDL2Dependency(Dependency):
                 mlog.debug('SDL 2 not found via pkgconfig. Trying next, error was:', str(e))
                 pass
         if 'sdlconfig' in self.methods:
+            record_program('sdl2-config')
             sdlconf = shutil.which('sdl2-config')
             if sdlconf:
                 stdo = Popen_safe(['sdl2-config', '--cflags'])[1]
@@ -1374,6 +1594,7 @@ class SDL2Dependency(Dependency):
             mlog.debug('Could not find sdl2-config binary, trying next.')
         if 'extraframework' in self.methods:
             if mesonlib.is_osx():
+                record_uncacheable()
                 fwdep = ExtraFrameworkDependency('sdl2', kwargs.get('required', True), None, kwargs)
                 if fwdep.found():
                     self.is_found = True
@@ -1571,9 +1792,38 @@ def get_dep_identifier(name, kwargs):
     return identifier
 
 def find_external_dependency(name, environment, kwargs):
+    global _lookup_record
     required = kwargs.get('required', True)
     if not isinstance(required, bool):
         raise DependencyException('Keyword "required" must be a boolean.')
+    cache = getattr(environment, 'dep_cache', None)
+    if cache is None or environment.is_cross_build():
+        return _find_external_dependency(name, environment, kwargs)
+    # Some dependencies modify kwargs
+    key = cache.make_key(name, kwargs)
+    dep = cache.lookup(key, environment)
+    if dep is not None:
+        if not kwargs.get('silent', False):
+            if dep.found():
+                version = getattr(dep, 'get_version', lambda: '')()
+                mlog.log('Dependency', mlog.bold(name), 'found:', mlog.green('YES'),
+                         version, '(cached)')
+            else:
+                mlog.log('Dependency', mlog.bold(name), 'found:', mlog.red('NO'), '(cached)')
+        if required and not dep.found():
+            raise DependencyException('Dependency "%s" not found' % name)
+        return dep
+    _lookup_record = record = LookupRecord()
+    try:
+        dep = _find_external_dependency(name, environment, kwargs)
+    finally:
+        _lookup_record = None
+    if dep is not None and dep.cacheable and record.cacheable:
+        cache.store(key, record, dep)
+    return dep
+
+def _find_external_dependency(name, environment, kwargs):
+    required = kwargs.get('required', True)
     lname = name.lower()
     if lname in packages:
         dep = packages[lname](environment, kwargs)
@@ -16,6 +16,7 @@ import os, re, subprocess, platform
 from . import coredata
 from . import mesonlib
 from . import mlog
+from . import mparser
 from .compilers import *
 from .mesonlib import EnvironmentException, Popen_safe
 import configparser
@@ -225,6 +226,8 @@ class Environment:
     private_dir = 'meson-private'
     log_dir = 'meson-logs'
     coredata_file = os.path.join(private_dir, 'coredata.dat')
+    check_cache_file = os.path.join(private_dir, 'check_cache.dat')
+    ast_cache_file = os.path.join(private_dir, 'ast_cache.dat')
 
     def __init__(self, source_dir, build_dir, main_script_launcher, options, original_cmd_line_args):
         self.source_dir = source_dir
@@ -251,6 +254,19 @@ class Environment:
             self.cross_info = None
         self.cmd_line_options = options
         self.original_cmd_line_args = original_cmd_line_args
+        self.check_cache = CompilerCheckCache(os.path.join(build_dir, Environment.check_cache_file))
+        if getattr(options, 'clear_check_cache', False):
+            self.check_cache.clear()
+        self.ast_cache = mparser.AstCache(os.path.join(build_dir, Environment.ast_cache_file))
+        # dependencies imports this module
+        from .dependencies import DependencyCache
+        dep_cache_file = DependencyCache.default_filename()
+        if dep_cache_file is None:
+            self.dep_cache = None
+        else:
+            self.dep_cache = DependencyCache(dep_cache_file)
+            if getattr(options, 'clear_dependency_cache', False):
+                self.dep_cache.clear()
 
         # List of potential compilers.
         if mesonlib.is_windows():
@@ -296,6 +312,26 @@ class Environment:
         coredata.save(self.coredata, cdf)
         os.utime(cdf, times=(mtime, mtime))
 
+    def dump_check_cache(self):
+        cache = self.check_cache
+        if cache.hits or cache.misses:
+            mlog.log('Compiler check cache: {} hits, {} misses.'.format(cache.hits, cache.misses))
+        cache.save()
+
+    def dump_ast_cache(self):
+        self.ast_cache.save()
+
+    def dump_dep_cache(self):
+        cache = self.dep_cache
+        if cache is None:
+            return
+        if cache.hits or cache.misses:
+            mlog.log('Dependency cache: {} hits, {} misses.'.format(cache.hits, cache.misses))
+        try:
+            cache.save()
+        except OSError as e:
+            mlog.warning('Could not write dependency cache {!r}: {}'.format(cache.filename, e))
+
     def get_script_dir(self):
         import mesonbuild.scripts
         return os.path.dirname(mesonbuild.scripts.__file__)
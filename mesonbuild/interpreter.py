@@ -32,7 +32,9 @@ from .modules import ModuleReturnValue
 
 import os, sys, shutil, uuid
 import re
+import multiprocessing
 from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 import importlib
 
@@ -591,7 +593,8 @@ class RunTargetHolder(InterpreterObject):
         return r.format(self.__class__.__name__, h.get_id(), h.command)
 
 class Test(InterpreterObject):
-    def __init__(self, name, suite, exe, is_parallel, cmd_args, env, should_fail, timeout, workdir):
+    def __init__(self, name, suite, exe, is_parallel, cmd_args, env, should_fail, timeout, workdir,
+                 weight, memory):
         InterpreterObject.__init__(self)
         self.name = name
         self.suite = suite
@@ -602,6 +605,8 @@ class Test(InterpreterObject):
         self.should_fail = should_fail
         self.timeout = timeout
         self.workdir = workdir
+        self.weight = weight
+        self.memory = memory
 
     def get_exe(self):
         return self.exe
@@ -637,12 +642,15 @@ class CompilerHolder(InterpreterObject):
                              'sizeof': self.sizeof_method,
                              'get_define': self.get_define_method,
                              'has_header': self.has_header_method,
+                             'has_headers': self.has_headers_method,
                              'has_header_symbol': self.has_header_symbol_method,
                              'run': self.run_method,
                              'has_function': self.has_function_method,
+                             'has_functions': self.has_functions_method,
                              'has_member': self.has_member_method,
                              'has_members': self.has_members_method,
                              'has_type': self.has_type_method,
+                             'has_types': self.has_types_method,
                              'alignment': self.alignment_method,
                              'version': self.version_method,
                              'cmd_array': self.cmd_array_method,
@@ -812,6 +820,52 @@ class CompilerHolder(InterpreterObject):
         mlog.log('Checking for function "', mlog.bold(funcname), '": ', hadtxt, sep='')
         return had
 
+    def run_checks(self, check, names, describe):
+        '''
+        Runs check(name) for every name concurrently and returns the results
+        in the same order as the names. Every check spends nearly all of its
+        time waiting for a compiler process, so threads are enough. The log
+        output of each check is held back and written in order, followed by
+        describe(name) and YES or NO.
+        '''
+        if len(names) == 0:
+            return []
+
+        def run_check(name):
+            mlog.start_capture()
+            try:
+                result = check(name)
+            except Exception as e:
+                return None, e, mlog.stop_capture()
+            return result, None, mlog.stop_capture()
+        results = []
+        workers = min(len(names), multiprocessing.cpu_count())
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for name, (result, error, records) in zip(names, executor.map(run_check, names)):
+                mlog.replay(records)
+                if error is not None:
+                    raise error
+                if result:
+                    restxt = mlog.green('YES')
+                else:
+                    restxt = mlog.red('NO')
+                mlog.log(*(describe(name) + [restxt]), sep='')
+                results.append(result)
+        return results
+
+    def has_functions_method(self, args, kwargs):
+        check_stringlist(args)
+        prefix = kwargs.get('prefix', '')
+        if not isinstance(prefix, str):
+            raise InterpreterException('Prefix argument of has_functions must be a string.')
+        extra_args = self.determine_args(kwargs)
+        deps = self.determine_dependencies(kwargs)
+
+        def check(funcname):
+            return self.compiler.has_function(funcname, prefix, self.environment, extra_args, deps)
+        return self.run_checks(check, args,
+                               lambda funcname: ['Checking for function "', mlog.bold(funcname), '": '])
+
     def has_type_method(self, args, kwargs):
         if len(args) != 1:
             raise InterpreterException('Has_type takes exactly one argument.')
@@ -830,6 +884,19 @@ class CompilerHolder(InterpreterObject):
         mlog.log('Checking for type "', mlog.bold(typename), '": ', hadtxt, sep='')
         return had
 
+    def has_types_method(self, args, kwargs):
+        check_stringlist(args)
+        prefix = kwargs.get('prefix', '')
+        if not isinstance(prefix, str):
+            raise InterpreterException('Prefix argument of has_types must be a string.')
+        extra_args = self.determine_args(kwargs)
+        deps = self.determine_dependencies(kwargs)
+
+        def check(typename):
+            return self.compiler.has_type(typename, prefix, self.environment, extra_args, deps)
+        return self.run_checks(check, args,
+                               lambda typename: ['Checking for type "', mlog.bold(typename), '": '])
+
     def compute_int_method(self, args, kwargs):
         if len(args) != 1:
             raise InterpreterException('Compute_int takes exactly one argument.')
@@ -945,6 +1012,18 @@ class CompilerHolder(InterpreterObject):
         mlog.log('Has header "%s":' % hname, h)
         return haz
 
+    def has_headers_method(self, args, kwargs):
+        check_stringlist(args)
+        prefix = kwargs.get('prefix', '')
+        if not isinstance(prefix, str):
+            raise InterpreterException('Prefix argument of has_headers must be a string.')
+        extra_args = self.determine_args(kwargs)
+        deps = self.determine_dependencies(kwargs)
+
+        def check(hname):
+            return self.compiler.has_header(hname, prefix, self.environment, extra_args, deps)
+        return self.run_checks(check, args, lambda hname: ['Has header "%s": ' % hname])
+
     def has_header_symbol_method(self, args, kwargs):
         if len(args) != 2:
             raise InterpreterException('has_header_symbol method takes exactly two arguments.')
@@ -1235,6 +1314,7 @@ class Interpreter(InterpreterBase):
         self.subproject = subproject
         self.subproject_dir = subproject_dir
         self.option_file = os.path.join(self.source_root, self.subdir, 'meson_options.txt')
+        self.ast_cache = self.environment.ast_cache
         self.load_root_meson_file()
         self.sanity_check_ast()
         self.builtin.update({'meson': MesonMain(build, self)})
@@ -2177,6 +2257,12 @@ class Interpreter(InterpreterBase):
             workdir = None
         if not isinstance(timeout, int):
             raise InterpreterException('Timeout must be an integer.')
+        weight = kwargs.get('weight', 1)
+        if not isinstance(weight, int) or weight < 1:
+            raise InterpreterException('Keyword argument weight must be a positive integer.')
+        memory = kwargs.get('memory', 0)
+        if not isinstance(memory, int) or memory < 0:
+            raise InterpreterException('Keyword argument memory must be a non-negative integer.')
         suite = []
         for s in mesonlib.stringlistify(kwargs.get('suite', '')):
             if len(s) > 0:
@@ -2185,7 +2271,8 @@ class Interpreter(InterpreterBase):
                 suite.append(self.subproject.replace(' ', '_').replace(':', '_') + s)
             else:
                 suite.append(self.build.project_name.replace(' ', '_').replace(':', '_') + s)
-        t = Test(args[0], suite, args[1].held_object, par, cmd_args, env, should_fail, timeout, workdir)
+        t = Test(args[0], suite, args[1].held_object, par, cmd_args, env, should_fail, timeout, workdir,
+                 weight, memory)
         if is_base_test:
             self.build.tests.append(t)
             mlog.debug('Adding test "', mlog.bold(args[0]), '".', sep='')
@@ -2228,14 +2315,7 @@ class Interpreter(InterpreterBase):
         if not os.path.isfile(absname):
             self.subdir = prev_subdir
             raise InterpreterException('Nonexistent build def file %s.' % buildfilename)
-        with open(absname, encoding='utf8') as f:
-            code = f.read()
-        assert(isinstance(code, str))
-        try:
-            codeblock = mparser.Parser(code, self.subdir).parse()
-        except mesonlib.MesonException as me:
-            me.file = buildfilename
-            raise me
+        codeblock = self.parse_cached(absname, buildfilename)
         self.evaluate_codeblock(codeblock)
         self.subdir = prev_subdir
 
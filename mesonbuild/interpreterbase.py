@@ -20,6 +20,7 @@ from . import environment, dependencies
 
 import os, copy, re
 from functools import wraps
+from collections import OrderedDict
 
 # Decorators for method calls.
 
@@ -87,11 +88,23 @@ class InterpreterBase:
         self.subdir = subdir
         self.variables = {}
         self.argument_depth = 0
+        # Set by subclasses that want to reuse ASTs from previous runs
+        self.ast_cache = None
+        self.build_statement_dict()
 
     def load_root_meson_file(self):
         mesonfile = os.path.join(self.source_root, self.subdir, environment.build_filename)
         if not os.path.isfile(mesonfile):
             raise InvalidArguments('Missing Meson file in %s' % mesonfile)
+        if self.ast_cache is not None:
+            self.ast = self.parse_cached(mesonfile, environment.build_filename)
+            if len(self.ast.lines) == 0:
+                # Only a blank file is empty, one with just comments fails
+                # the sanity check on the first statement instead.
+                with open(mesonfile, encoding='utf8') as mf:
+                    if len(mf.read().strip()) == 0:
+                        raise InvalidCode('Builder file is empty.')
+            return
         with open(mesonfile, encoding='utf8') as mf:
             code = mf.read()
         if len(code.strip()) == 0:
@@ -103,6 +116,13 @@ class InterpreterBase:
             me.file = environment.build_filename
             raise me
 
+    def parse_cached(self, fname, relname):
+        try:
+            return self.ast_cache.parse(fname, self.subdir)
+        except mesonlib.MesonException as me:
+            me.file = relname
+            raise me
+
     def parse_project(self):
         """
         Parses project() and initializes languages, compilers etc. Do this
@@ -146,49 +166,50 @@ class InterpreterBase:
                 raise e
             i += 1 # In THE FUTURE jump over blocks and stuff.
 
+    def build_statement_dict(self):
+        # Maps AST node types to the methods that evaluate them. The order is
+        # the order in which isinstance() is tried for node types that are
+        # not in the table themselves, such as subclasses of node types.
+        self.statements = OrderedDict([
+            (mparser.FunctionNode, self.function_call),
+            (mparser.AssignmentNode, self.assignment),
+            (mparser.MethodNode, self.method_call),
+            (mparser.StringNode, self.evaluate_literal),
+            (mparser.BooleanNode, self.evaluate_literal),
+            (mparser.IfClauseNode, self.evaluate_if),
+            (mparser.IdNode, self.evaluate_id),
+            (mparser.ComparisonNode, self.evaluate_comparison),
+            (mparser.ArrayNode, self.evaluate_arraystatement),
+            (mparser.NumberNode, self.evaluate_literal),
+            (mparser.AndNode, self.evaluate_andstatement),
+            (mparser.OrNode, self.evaluate_orstatement),
+            (mparser.NotNode, self.evaluate_notstatement),
+            (mparser.UMinusNode, self.evaluate_uminusstatement),
+            (mparser.ArithmeticNode, self.evaluate_arithmeticstatement),
+            (mparser.ForeachClauseNode, self.evaluate_foreach),
+            (mparser.PlusAssignmentNode, self.evaluate_plusassign),
+            (mparser.IndexNode, self.evaluate_indexing),
+            (mparser.TernaryNode, self.evaluate_ternary),
+        ])
+
     def evaluate_statement(self, cur):
-        if isinstance(cur, mparser.FunctionNode):
-            return self.function_call(cur)
-        elif isinstance(cur, mparser.AssignmentNode):
-            return self.assignment(cur)
-        elif isinstance(cur, mparser.MethodNode):
-            return self.method_call(cur)
-        elif isinstance(cur, mparser.StringNode):
-            return cur.value
-        elif isinstance(cur, mparser.BooleanNode):
-            return cur.value
-        elif isinstance(cur, mparser.IfClauseNode):
-            return self.evaluate_if(cur)
-        elif isinstance(cur, mparser.IdNode):
-            return self.get_variable(cur.value)
-        elif isinstance(cur, mparser.ComparisonNode):
-            return self.evaluate_comparison(cur)
-        elif isinstance(cur, mparser.ArrayNode):
-            return self.evaluate_arraystatement(cur)
-        elif isinstance(cur, mparser.NumberNode):
-            return cur.value
-        elif isinstance(cur, mparser.AndNode):
-            return self.evaluate_andstatement(cur)
-        elif isinstance(cur, mparser.OrNode):
-            return self.evaluate_orstatement(cur)
-        elif isinstance(cur, mparser.NotNode):
-            return self.evaluate_notstatement(cur)
-        elif isinstance(cur, mparser.UMinusNode):
-            return self.evaluate_uminusstatement(cur)
-        elif isinstance(cur, mparser.ArithmeticNode):
-            return self.evaluate_arithmeticstatement(cur)
-        elif isinstance(cur, mparser.ForeachClauseNode):
-            return self.evaluate_foreach(cur)
-        elif isinstance(cur, mparser.PlusAssignmentNode):
-            return self.evaluate_plusassign(cur)
-        elif isinstance(cur, mparser.IndexNode):
-            return self.evaluate_indexing(cur)
-        elif isinstance(cur, mparser.TernaryNode):
-            return self.evaluate_ternary(cur)
-        elif self.is_elementary_type(cur):
-            return cur
-        else:
-            raise InvalidCode("Unknown statement.")
+        try:
+            func = self.statements[type(cur)]
+        except KeyError:
+            for (nodetype, func) in self.statements.items():
+                if isinstance(cur, nodetype):
+                    break
+            else:
+                if self.is_elementary_type(cur):
+                    return cur
+                raise InvalidCode("Unknown statement.")
+        return func(cur)
+
+    def evaluate_literal(self, cur):
+        return cur.value
+
+    def evaluate_id(self, cur):
+        return self.get_variable(cur.value)
 
     def evaluate_arraystatement(self, cur):
         (arguments, kwargs) = self.reduce_arguments(cur.args)
@@ -13,9 +13,8 @@
 # limitations under the License.
 
 import sys, os
-import pickle
 import argparse
-from . import coredata, mesonlib
+from . import build, coredata, mesonlib
 
 parser = argparse.ArgumentParser()
 
@@ -23,7 +22,7 @@ parser.add_argument('-D', action='append', default=[], dest='sets',
                     help='Set an option to the given value.')
 parser.add_argument('directory', nargs='*')
 parser.add_argument('--clearcache', action='store_true', default=False,
-                    help='Clear cached state (e.g. found dependencies)')
+                    help='Clear cached state (e.g. found dependencies, compiler checks, parsed build files)')
 
 class ConfException(mesonlib.MesonException):
     def __init__(self, *args, **kwargs):
@@ -34,23 +33,25 @@ class Conf:
         self.build_dir = build_dir
         self.coredata_file = os.path.join(build_dir, 'meson-private/coredata.dat')
         self.build_file = os.path.join(build_dir, 'meson-private/build.dat')
+        self.check_cache_file = os.path.join(build_dir, 'meson-private/check_cache.dat')
+        self.ast_cache_file = os.path.join(build_dir, 'meson-private/ast_cache.dat')
         if not os.path.isfile(self.coredata_file) or not os.path.isfile(self.build_file):
             raise ConfException('Directory %s does not seem to be a Meson build directory.' % build_dir)
-        with open(self.coredata_file, 'rb') as f:
-            self.coredata = pickle.load(f)
-        with open(self.build_file, 'rb') as f:
-            self.build = pickle.load(f)
-        if self.coredata.version != coredata.version:
-            raise ConfException('Version mismatch (%s vs %s)' %
-                                (coredata.version, self.coredata.version))
+        try:
+            self.coredata = coredata.load(self.coredata_file)
+            self.build = build.load(self.build_file)
+        except mesonlib.MesonException as e:
+            raise ConfException(str(e))
 
     def clear_cache(self):
         self.coredata.deps = {}
+        for f in (self.check_cache_file, self.ast_cache_file):
+            if os.path.exists(f):
+                os.unlink(f)
 
     def save(self):
         # Only called if something has changed so overwrite unconditionally.
-        with open(self.coredata_file, 'wb') as f:
-            pickle.dump(self.coredata, f)
+        coredata.save(self.coredata, self.coredata_file)
         # We don't write the build file because any changes to it
         # are erased when Meson is executed the next time, i.e. whne
         # Ninja is run.
@@ -132,7 +133,7 @@ class Conf:
         print('')
         print('Core options:')
         carr = []
-        for key in ['buildtype', 'warning_level', 'werror', 'strip', 'unity', 'default_library']:
+        for key in ['buildtype', 'warning_level', 'werror', 'strip', 'unity', 'unity_size', 'default_library']:
             carr.append([key, coredata.get_builtin_option_description(key),
                          self.coredata.get_builtin_option(key), coredata.get_builtin_option_choices(key)])
         self.print_aligned(carr)
@@ -367,8 +367,7 @@ def get_library_dirs():
 
 
 def do_replacement(regex, line, confdata):
-    match = re.search(regex, line)
-    while match:
+    def variable_replace(match):
         varname = match.group(1)
         if varname in confdata.keys():
             (var, desc) = confdata.get(varname)
@@ -380,9 +379,9 @@ def do_replacement(regex, line, confdata):
                 raise RuntimeError('Tried to replace a variable with something other than a string or int.')
         else:
             var = ''
-        line = line.replace('@' + varname + '@', var)
-        match = re.search(regex, line)
-    return line
+        return var
+    # All variables are replaced in one pass, values are not expanded again.
+    return regex.sub(variable_replace, line)
 
 def do_mesondefine(line, confdata):
     arr = line.split()
@@ -408,23 +407,30 @@ def do_mesondefine(line, confdata):
 
 def do_conf_file(src, dst, confdata):
     try:
-        with open(src, encoding='utf-8') as f:
-            data = f.readlines()
+        fin = open(src, encoding='utf-8')
     except Exception as e:
         raise MesonException('Could not read input file %s: %s' % (src, str(e)))
     # Only allow (a-z, A-Z, 0-9, _, -) as valid characters for a define
-    # Also allow escaping '@' with '\@'
-    regex = re.compile(r'[^\\]?@([-a-zA-Z0-9_]+)@')
-    result = []
-    for line in data:
-        if line.startswith('#mesondefine'):
-            line = do_mesondefine(line, confdata)
-        else:
-            line = do_replacement(regex, line, confdata)
-        result.append(line)
+    regex = re.compile(r'@([-a-zA-Z0-9_]+)@')
     dst_tmp = dst + '~'
-    with open(dst_tmp, 'w', encoding='utf-8') as f:
-        f.writelines(result)
+    # The input is processed line by line straight into the temporary
+    # file so that large files are never held in memory as a whole.
+    try:
+        with fin, open(dst_tmp, 'w', encoding='utf-8', buffering=1024 * 1024) as fout:
+            try:
+                for line in fin:
+                    if line.startswith('#mesondefine'):
+                        line = do_mesondefine(line, confdata)
+                    elif '@' in line:
+                        line = do_replacement(regex, line, confdata)
+                    fout.write(line)
+            except UnicodeDecodeError as e:
+                raise MesonException('Could not read input file %s: %s' % (src, str(e)))
+    except BaseException:
+        # Do not leave a partially written file behind
+        if os.path.exists(dst_tmp):
+            os.unlink(dst_tmp)
+        raise
     shutil.copymode(src, dst_tmp)
     replace_if_different(dst, dst_tmp)
 
@@ -454,18 +460,25 @@ def dump_conf_header(ofilename, cdata):
 
 def replace_if_different(dst, dst_tmp):
     # If contents are identical, don't touch the file to prevent
-    # unnecessary rebuilds.
+    # unnecessary rebuilds. Returns whether dst was replaced.
     different = True
     try:
-        with open(dst, 'r') as f1, open(dst_tmp, 'r') as f2:
-            if f1.read() == f2.read():
-                different = False
+        if os.stat(dst).st_size == os.stat(dst_tmp).st_size:
+            with open(dst, 'rb') as f1, open(dst_tmp, 'rb') as f2:
+                while True:
+                    chunk = f1.read(1024 * 1024)
+                    if chunk != f2.read(1024 * 1024):
+                        break
+                    if not chunk:
+                        different = False
+                        break
     except FileNotFoundError:
         pass
     if different:
         os.replace(dst_tmp, dst)
     else:
         os.unlink(dst_tmp)
+    return different
 
 def stringintlistify(item):
     if isinstance(item, (str, int)):
@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import sys, stat, traceback, pickle, argparse
+import sys, stat, traceback, argparse
 import time, datetime
 import os.path
 from . import environment, interpreter, mesonlib
@@ -55,6 +55,7 @@ add_builtin_argument('backend')
 add_builtin_argument('buildtype')
 add_builtin_argument('strip', action='store_true')
 add_builtin_argument('unity', action='store_true')
+add_builtin_argument('unity-size', type=int)
 add_builtin_argument('werror', action='store_true')
 add_builtin_argument('layout')
 add_builtin_argument('default-library')
@@ -72,6 +73,10 @@ parser.add_argument('-v', '--version', action='version',
 parser.add_argument('--wrap-mode', default=WrapMode.default,
                     type=lambda t: getattr(WrapMode, t), choices=WrapMode,
                     help='Special wrap mode to use')
+parser.add_argument('--clear-check-cache', action='store_true', default=False,
+                    help='Discard cached compiler check results and rerun all checks.')
+parser.add_argument('--clear-dependency-cache', action='store_true', default=False,
+                    help='Discard the dependency lookups cached for all build directories.')
 parser.add_argument('directories', nargs='*')
 
 class MesonApp:
@@ -177,13 +182,21 @@ If you want to change option values, use the mesonconf tool instead.'''
             mlog.log('Target machine cpu:', mlog.bold(intr.builtin['target_machine'].cpu_method([], {})))
         mlog.log('Build machine cpu family:', mlog.bold(intr.builtin['build_machine'].cpu_family_method([], {})))
         mlog.log('Build machine cpu:', mlog.bold(intr.builtin['build_machine'].cpu_method([], {})))
-        intr.run()
+        try:
+            intr.run()
+            # Forget build files that are no longer part of the project
+            env.ast_cache.prune()
+        finally:
+            # Results of the checks that did run are valid even if the
+            # configuration failed later on, so keep them for the next try.
+            env.dump_check_cache()
+            env.dump_ast_cache()
+            env.dump_dep_cache()
         coredata_mtime = time.time()
         g.generate(intr)
         g.run_postconf_scripts()
         dumpfile = os.path.join(env.get_scratch_dir(), 'build.dat')
-        with open(dumpfile, 'wb') as f:
-            pickle.dump(b, f)
+        build.save(b, dumpfile)
         # Write this last since we use the existence of this file to check if
         # we generated the build file successfully, so we don't want an error
         # that pops up during generation, post-conf scripts, etc to cause us to
@@ -306,4 +319,7 @@ def run(mainfile, args):
         else:
             traceback.print_exc()
         return 1
+    finally:
+        # In-process callers read meson-log.txt as soon as we return
+        mlog.flush()
     return 0
@@ -211,11 +211,10 @@ def run(args):
     testfile = os.path.join(datadir, 'meson_test_setup.dat')
     benchmarkfile = os.path.join(datadir, 'meson_benchmark_setup.dat')
 
-    # Load all data files
-    with open(corefile, 'rb') as f:
-        coredata = pickle.load(f)
-    with open(buildfile, 'rb') as f:
-        builddata = pickle.load(f)
+    # coredata.dat and build.dat are unpickled lazily, section by section,
+    # so only the parts needed for the requested information are loaded.
+    core = coredata.load(corefile)
+    builddata = build.load(buildfile)
     with open(testfile, 'rb') as f:
         testdata = pickle.load(f)
     with open(benchmarkfile, 'rb') as f:
@@ -228,21 +227,21 @@ def run(args):
         installdata = None
 
     if options.list_targets:
-        list_targets(coredata, builddata, installdata)
+        list_targets(core, builddata, installdata)
     elif options.list_installed:
         list_installed(installdata)
     elif options.target_files is not None:
-        list_target_files(options.target_files, coredata, builddata)
+        list_target_files(options.target_files, core, builddata)
     elif options.buildsystem_files:
-        list_buildsystem_files(coredata, builddata)
+        list_buildsystem_files(core, builddata)
     elif options.buildoptions:
-        list_buildoptions(coredata, builddata)
+        list_buildoptions(core, builddata)
     elif options.tests:
         list_tests(testdata)
     elif options.benchmarks:
         list_tests(benchmarkdata)
     elif options.dependencies:
-        list_deps(coredata)
+        list_deps(core)
     elif options.projectinfo:
         list_projinfo(builddata)
     else:
@@ -13,6 +13,7 @@
 # limitations under the License.
 
 import sys, os, platform, io
+import atexit, queue, threading, time
 
 """This is (mostly) a standalone module used to write logging
 information about Meson runs. Some output goes to screen,
@@ -23,15 +24,123 @@ colorize_console = platform.system().lower() != 'windows' and os.isatty(sys.stdo
 log_dir = None
 log_file = None
 
+class LogWriter:
+    """Buffered writer for meson-log.txt.
+
+    Text is collected in memory and written out once flush_size characters
+    are pending or flush_interval seconds have passed since the last write
+    to the file. With threaded=True the file is written by a background
+    thread, which also writes out pending text when the log goes quiet.
+    flush() and close() only return once everything is in the file, and
+    the log is closed at exit so that it is complete even after a crash."""
+
+    flush_size = 64 * 1024
+    flush_interval = 1.0
+
+    def __init__(self, fname, threaded=False):
+        self.file = open(fname, 'w', encoding='utf8')
+        self.chunks = []
+        self.size = 0
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        self.queue = None
+        self.thread = None
+        if threaded:
+            self.queue = queue.Queue()
+            self.thread = threading.Thread(target=self.writer, daemon=True)
+            self.thread.start()
+
+    def write(self, text):
+        with self.lock:
+            self.chunks.append(text)
+            self.size += len(text)
+            if self.size >= self.flush_size or \
+                    time.monotonic() - self.last_flush >= self.flush_interval:
+                self.write_pending()
+
+    def write_pending(self):
+        # Called with the lock held
+        if self.chunks:
+            data = ''.join(self.chunks)
+            self.chunks = []
+            self.size = 0
+            if self.queue is not None:
+                self.queue.put(data)
+            else:
+                self.file.write(data)
+                self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def writer(self):
+        while True:
+            try:
+                data = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                with self.lock:
+                    self.write_pending()
+                continue
+            try:
+                if data is None:
+                    return
+                self.file.write(data)
+                self.file.flush()
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        with self.lock:
+            self.write_pending()
+        if self.queue is not None:
+            self.queue.join()
+
+    def close(self):
+        self.flush()
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+        self.file.close()
+
 def initialize(logdir):
     global log_dir, log_file
+    shutdown()
     log_dir = logdir
-    log_file = open(os.path.join(logdir, 'meson-log.txt'), 'w', encoding='utf8')
+    threaded = os.environ.get('MESON_LOG_WRITER') == 'thread'
+    log_file = LogWriter(os.path.join(logdir, 'meson-log.txt'), threaded)
+
+def flush():
+    if log_file is not None:
+        log_file.flush()
 
 def shutdown():
     global log_file
     if log_file is not None:
         log_file.close()
+        log_file = None
+
+atexit.register(shutdown)
+
+# Output of the calling thread is held back while it is being captured,
+# so that work done in parallel can be logged in a fixed order.
+capture_state = threading.local()
+
+def start_capture():
+    capture_state.records = []
+
+def stop_capture():
+    records = capture_state.records
+    capture_state.records = None
+    return records
+
+def replay(records):
+    for (func, args, kwargs) in records:
+        func(*args, **kwargs)
+
+def capture(func, args, kwargs):
+    records = getattr(capture_state, 'records', None)
+    if records is None:
+        return False
+    records.append((func, args, kwargs))
+    return True
 
 class AnsiDecorator:
     plain_code = "\033[0m"
@@ -83,22 +192,25 @@ def force_print(*args, **kwargs):
         print(cleaned)
 
 def debug(*args, **kwargs):
+    if capture(debug, args, kwargs):
+        return
     arr = process_markup(args, False)
     if log_file is not None:
         print(*arr, file=log_file, **kwargs) # Log file never gets ANSI codes.
-        log_file.flush()
 
 def log(*args, **kwargs):
+    if capture(log, args, kwargs):
+        return
     arr = process_markup(args, False)
     if log_file is not None:
         print(*arr, file=log_file, **kwargs) # Log file never gets ANSI codes.
-        log_file.flush()
     if colorize_console:
         arr = process_markup(args, True)
     force_print(*arr, **kwargs)
 
 def warning(*args, **kwargs):
     log(yellow('WARNING:'), *args, **kwargs)
+    flush()
 
 # Format a list for logging purposes as a string. It separates
 # all but the last item with commas, and the last with 'and'.
@@ -13,6 +13,10 @@
 # limitations under the License.
 
 import re
+import os
+import pickle
+import hashlib
+from . import coredata
 from .mesonlib import MesonException
 
 class ParseException(MesonException):
@@ -62,109 +66,115 @@ class Token:
         return self.tid == other.tid
 
 class Lexer:
+    keywords = {'true', 'false', 'if', 'else', 'elif',
+                'endif', 'and', 'or', 'not', 'foreach', 'endforeach'}
+    token_specification = [
+        # Need to be sorted longest to shortest.
+        ('ignore', r'[ \t]+'),
+        ('id', r'[_a-zA-Z][_0-9a-zA-Z]*'),
+        ('number', r'\d+'),
+        ('eol_cont', r'\\\n'),
+        ('eol', r'\n'),
+        ('multiline_string', r"'''(?:.|\n)*?'''"),
+        ('comment', r'#.*'),
+        ('lparen', r'\('),
+        ('rparen', r'\)'),
+        ('lbracket', r'\['),
+        ('rbracket', r'\]'),
+        ('dblquote', r'"'),
+        ('string', r"'(?:[^'\\]|(?:\\.))*'"),
+        ('comma', r','),
+        ('plusassign', r'\+='),
+        ('dot', r'\.'),
+        ('plus', r'\+'),
+        ('dash', r'-'),
+        ('star', r'\*'),
+        ('percent', r'%'),
+        ('fslash', r'/'),
+        ('colon', r':'),
+        ('equal', r'=='),
+        ('nequal', r'!='),
+        ('assign', r'='),
+        ('le', r'<='),
+        ('lt', r'<'),
+        ('ge', r'>='),
+        ('gt', r'>'),
+        ('questionmark', r'\?'),
+    ]
+    # All token patterns combined into a single regex with one named group per
+    # token type. Alternatives are tried left to right, so the ordering above
+    # still decides which token wins, but only one match is attempted at every
+    # position.
+    token_regex = re.compile('|'.join('(?P<%s>%s)' % spec for spec in token_specification))
+
     def __init__(self, code):
         self.code = code
-        self.keywords = {'true', 'false', 'if', 'else', 'elif',
-                         'endif', 'and', 'or', 'not', 'foreach', 'endforeach'}
-        self.token_specification = [
-            # Need to be sorted longest to shortest.
-            ('ignore', re.compile(r'[ \t]')),
-            ('id', re.compile('[_a-zA-Z][_0-9a-zA-Z]*')),
-            ('number', re.compile(r'\d+')),
-            ('eol_cont', re.compile(r'\\\n')),
-            ('eol', re.compile(r'\n')),
-            ('multiline_string', re.compile(r"'''(.|\n)*?'''", re.M)),
-            ('comment', re.compile(r'#.*')),
-            ('lparen', re.compile(r'\(')),
-            ('rparen', re.compile(r'\)')),
-            ('lbracket', re.compile(r'\[')),
-            ('rbracket', re.compile(r'\]')),
-            ('dblquote', re.compile(r'"')),
-            ('string', re.compile(r"'([^'\\]|(\\.))*'")),
-            ('comma', re.compile(r',')),
-            ('plusassign', re.compile(r'\+=')),
-            ('dot', re.compile(r'\.')),
-            ('plus', re.compile(r'\+')),
-            ('dash', re.compile(r'-')),
-            ('star', re.compile(r'\*')),
-            ('percent', re.compile(r'%')),
-            ('fslash', re.compile(r'/')),
-            ('colon', re.compile(r':')),
-            ('equal', re.compile(r'==')),
-            ('nequal', re.compile(r'!=')),
-            ('assign', re.compile(r'=')),
-            ('le', re.compile(r'<=')),
-            ('lt', re.compile(r'<')),
-            ('ge', re.compile(r'>=')),
-            ('gt', re.compile(r'>')),
-            ('questionmark', re.compile(r'\?')),
-        ]
 
     def getline(self, line_start):
         return self.code[line_start:self.code.find('\n', line_start)]
 
     def lex(self, subdir):
+        code = self.code
+        codelen = len(code)
+        match = self.token_regex.match
+        keywords = self.keywords
         line_start = 0
         lineno = 1
         loc = 0
         par_count = 0
         bracket_count = 0
         col = 0
-        while loc < len(self.code):
-            matched = False
-            value = None
-            for (tid, reg) in self.token_specification:
-                mo = reg.match(self.code, loc)
-                if mo:
-                    curline = lineno
-                    curline_start = line_start
-                    col = mo.start() - line_start
-                    matched = True
-                    span_start = loc
-                    loc = mo.end()
-                    span_end = loc
-                    bytespan = (span_start, span_end)
-                    match_text = mo.group()
-                    if tid == 'ignore' or tid == 'comment':
-                        break
-                    elif tid == 'lparen':
-                        par_count += 1
-                    elif tid == 'rparen':
-                        par_count -= 1
-                    elif tid == 'lbracket':
-                        bracket_count += 1
-                    elif tid == 'rbracket':
-                        bracket_count -= 1
-                    elif tid == 'dblquote':
-                        raise ParseException('Double quotes are not supported. Use single quotes.', self.getline(line_start), lineno, col)
-                    elif tid == 'string':
-                        value = match_text[1:-1]\
-                            .replace(r"\'", "'")\
-                            .replace(r" \\ ".strip(), r" \ ".strip())\
-                            .replace("\\n", "\n")
-                    elif tid == 'multiline_string':
-                        tid = 'string'
-                        value = match_text[3:-3]
-                        lines = match_text.split('\n')
-                        if len(lines) > 1:
-                            lineno += len(lines) - 1
-                            line_start = mo.end() - len(lines[-1])
-                    elif tid == 'number':
-                        value = int(match_text)
-                    elif tid == 'eol' or tid == 'eol_cont':
-                        lineno += 1
-                        line_start = loc
-                        if par_count > 0 or bracket_count > 0:
-                            break
-                    elif tid == 'id':
-                        if match_text in self.keywords:
-                            tid = match_text
-                        else:
-                            value = match_text
-                    yield Token(tid, subdir, curline_start, curline, col, bytespan, value)
-                    break
-            if not matched:
+        while loc < codelen:
+            mo = match(code, loc)
+            if mo is None:
                 raise ParseException('lexer', self.getline(line_start), lineno, col)
+            tid = mo.lastgroup
+            value = None
+            curline = lineno
+            curline_start = line_start
+            col = loc - line_start
+            span_start = loc
+            loc = mo.end()
+            bytespan = (span_start, loc)
+            if tid == 'ignore' or tid == 'comment':
+                continue
+            elif tid == 'id':
+                match_text = mo.group()
+                if match_text in keywords:
+                    tid = match_text
+                else:
+                    value = match_text
+            elif tid == 'eol' or tid == 'eol_cont':
+                lineno += 1
+                line_start = loc
+                if par_count > 0 or bracket_count > 0:
+                    continue
+            elif tid == 'lparen':
+                par_count += 1
+            elif tid == 'rparen':
+                par_count -= 1
+            elif tid == 'lbracket':
+                bracket_count += 1
+            elif tid == 'rbracket':
+                bracket_count -= 1
+            elif tid == 'dblquote':
+                raise ParseException('Double quotes are not supported. Use single quotes.', self.getline(line_start), lineno, col)
+            elif tid == 'string':
+                value = mo.group()[1:-1]\
+                    .replace(r"\'", "'")\
+                    .replace(r" \\ ".strip(), r" \ ".strip())\
+                    .replace("\\n", "\n")
+            elif tid == 'multiline_string':
+                tid = 'string'
+                match_text = mo.group()
+                value = match_text[3:-3]
+                lines = match_text.split('\n')
+                if len(lines) > 1:
+                    lineno += len(lines) - 1
+                    line_start = loc - len(lines[-1])
+            elif tid == 'number':
+                value = int(mo.group())
+            yield Token(tid, subdir, curline_start, curline, col, bytespan, value)
 
 class ElementaryNode:
     def __init__(self, token):
@@ -668,3 +678,91 @@ class Parser:
                 block.lines.append(curline)
             cond = self.accept('eol')
         return block
+
+class AstCache:
+    '''
+    Parsed build files of previous runs, stored in the private directory of
+    the build tree so that regenerating does not lex and parse build files
+    that have not changed.
+
+    An entry is reused without reading the file if its modification time and
+    size are unchanged. Otherwise the file is read and the entry is still
+    reused if the contents hash to the same value as before. Every AST is
+    pickled on its own and only unpickled when it is needed. Entries of
+    build files that a complete run did not parse are dropped by prune().
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        self.used = set()
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.filename, 'rb') as f:
+                obj = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except (EOFError, AttributeError, pickle.UnpicklingError):
+            return
+        # The node classes change between versions, never reuse old ASTs
+        if isinstance(obj, tuple) and len(obj) == 2 and obj[0] == coredata.version:
+            self.entries = obj[1]
+
+    def save(self):
+        if not self.dirty:
+            return
+        tmpname = self.filename + '~'
+        with open(tmpname, 'wb') as f:
+            pickle.dump((coredata.version, self.entries), f)
+        os.replace(tmpname, self.filename)
+        self.dirty = False
+
+    def prune(self):
+        '''
+        Drops the entries of build files that were not parsed since the
+        cache was loaded, such as deleted or renamed ones.
+        '''
+        for key in list(self.entries):
+            if key not in self.used:
+                del self.entries[key]
+                self.dirty = True
+
+    def __getstate__(self):
+        # The environment, and us with it, gets pickled into build.dat where
+        # the ASTs would only be dead weight.
+        state = self.__dict__.copy()
+        state['entries'] = {}
+        state['used'] = set()
+        state['dirty'] = False
+        return state
+
+    def parse(self, fname, subdir):
+        '''
+        Returns the AST of the build file fname, which belongs to subdir.
+        Raises the same exceptions as reading and parsing the file would.
+        '''
+        key = (fname, subdir)
+        st = os.stat(fname)
+        self.used.add(key)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+            return pickle.loads(entry[3])
+        with open(fname, encoding='utf8') as f:
+            code = f.read()
+        digest = hashlib.sha1(code.encode('utf8')).hexdigest()
+        if entry is not None and entry[2] == digest:
+            self.entries[key] = (st.st_mtime_ns, st.st_size, digest, entry[3])
+            self.dirty = True
+            return pickle.loads(entry[3])
+        ast = Parser(code, subdir).parse()
+        try:
+            blob = pickle.dumps(ast)
+        except RecursionError:
+            # Extremely deeply nested expressions, just parse them every time
+            self.entries.pop(key, None)
+        else:
+            self.entries[key] = (st.st_mtime_ns, st.st_size, digest, blob)
+        self.dirty = True
+        return ast
@@ -0,0 +1,437 @@
+# Copyright 2017 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This file contains an in-process reader for pkg-config .pc files.
+# PkgConfigDependency uses it to answer --modversion, --cflags, --libs
+# and --variable queries without spawning pkg-config for every one of
+# them. Anything it does not know how to handle exactly raises
+# PkgConfigUnsupported, and the query is then passed on to the binary.
+
+import os
+import re
+import shlex
+
+from .mesonlib import MesonException, Popen_safe, is_windows
+
+class PkgConfigUnsupported(MesonException):
+    '''The query must be answered by the pkg-config binary instead.'''
+
+class PkgConfigNotFound(MesonException):
+    '''A package or one of its requirements is missing or has the wrong version.'''
+
+_line_re = re.compile(r'^([A-Za-z0-9_.]+)\s*([:=])\s*(.*)$')
+_variable_re = re.compile(r'\$\$|\$\{([^}]*)\}')
+_requirement_re = re.compile(r'([^\s,<>=!]+)\s*(?:(<=|>=|!=|=|<|>)\s*([^\s,]+))?')
+_version_part_re = re.compile(r'[0-9]+|[A-Za-z]+')
+# Linker flags whose effect depends on where they are on the command line,
+# such as -Wl,--push-state/--pop-state, --whole-archive and -Bstatic.
+# pkg-config and pkgconf each have their own rules for merging them.
+_positional_flag_prefixes = ('-Wl,', '-Xlinker', '-Bstatic', '-Bdynamic', '-static', '-dynamic')
+
+def version_cmp(v1, v2):
+    '''Compare two versions the way pkg-config does (rpmvercmp).
+    Returns a negative, zero or positive number.'''
+    if v1 == v2:
+        return 0
+    parts1 = _version_part_re.findall(v1)
+    parts2 = _version_part_re.findall(v2)
+    for a, b in zip(parts1, parts2):
+        if a.isdigit():
+            if not b.isdigit():
+                return 1
+            a, b = int(a), int(b)
+        elif b.isdigit():
+            return -1
+        if a != b:
+            return 1 if a > b else -1
+    return len(parts1) - len(parts2)
+
+_version_ops = {
+    '=': lambda c: c == 0,
+    '!=': lambda c: c != 0,
+    '<': lambda c: c < 0,
+    '<=': lambda c: c <= 0,
+    '>': lambda c: c > 0,
+    '>=': lambda c: c >= 0,
+}
+
+class PkgConfigPackage:
+    def __init__(self, name, path, global_variables):
+        self.name = name
+        self.path = path
+        self.variables = {'pcfiledir': os.path.dirname(path)}
+        self.global_variables = global_variables
+        self.fields = {}
+        # Filled in by the resolver once the requirements are loaded.
+        self.requires = []
+        self.requires_private = []
+        self.flags = {}
+        self.parse()
+        for f in ('Name', 'Description', 'Version'):
+            if f not in self.fields:
+                raise PkgConfigUnsupported('Package {!r} has no {} field'.format(name, f))
+        if self.fields.get('Conflicts'):
+            raise PkgConfigUnsupported('Package {!r} declares conflicts'.format(name))
+        self.version = self.fields['Version']
+
+    def parse(self):
+        try:
+            with open(self.path, encoding='utf-8', errors='replace') as f:
+                content = f.read()
+        except OSError as e:
+            raise PkgConfigUnsupported('Could not read {!r}: {}'.format(self.path, e))
+        content = content.replace('\\\r\n', '').replace('\\\n', '')
+        for line in content.splitlines():
+            line = self.strip_comment(line).strip()
+            if not line:
+                continue
+            m = _line_re.match(line)
+            if not m:
+                continue
+            key, sep, value = m.groups()
+            value = self.expand(value.strip())
+            if sep == '=':
+                if key in self.variables and key != 'pcfiledir':
+                    raise PkgConfigUnsupported('Duplicate definition of variable {!r} '
+                                               'in {!r}'.format(key, self.path))
+                self.variables[key] = value
+            else:
+                if key == 'CFlags':
+                    key = 'Cflags'
+                self.fields[key] = value
+
+    @staticmethod
+    def strip_comment(line):
+        start = 0
+        while True:
+            i = line.find('#', start)
+            if i == -1:
+                return line
+            if i > 0 and line[i - 1] == '\\':
+                line = line[:i - 1] + line[i:]
+                start = i
+                continue
+            return line[:i]
+
+    def get_variable(self, name):
+        if name in self.global_variables:
+            return self.global_variables[name]
+        return self.variables.get(name)
+
+    def expand(self, value):
+        def repl(m):
+            if m.group(1) is None:
+                return '$'
+            v = self.get_variable(m.group(1))
+            if v is None:
+                raise PkgConfigUnsupported('Variable {!r} not defined in {!r}'
+                                           ''.format(m.group(1), self.path))
+            return v
+        return _variable_re.sub(repl, value)
+
+    def get_requirements(self, field):
+        return _requirement_re.findall(self.fields.get(field, ''))
+
+    def split_field(self, field):
+        try:
+            return shlex.split(self.fields.get(field, ''))
+        except ValueError as e:
+            raise PkgConfigUnsupported('Could not parse {} of {!r}: {}'
+                                       ''.format(field, self.path, e))
+
+class PkgConfigResolver:
+    '''Answers pkg-config queries for the .pc files found in search_path.
+    The directories are listed once, and every .pc file is read at most
+    once, when a query first needs it.'''
+
+    def __init__(self, search_path, sysroot='', system_include_dirs=(),
+                 system_library_dirs=(), allow_system_cflags=False,
+                 allow_system_libs=False, disable_uninstalled=False):
+        self.search_path = search_path
+        self.sysroot = sysroot
+        self.system_include_dirs = set(os.path.normpath(d) for d in system_include_dirs)
+        self.system_library_dirs = set(os.path.normpath(d) for d in system_library_dirs)
+        self.allow_system_cflags = allow_system_cflags
+        self.allow_system_libs = allow_system_libs
+        self.disable_uninstalled = disable_uninstalled
+        self.global_variables = {'pc_sysrootdir': sysroot or '/'}
+        self.index = {}
+        self.packages = {}
+        # Every package that could be parsed, including the ones whose
+        # requirements could not be satisfied.
+        self.parsed = {}
+        for d in search_path:
+            try:
+                entries = os.listdir(d)
+            except OSError:
+                continue
+            for e in sorted(entries):
+                if e.endswith('.pc'):
+                    self.index.setdefault(e[:-3], os.path.join(d, e))
+
+    def get_package(self, name, required_by=None):
+        try:
+            pkg = self.packages[name]
+        except KeyError:
+            pass
+        else:
+            if isinstance(pkg, Exception):
+                raise pkg
+            return pkg
+        try:
+            pkg = self.load_package(name, required_by)
+        except (PkgConfigUnsupported, PkgConfigNotFound) as e:
+            self.packages[name] = e
+            raise
+        return pkg
+
+    def load_package(self, name, required_by):
+        if not self.disable_uninstalled and name + '-uninstalled' in self.index:
+            raise PkgConfigUnsupported('Uninstalled package {!r} is present'.format(name))
+        path = self.index.get(name)
+        if path is None:
+            if required_by is None:
+                raise PkgConfigNotFound('Package {!r} was not found in the pkg-config '
+                                        'search path'.format(name))
+            raise PkgConfigNotFound('Package {!r}, required by {!r}, not found'
+                                    ''.format(name, required_by))
+        pkg = PkgConfigPackage(name, path, self.global_variables)
+        self.parsed[name] = pkg
+        # Store it before loading the requirements so that cycles terminate.
+        self.packages[name] = pkg
+        pkg.requires = self.load_requirements(pkg, 'Requires')
+        pkg.requires_private = self.load_requirements(pkg, 'Requires.private')
+        return pkg
+
+    def load_requirements(self, pkg, field):
+        result = []
+        for rname, op, version in pkg.get_requirements(field):
+            if not op and version:
+                raise PkgConfigUnsupported('Could not parse {} of {!r}'.format(field, pkg.path))
+            req = self.get_package(rname, pkg.name)
+            if op and not _version_ops[op](version_cmp(req.version, version)):
+                raise PkgConfigNotFound('Package {!r} requires \'{} {} {}\' but version of '
+                                        '{} is {}'.format(pkg.name, rname, op, version,
+                                                          rname, req.version))
+            result.append(req)
+        return result
+
+    def get_consulted_files(self, name):
+        '''Returns the search directories and the .pc files that were read to
+        answer queries about name, whether or not they succeeded.'''
+        files = list(self.search_path)
+        todo = [name]
+        seen = set()
+        while todo:
+            n = todo.pop()
+            if n in seen:
+                continue
+            seen.add(n)
+            for candidate in (n, n + '-uninstalled'):
+                if candidate in self.index:
+                    files.append(self.index[candidate])
+            pkg = self.parsed.get(n)
+            if pkg is not None:
+                for f in ('Requires', 'Requires.private'):
+                    todo += [r[0] for r in pkg.get_requirements(f)]
+        return files
+
+    @staticmethod
+    def walk(pkg, private):
+        '''Returns pkg and everything it requires, each package before the
+        ones it depends on.'''
+        order = []
+        visited = set()
+
+        def visit(p):
+            if p.name in visited:
+                return
+            visited.add(p.name)
+            reqs = p.requires + p.requires_private if private else p.requires
+            for r in reversed(reqs):
+                visit(r)
+            order.append(p)
+        visit(pkg)
+        order.reverse()
+        return order
+
+    def is_system_dir(self, path, dirs):
+        return os.path.normpath(path) in dirs
+
+    def parse_flags(self, pkg, field):
+        '''Splits a Cflags or Libs field into flags. Each flag is a tuple of
+        the arguments that belong together and the kind of flag it is.'''
+        try:
+            return pkg.flags[field]
+        except KeyError:
+            pass
+        result = []
+        args = pkg.split_field(field)
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            i += 1
+            if arg in ('-I', '-L', '-l', '-isystem', '-idirafter', '-framework') \
+                    and i < len(args):
+                value = args[i]
+                i += 1
+                if arg in ('-I', '-L', '-l'):
+                    arg, value = arg + value, None
+            elif arg.startswith(('-isystem', '-idirafter')):
+                prefix = '-isystem' if arg.startswith('-isystem') else '-idirafter'
+                arg, value = prefix, arg[len(prefix):]
+            else:
+                value = None
+            if arg.startswith('-I') or arg in ('-isystem', '-idirafter'):
+                path = arg[2:] if value is None else value
+                if not self.allow_system_cflags and arg.startswith('-I') and \
+                        self.is_system_dir(path, self.system_include_dirs):
+                    continue
+                path = self.sysroot + path
+                result.append((('-I' + path,) if value is None else (arg, path), 'I'))
+            elif arg.startswith('-L'):
+                path = arg[2:]
+                if not self.allow_system_libs and \
+                        self.is_system_dir(path, self.system_library_dirs):
+                    continue
+                result.append((('-L' + self.sysroot + path,), 'L'))
+            elif arg.startswith('-l'):
+                result.append(((arg,), 'l'))
+            elif arg.startswith(_positional_flag_prefixes):
+                raise PkgConfigUnsupported('{} of {!r} has flags that depend on their '
+                                           'position'.format(field, pkg.path))
+            else:
+                result.append(((arg,) if value is None else (arg, value), 'other'))
+        pkg.flags[field] = result
+        return result
+
+    @staticmethod
+    def merge_flags(flag_lists):
+        '''Concatenates the flags of several packages. Duplicate -l flags
+        keep their last position so that every library still comes after
+        the ones that need it; other duplicates keep the first one. This is
+        only safe because parse_flags() rejects flags that depend on their
+        position.'''
+        flags = [f for fl in flag_lists for f in fl]
+        last_lib = {}
+        for i, (args, kind) in enumerate(flags):
+            if kind == 'l':
+                last_lib[args] = i
+        seen = set()
+        result = []
+        for i, (args, kind) in enumerate(flags):
+            if kind == 'l':
+                if last_lib[args] != i:
+                    continue
+            elif args in seen:
+                continue
+            seen.add(args)
+            result.extend(args)
+        return result
+
+    def get_modversion(self, name):
+        return self.get_package(name).version
+
+    def get_cflags(self, name):
+        pkgs = self.walk(self.get_package(name), True)
+        return self.merge_flags([self.parse_flags(p, 'Cflags') for p in pkgs])
+
+    def get_libs(self, name, static=False):
+        pkgs = self.walk(self.get_package(name), static)
+        flag_lists = []
+        for p in pkgs:
+            flag_lists.append(self.parse_flags(p, 'Libs'))
+            if static:
+                flag_lists.append(self.parse_flags(p, 'Libs.private'))
+        return self.merge_flags(flag_lists)
+
+    def get_variable(self, name, variable):
+        if self.sysroot:
+            # pkg-config and pkgconf disagree on whether the sysroot is
+            # prepended to variables.
+            raise PkgConfigUnsupported('Variables are not resolved with a sysroot')
+        v = self.get_package(name).get_variable(variable)
+        return '' if v is None else v
+
+# Default search and system paths of each pkg-config binary, queried once.
+_binary_defaults = {}
+# The resolver for the current environment, and what it was built from.
+_current = (None, None)
+
+def _split_path(value):
+    return [p for p in value.split(os.pathsep) if p]
+
+def _query_binary(pkgbin, variable):
+    try:
+        p, out = Popen_safe([pkgbin, '--variable=' + variable, 'pkg-config'])[0:2]
+    except OSError:
+        return None
+    if p.returncode != 0:
+        return None
+    return out.strip()
+
+def _get_binary_defaults(pkgbin):
+    try:
+        return _binary_defaults[pkgbin]
+    except KeyError:
+        pass
+    defaults = None
+    pc_path = _query_binary(pkgbin, 'pc_path')
+    if pc_path:
+        # Only pkgconf reports these, pkg-config falls back to
+        # PKG_CONFIG_SYSTEM_*_PATH or its usual built-in values.
+        incdirs = _query_binary(pkgbin, 'pc_system_includedirs') or '/usr/include'
+        libdirs = _query_binary(pkgbin, 'pc_system_libdirs') or os.pathsep.join(['/usr/lib', '/lib'])
+        defaults = (_split_path(pc_path), _split_path(incdirs), _split_path(libdirs))
+    _binary_defaults[pkgbin] = defaults
+    return defaults
+
+def get_resolver(pkgbin):
+    '''Returns a resolver matching what pkgbin would see in the current
+    environment, or None if all queries have to go to the binary.'''
+    global _current
+    if is_windows() or os.environ.get('MESON_PKG_CONFIG_RESOLVER') == 'external':
+        return None
+    defaults = _get_binary_defaults(pkgbin)
+    if defaults is None:
+        return None
+    pc_path, incdirs, libdirs = defaults
+    env = os.environ
+    search_path = _split_path(env.get('PKG_CONFIG_PATH', ''))
+    if 'PKG_CONFIG_LIBDIR' in env:
+        search_path += _split_path(env['PKG_CONFIG_LIBDIR'])
+    else:
+        search_path += pc_path
+    if 'PKG_CONFIG_SYSTEM_INCLUDE_PATH' in env:
+        incdirs = _split_path(env['PKG_CONFIG_SYSTEM_INCLUDE_PATH'])
+    if 'PKG_CONFIG_SYSTEM_LIBRARY_PATH' in env:
+        libdirs = _split_path(env['PKG_CONFIG_SYSTEM_LIBRARY_PATH'])
+    # Directory mtimes change when .pc files are added or removed, for
+    # instance by pkgconfig.generate() between two lookups.
+    mtimes = []
+    for d in search_path:
+        try:
+            mtimes.append(os.stat(d).st_mtime_ns)
+        except OSError:
+            mtimes.append(None)
+    kwargs = {'sysroot': env.get('PKG_CONFIG_SYSROOT_DIR', '').rstrip('/'),
+              'system_include_dirs': incdirs,
+              'system_library_dirs': libdirs,
+              'allow_system_cflags': 'PKG_CONFIG_ALLOW_SYSTEM_CFLAGS' in env,
+              'allow_system_libs': 'PKG_CONFIG_ALLOW_SYSTEM_LIBS' in env,
+              'disable_uninstalled': 'PKG_CONFIG_DISABLE_UNINSTALLED' in env}
+    key = (pkgbin, tuple(search_path), tuple(mtimes), tuple(sorted(kwargs.items())))
+    if _current[0] != key:
+        _current = (key, PkgConfigResolver(search_path, **kwargs))
+    return _current[1]
@@ -13,9 +13,26 @@
 # limitations under the License.
 
 
-import sys, struct
+import sys, struct, mmap
 
 SHT_STRTAB = 3
+SHT_NOBITS = 8
+SHT_DYNSYM = 11
+SHT_GNU_VERDEF = 0x6ffffffd
+SHT_GNU_VERSYM = 0x6fffffff
+SHF_WRITE = 0x1
+SHF_ALLOC = 0x2
+SHF_EXECINSTR = 0x4
+SHN_UNDEF = 0
+SHN_ABS = 0xfff1
+SHN_COMMON = 0xfff2
+STB_LOCAL = 0
+STB_WEAK = 2
+STB_GNU_UNIQUE = 10
+STT_OBJECT = 1
+STT_GNU_IFUNC = 10
+VERSYM_HIDDEN = 0x8000
+VER_FLG_BASE = 0x1
 DT_NEEDED = 1
 DT_RPATH = 15
 DT_RUNPATH = 29
@@ -24,114 +41,81 @@ DT_SONAME = 14
 DT_MIPS_RLD_MAP_REL = 1879048245
 
 class DataSizes:
+    '''
+    Precompiled layouts of the ELF structures for one word size and byte
+    order, so that every header or table entry is decoded with one call.
+    '''
     def __init__(self, ptrsize, is_le):
         if is_le:
             p = '<'
         else:
             p = '>'
-        self.Half = p + 'h'
-        self.HalfSize = 2
-        self.Word = p + 'I'
-        self.WordSize = 4
-        self.Sword = p + 'i'
-        self.SwordSize = 4
         if ptrsize == 64:
-            self.Addr = p + 'Q'
-            self.AddrSize = 8
-            self.Off = p + 'Q'
-            self.OffSize = 8
-            self.XWord = p + 'Q'
-            self.XWordSize = 8
-            self.Sxword = p + 'q'
-            self.SxwordSize = 8
+            self.Header = struct.Struct(p + '16sHHIQQQIHHHHHH')
+            self.Shdr = struct.Struct(p + 'IIQQQQIIQQ')
+            self.Dyn = struct.Struct(p + 'qQ')
+            self.Sym = struct.Struct(p + 'IBBHQQ')
         else:
-            self.Addr = p + 'I'
-            self.AddrSize = 4
-            self.Off = p + 'I'
-            self.OffSize = 4
-
-class DynamicEntry(DataSizes):
-    def __init__(self, ifile, ptrsize, is_le):
-        super().__init__(ptrsize, is_le)
-        self.ptrsize = ptrsize
-        if ptrsize == 64:
-            self.d_tag = struct.unpack(self.Sxword, ifile.read(self.SxwordSize))[0]
-            self.val = struct.unpack(self.XWord, ifile.read(self.XWordSize))[0]
-        else:
-            self.d_tag = struct.unpack(self.Sword, ifile.read(self.SwordSize))[0]
-            self.val = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
+            self.Header = struct.Struct(p + '16sHHIIIIIHHHHHH')
+            self.Shdr = struct.Struct(p + 'IIIIIIIIII')
+            self.Dyn = struct.Struct(p + 'iI')
+            self.Sym = struct.Struct(p + 'IIIBBH')
+        self.Verdef = struct.Struct(p + 'HHHHIII')
+        self.Verdaux = struct.Struct(p + 'II')
+        self.Versym = p + '{}H'
 
-    def write(self, ofile):
-        if self.ptrsize == 64:
-            ofile.write(struct.pack(self.Sxword, self.d_tag))
-            ofile.write(struct.pack(self.XWord, self.val))
-        else:
-            ofile.write(struct.pack(self.Sword, self.d_tag))
-            ofile.write(struct.pack(self.Word, self.val))
+class DynamicEntry:
+    def __init__(self, d_tag, val):
+        self.d_tag = d_tag
+        self.val = val
 
-class SectionHeader(DataSizes):
-    def __init__(self, ifile, ptrsize, is_le):
-        super().__init__(ptrsize, is_le)
-        if ptrsize == 64:
-            is_64 = True
-        else:
-            is_64 = False
-# Elf64_Word
-        self.sh_name = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Word
-        self.sh_type = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Xword
-        if is_64:
-            self.sh_flags = struct.unpack(self.XWord, ifile.read(self.XWordSize))[0]
-        else:
-            self.sh_flags = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Addr
-        self.sh_addr = struct.unpack(self.Addr, ifile.read(self.AddrSize))[0]
-# Elf64_Off
-        self.sh_offset = struct.unpack(self.Off, ifile.read(self.OffSize))[0]
-# Elf64_Xword
-        if is_64:
-            self.sh_size = struct.unpack(self.XWord, ifile.read(self.XWordSize))[0]
-        else:
-            self.sh_size = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Word
-        self.sh_link = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Word
-        self.sh_info = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-# Elf64_Xword
-        if is_64:
-            self.sh_addralign = struct.unpack(self.XWord, ifile.read(self.XWordSize))[0]
-        else:
-            self.sh_addralign = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
-#Elf64_Xword
-        if is_64:
-            self.sh_entsize = struct.unpack(self.XWord, ifile.read(self.XWordSize))[0]
-        else:
-            self.sh_entsize = struct.unpack(self.Word, ifile.read(self.WordSize))[0]
+class SectionHeader:
+    def __init__(self, fields):
+        (self.sh_name, self.sh_type, self.sh_flags, self.sh_addr,
+         self.sh_offset, self.sh_size, self.sh_link, self.sh_info,
+         self.sh_addralign, self.sh_entsize) = fields
 
 class Elf(DataSizes):
-    def __init__(self, bfile, verbose=True):
+    def __init__(self, bfile, verbose=True, readonly=False):
         self.bfile = bfile
         self.verbose = verbose
-        self.bf = open(bfile, 'r+b')
+        self.readonly = readonly
+        self.bf = open(bfile, 'rb' if readonly else 'r+b')
+        self.mm = None
         try:
+            self.mm = self.map_file()
             (self.ptrsize, self.is_le) = self.detect_elf_type()
             super().__init__(self.ptrsize, self.is_le)
             self.parse_header()
             self.parse_sections()
             self.parse_dynamic()
         except:
-            self.bf.close()
+            self.close()
             raise
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self.mm = None
         self.bf.close()
 
+    def map_file(self):
+        try:
+            if self.readonly:
+                return mmap.mmap(self.bf.fileno(), 0, access=mmap.ACCESS_READ)
+            return mmap.mmap(self.bf.fileno(), 0)
+        except ValueError:
+            # Empty files can not be mapped
+            return b''
+
     def detect_elf_type(self):
-        data = self.bf.read(6)
+        data = self.mm[:6]
         if data[1:4] != b'ELF':
             # This script gets called to non-elf targets too
             # so just ignore them.
@@ -153,78 +137,155 @@ class Elf(DataSizes):
         return ptrsize, is_le
 
     def parse_header(self):
-        self.bf.seek(0)
-        self.e_ident = struct.unpack('16s', self.bf.read(16))[0]
-        self.e_type = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_machine = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_version = struct.unpack(self.Word, self.bf.read(self.WordSize))[0]
-        self.e_entry = struct.unpack(self.Addr, self.bf.read(self.AddrSize))[0]
-        self.e_phoff = struct.unpack(self.Off, self.bf.read(self.OffSize))[0]
-        self.e_shoff = struct.unpack(self.Off, self.bf.read(self.OffSize))[0]
-        self.e_flags = struct.unpack(self.Word, self.bf.read(self.WordSize))[0]
-        self.e_ehsize = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_phentsize = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_phnum = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_shentsize = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_shnum = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
-        self.e_shstrndx = struct.unpack(self.Half, self.bf.read(self.HalfSize))[0]
+        (self.e_ident, self.e_type, self.e_machine, self.e_version,
+         self.e_entry, self.e_phoff, self.e_shoff, self.e_flags,
+         self.e_ehsize, self.e_phentsize, self.e_phnum, self.e_shentsize,
+         self.e_shnum, self.e_shstrndx) = self.Header.unpack_from(self.mm, 0)
 
     def parse_sections(self):
-        self.bf.seek(self.e_shoff)
-        self.sections = []
-        for i in range(self.e_shnum):
-            self.sections.append(SectionHeader(self.bf, self.ptrsize, self.is_le))
-
-    def read_str(self):
-        arr = []
-        x = self.bf.read(1)
-        while x != b'\0':
-            arr.append(x)
-            x = self.bf.read(1)
-            if x == b'':
-                raise RuntimeError('Tried to read past the end of the file')
-        return b''.join(arr)
+        end = self.e_shoff + self.e_shnum * self.Shdr.size
+        self.sections = [SectionHeader(f) for f in self.Shdr.iter_unpack(self.mm[self.e_shoff:end])]
+        # Section name -> header, filled in by find_section()
+        self.section_index = None
 
-    def find_section(self, target_name):
+    def read_str(self, offset):
+        end = self.mm.find(b'\0', offset)
+        if end == -1:
+            raise RuntimeError('Tried to read past the end of the file')
+        return self.mm[offset:end]
+
+    def get_section_names(self):
         section_names = self.sections[self.e_shstrndx]
-        for i in self.sections:
-            self.bf.seek(section_names.sh_offset + i.sh_name)
-            name = self.read_str()
-            if name == target_name:
-                return i
+        return [self.read_str(section_names.sh_offset + i.sh_name) for i in self.sections]
+
+    def find_section(self, target_name):
+        if self.section_index is None:
+            self.section_index = {}
+            for (name, sec) in zip(self.get_section_names(), self.sections):
+                self.section_index.setdefault(name, sec)
+        return self.section_index.get(target_name)
 
     def parse_dynamic(self):
         sec = self.find_section(b'.dynamic')
         self.dynamic = []
         if sec is None:
             return
-        self.bf.seek(sec.sh_offset)
-        while True:
-            e = DynamicEntry(self.bf, self.ptrsize, self.is_le)
-            self.dynamic.append(e)
-            if e.d_tag == 0:
+        end = sec.sh_offset + sec.sh_size // self.Dyn.size * self.Dyn.size
+        for (d_tag, val) in self.Dyn.iter_unpack(self.mm[sec.sh_offset:end]):
+            self.dynamic.append(DynamicEntry(d_tag, val))
+            if d_tag == 0:
                 break
 
     def print_section_names(self):
-        section_names = self.sections[self.e_shstrndx]
-        for i in self.sections:
-            self.bf.seek(section_names.sh_offset + i.sh_name)
-            name = self.read_str()
+        for name in self.get_section_names():
             print(name.decode())
 
     def print_soname(self):
-        soname = None
-        strtab = None
-        for i in self.dynamic:
-            if i.d_tag == DT_SONAME:
-                soname = i
-            if i.d_tag == DT_STRTAB:
-                strtab = i
-        if soname is None or strtab is None:
+        soname = self.get_soname()
+        if soname is None:
             print("This file does not have a soname")
             return
-        self.bf.seek(strtab.val + soname.val)
-        print(self.read_str())
+        print(soname)
+
+    def get_soname(self):
+        offset = self.get_entry_offset(DT_SONAME)
+        if offset is None:
+            return None
+        return self.read_str(offset)
+
+    def get_dynamic_symbols(self):
+        '''
+        Returns the (name, type) pairs of the defined global symbols of the
+        dynamic symbol table, as 'nm --dynamic --extern-only --defined-only'
+        lists them. Names of versioned symbols carry their version, with '@@'
+        for the default version of a symbol.
+        '''
+        dynsym = None
+        versym = None
+        verdef = None
+        for sec in self.sections:
+            if sec.sh_type == SHT_DYNSYM:
+                dynsym = sec
+            elif sec.sh_type == SHT_GNU_VERSYM:
+                versym = sec
+            elif sec.sh_type == SHT_GNU_VERDEF:
+                verdef = sec
+        if dynsym is None or dynsym.sh_size == 0:
+            return []
+        strtab = self.sections[dynsym.sh_link].sh_offset
+        if self.ptrsize == 64:
+            fields = lambda e: (e[0], e[1], e[3])
+        else:
+            fields = lambda e: (e[0], e[3], e[5])
+        count = dynsym.sh_size // self.Sym.size
+        end = dynsym.sh_offset + count * self.Sym.size
+        entries = self.Sym.iter_unpack(self.mm[dynsym.sh_offset:end])
+        versions = self.get_version_names(verdef)
+        if versym is not None and versions:
+            vers = struct.unpack(self.Versym.format(count),
+                                 self.mm[versym.sh_offset:versym.sh_offset + 2 * count])
+        else:
+            vers = None
+        result = []
+        for (i, e) in enumerate(entries):
+            (st_name, st_info, st_shndx) = fields(e)
+            bind = st_info >> 4
+            if st_name == 0 or bind == STB_LOCAL or st_shndx == SHN_UNDEF:
+                continue
+            name = self.read_str(strtab + st_name)
+            if vers is not None:
+                v = versions.get(vers[i] & ~VERSYM_HIDDEN)
+                if v is not None and v != name:
+                    sep = b'@' if vers[i] & VERSYM_HIDDEN else b'@@'
+                    name += sep + v
+            result.append((name.decode('utf-8', 'replace'),
+                           self.symbol_type(st_info, st_shndx)))
+        return result
+
+    def get_version_names(self, verdef):
+        '''Maps the version indexes defined in the file to their names.'''
+        versions = {}
+        if verdef is None:
+            return versions
+        strtab = self.sections[verdef.sh_link].sh_offset
+        offset = verdef.sh_offset
+        for _ in range(verdef.sh_info):
+            (_, flags, ndx, cnt, _, aux, nxt) = self.Verdef.unpack_from(self.mm, offset)
+            # The base version is the name of the file itself
+            if cnt > 0 and not flags & VER_FLG_BASE:
+                vda_name = self.Verdaux.unpack_from(self.mm, offset + aux)[0]
+                versions[ndx] = self.read_str(strtab + vda_name)
+            if nxt == 0:
+                break
+            offset += nxt
+        return versions
+
+    def symbol_type(self, st_info, st_shndx):
+        '''The letter nm uses for a defined global symbol.'''
+        bind = st_info >> 4
+        stype = st_info & 0xf
+        if stype == STT_GNU_IFUNC:
+            return 'i'
+        if bind == STB_WEAK:
+            return 'V' if stype == STT_OBJECT else 'W'
+        if bind == STB_GNU_UNIQUE:
+            return 'u'
+        if st_shndx == SHN_ABS:
+            return 'A'
+        if st_shndx == SHN_COMMON:
+            return 'C'
+        if st_shndx >= len(self.sections):
+            return '?'
+        sec = self.sections[st_shndx]
+        if sec.sh_flags & SHF_EXECINSTR:
+            return 'T'
+        if sec.sh_type == SHT_NOBITS:
+            return 'B'
+        if sec.sh_flags & SHF_WRITE:
+            return 'D'
+        if sec.sh_flags & SHF_ALLOC:
+            return 'R'
+        return 'N'
 
     def get_entry_offset(self, entrynum):
         sec = self.find_section(b'.dynstr')
@@ -238,46 +299,34 @@ class Elf(DataSizes):
         if offset is None:
             print("This file does not have an rpath.")
         else:
-            self.bf.seek(offset)
-            print(self.read_str())
+            print(self.read_str(offset))
 
     def print_runpath(self):
         offset = self.get_entry_offset(DT_RUNPATH)
         if offset is None:
             print("This file does not have a runpath.")
         else:
-            self.bf.seek(offset)
-            print(self.read_str())
+            print(self.read_str(offset))
 
     def print_deps(self):
         sec = self.find_section(b'.dynstr')
-        deps = []
         for i in self.dynamic:
             if i.d_tag == DT_NEEDED:
-                deps.append(i)
-        for i in deps:
-            offset = sec.sh_offset + i.val
-            self.bf.seek(offset)
-            name = self.read_str()
-            print(name)
+                print(self.read_str(sec.sh_offset + i.val))
 
     def fix_deps(self, prefix):
         sec = self.find_section(b'.dynstr')
-        deps = []
         for i in self.dynamic:
-            if i.d_tag == DT_NEEDED:
-                deps.append(i)
-        for i in deps:
+            if i.d_tag != DT_NEEDED:
+                continue
             offset = sec.sh_offset + i.val
-            self.bf.seek(offset)
-            name = self.read_str()
+            name = self.read_str(offset)
             if name.startswith(prefix):
                 basename = name.split(b'/')[-1]
                 padding = b'\0' * (len(name) - len(basename))
                 newname = basename + padding
                 assert(len(newname) == len(name))
-                self.bf.seek(offset)
-                self.bf.write(newname)
+                self.mm[offset:offset + len(newname)] = newname
 
     def fix_rpath(self, new_rpath):
         # The path to search for can be either rpath or runpath.
@@ -293,13 +342,12 @@ class Elf(DataSizes):
             if self.verbose:
                 print('File does not have rpath. It should be a fully static executable.')
             return
-        self.bf.seek(rp_off)
-        old_rpath = self.read_str()
+        old_rpath = self.read_str(rp_off)
         if len(old_rpath) < len(new_rpath):
             sys.exit("New rpath must not be longer than the old one.")
-        self.bf.seek(rp_off)
-        self.bf.write(new_rpath)
-        self.bf.write(b'\0' * (len(old_rpath) - len(new_rpath) + 1))
+        # Patch the string in place, padding the rest of the old one
+        new_value = new_rpath + b'\0' * (len(old_rpath) - len(new_rpath) + 1)
+        self.mm[rp_off:rp_off + len(new_value)] = new_value
         if len(new_rpath) == 0:
             self.remove_rpath_entry(entrynum)
 
@@ -318,9 +366,10 @@ class Elf(DataSizes):
             if entry.d_tag == DT_MIPS_RLD_MAP_REL:
                 entry.val += 2 * (self.ptrsize // 8)
                 break
-        self.bf.seek(sec.sh_offset)
+        offset = sec.sh_offset
         for entry in self.dynamic:
-            entry.write(self.bf)
+            self.Dyn.pack_into(self.mm, offset, entry.d_tag, entry.val)
+            offset += self.Dyn.size
         return None
 
 def run(args):
@@ -329,11 +378,12 @@ def run(args):
         print('Don\'t run this unless you know what you are doing.')
         print('%s: <binary file> <prefix>' % sys.argv[0])
         exit(1)
-    with Elf(args[0]) as e:
-        if len(args) == 1:
+    if len(args) == 1:
+        with Elf(args[0], readonly=True) as e:
             e.print_rpath()
             e.print_runpath()
-        else:
+    else:
+        with Elf(args[0]) as e:
             new_rpath = args[1]
             e.fix_rpath(new_rpath)
     return 0
@@ -12,13 +12,28 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import sys, pickle, os, shutil, subprocess, gzip, platform, errno
+import sys, pickle, os, shutil, subprocess, gzip, platform, errno, stat
+import hashlib, multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from . import depfixer
 from . import destdir_join
 from ..mesonlib import is_windows, Popen_safe
+from ..coredata import version as coredata_version
 
-install_log_file = None
+# Lines of the install log, written out in one go when installation ends.
+install_log = []
+
+# How to decide whether an already installed file can be kept, set with the
+# MESON_INSTALL_COMPARE environment variable:
+#   stat: same size and modification time as the file to install
+#   hash: same size and contents as the file to install
+#   copy: always copy
+compare_modes = ('stat', 'hash', 'copy')
+
+# Bumped whenever the entries of install_manifest.dat change
+manifest_format = 2
 
 def set_mode(path, mode):
     if mode is None:
@@ -54,30 +69,236 @@ def set_mode(path, mode):
             print(msg.format(path, mode.perms_s, e.strerror))
 
 def append_to_log(line):
-    install_log_file.write(line)
-    if not line.endswith('\n'):
-        install_log_file.write('\n')
-    install_log_file.flush()
+    install_log.append(line.rstrip('\n'))
 
-def do_copyfile(from_file, to_file):
+def write_log(filename):
+    with open(filename, 'w') as lf:
+        lf.write('\n'.join(install_log) + '\n')
+
+def file_digest(fname):
+    h = hashlib.sha256()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_manifest(filename):
+    '''
+    Returns the destdir and the entries of the manifest of the previous
+    install. Entries map each installed file to a tuple of (source, source
+    size, source mtime, size, mtime, sha256 or None, post-processing
+    parameters) as they were at the end of that install.
+    '''
+    try:
+        with open(filename, 'rb') as f:
+            (file_version, file_format, destdir, entries) = pickle.load(f)
+    except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+        return (None, {})
+    if file_version != coredata_version or file_format != manifest_format:
+        return (None, {})
+    return (destdir, entries)
+
+def save_manifest(filename, destdir, installed):
+    entries = {}
+    for (to_file, (from_file, src_size, src_mtime, digest, post)) in installed.items():
+        # Stat again because targets may have been stripped or had their
+        # rpath changed after they were copied.
+        try:
+            st = os.stat(to_file)
+        except OSError:
+            continue
+        entries[to_file] = (from_file, src_size, src_mtime, st.st_size, st.st_mtime_ns, digest, post)
+    tempfilename = filename + '~'
+    with open(tempfilename, 'wb') as f:
+        pickle.dump((coredata_version, manifest_format, destdir, entries), f)
+    os.replace(tempfilename, filename)
+
+class CopyPlan:
+    '''
+    Collects all files to install before anything is copied. Directories are
+    then created once and the files are copied by a pool of threads. Files
+    that are already installed and identical are not copied again.
+    '''
+    def __init__(self, compare='stat', manifest=None):
+        # Directory -> source directory to copy the stat info from, or None
+        self.dirs = OrderedDict()
+        # Destination -> (copy function, source, mode, post-processing
+        # parameters). A destination that is installed to twice is only
+        # copied once, from the last source.
+        self.files = OrderedDict()
+        # Modes to set on directories once everything has been copied
+        self.dir_modes = []
+        self.compare = compare
+        self.manifest = manifest if manifest is not None else {}
+        # Destination -> (source, source size, source mtime, sha256 or None,
+        # post-processing parameters)
+        self.installed = OrderedDict()
+        self.skipped = set()
+        # Skipped files that have not changed since the end of the previous
+        # install, so any processing after copying was already done on them.
+        self.unchanged = set()
+
+    def add_dir(self, path, stat_from=None):
+        if path not in self.dirs:
+            self.dirs[path] = stat_from
+
+    def set_dir_mode(self, path, mode):
+        self.dir_modes.append((path, mode))
+
+    def add_file(self, copier, from_file, to_file, mode=None, post=None):
+        '''
+        post describes how the file is processed after copying, such as the
+        strip command and rpath of targets. A file is only kept as it is if
+        it was processed the same way by the previous install.
+        '''
+        self.add_dir(os.path.dirname(to_file))
+        self.files.pop(to_file, None)
+        self.files[to_file] = (copier, from_file, mode, post)
+
+    def create_dirs(self):
+        for (path, stat_from) in self.dirs.items():
+            if os.path.isdir(path):
+                continue
+            if os.path.exists(path):
+                print('Tried to copy directory %s but a file of that name already exists.' % path)
+                sys.exit(1)
+            os.makedirs(path)
+            if stat_from is not None:
+                shutil.copystat(stat_from, path)
+
+    def is_up_to_date(self, copier, from_file, to_file, src_stat, post):
+        '''
+        Returns whether to_file can be kept as it is, either False, 'unchanged'
+        or 'identical', and the digest of from_file if it was computed.
+        '''
+        try:
+            dst_stat = os.stat(to_file)
+        except OSError:
+            return (False, None)
+        old = self.manifest.get(to_file)
+        if old is not None and old[0] != from_file:
+            old = None
+        dst_unchanged = old is not None and old[3:5] == (dst_stat.st_size, dst_stat.st_mtime_ns)
+        # Neither side changed since the previous install. This also covers
+        # files that are modified while installing them, e.g. compressed man
+        # pages and targets that get stripped, as long as they are processed
+        # the same way as the last time.
+        if dst_unchanged and old[1:3] == (src_stat.st_size, src_stat.st_mtime_ns) and old[6] == post:
+            return ('unchanged', old[5])
+        if copier not in (do_copyfile, do_copy_tree_file) or src_stat.st_size != dst_stat.st_size:
+            return (False, None)
+        if self.compare == 'hash':
+            digest = file_digest(from_file)
+            if dst_unchanged and old[5] is not None:
+                dst_digest = old[5]
+            else:
+                dst_digest = file_digest(to_file)
+            return ('identical' if digest == dst_digest else False, digest)
+        return ('identical' if src_stat.st_mtime_ns == dst_stat.st_mtime_ns else False, None)
+
+    def copy_one(self, item):
+        (to_file, (copier, from_file, mode, post)) = item
+        src_stat = os.lstat(from_file)
+        if self.compare != 'copy' and not stat.S_ISLNK(src_stat.st_mode):
+            (up_to_date, digest) = self.is_up_to_date(copier, from_file, to_file, src_stat, post)
+        else:
+            (up_to_date, digest) = (False, None)
+        if not up_to_date:
+            copier(from_file, to_file)
+            if self.compare == 'hash' and digest is None and copier is do_copyfile:
+                digest = file_digest(to_file)
+        set_mode(to_file, mode)
+        return (to_file, up_to_date, (from_file, src_stat.st_size, src_stat.st_mtime_ns, digest, post))
+
+    def execute(self):
+        self.create_dirs()
+        if self.files:
+            num_workers = min(len(self.files), multiprocessing.cpu_count() * 2)
+            with ThreadPoolExecutor(max_workers=num_workers) as executor:
+                # map() returns results in submission order, which keeps the
+                # install log deterministic.
+                for (to_file, up_to_date, record) in executor.map(self.copy_one, self.files.items()):
+                    if up_to_date:
+                        self.skipped.add(to_file)
+                    if up_to_date == 'unchanged':
+                        self.unchanged.add(to_file)
+                    self.installed[to_file] = record
+                    append_to_log(to_file)
+        for (path, mode) in self.dir_modes:
+            set_mode(path, mode)
+        if self.skipped:
+            print('Skipped {} files that were already up to date.'.format(len(self.skipped)))
+
+def copy_file_data(from_file, to_file):
+    '''
+    Copies the contents of a file, letting the kernel do the copy with
+    copy_file_range() or sendfile() where available.
+    '''
+    with open(from_file, 'rb') as fsrc, open(to_file, 'wb') as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        for name in ('copy_file_range', 'sendfile'):
+            func = getattr(os, name, None)
+            if func is None or size == 0:
+                continue
+            offset = 0
+            try:
+                while offset < size:
+                    if name == 'sendfile':
+                        sent = func(fdst.fileno(), fsrc.fileno(), offset, size - offset)
+                    else:
+                        sent = func(fsrc.fileno(), fdst.fileno(), size - offset, offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+            except OSError as e:
+                # Unsupported for this pair of files, e.g. across file systems.
+                if offset == 0 and e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                               errno.EOPNOTSUPP, errno.EBADF, errno.ENOTSOCK):
+                    continue
+                raise
+            if offset == size:
+                return
+            # The file changed size while copying, fall back to a plain copy.
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            break
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+
+def check_copyfile(from_file, to_file):
     if not os.path.isfile(from_file):
         raise RuntimeError('Tried to install something that isn\'t a file:'
                            '{!r}'.format(from_file))
-    # copyfile fails if the target file already exists, so remove it to
-    # allow overwriting a previous install. If the target is not a file, we
-    # want to give a readable error.
+    if os.path.exists(to_file) and not os.path.isfile(to_file):
+        raise RuntimeError('Destination {!r} already exists and is not '
+                           'a file'.format(to_file))
+
+def do_copyfile(from_file, to_file):
+    # Opening the target for writing fails if the target file is read-only, so
+    # remove it to allow overwriting a previous install.
     if os.path.exists(to_file):
-        if not os.path.isfile(to_file):
-            raise RuntimeError('Destination {!r} already exists and is not '
-                               'a file'.format(to_file))
         os.unlink(to_file)
-    shutil.copyfile(from_file, to_file)
+    copy_file_data(from_file, to_file)
+    shutil.copystat(from_file, to_file)
+
+def do_copy_tree_file(from_file, to_file):
+    if os.path.lexists(to_file):
+        os.unlink(to_file)
+    if os.path.islink(from_file):
+        os.symlink(os.readlink(from_file), to_file)
+    else:
+        copy_file_data(from_file, to_file)
+    shutil.copystat(from_file, to_file, follow_symlinks=False)
+
+def do_gzipfile(from_file, to_file):
+    with open(to_file, 'wb') as of:
+        with open(from_file, 'rb') as sf:
+            of.write(gzip.compress(sf.read()))
     shutil.copystat(from_file, to_file)
-    append_to_log(to_file)
 
-def do_copydir(src_prefix, src_dir, dst_dir):
+def do_copydir(plan, src_prefix, src_dir, dst_dir):
     '''
-    Copies the directory @src_prefix (full path) into @dst_dir
+    Plans copying the directory @src_prefix (full path) into @dst_dir
 
     @src_dir is simply the parent directory of @src_prefix
     '''
@@ -86,27 +307,15 @@ def do_copydir(src_prefix, src_dir, dst_dir):
             abs_src = os.path.join(src_dir, root, d)
             filepart = abs_src[len(src_dir) + 1:]
             abs_dst = os.path.join(dst_dir, filepart)
-            if os.path.isdir(abs_dst):
-                continue
-            if os.path.exists(abs_dst):
-                print('Tried to copy directory %s but a file of that name already exists.' % abs_dst)
-                sys.exit(1)
-            os.makedirs(abs_dst)
-            shutil.copystat(abs_src, abs_dst)
+            plan.add_dir(abs_dst, abs_src)
         for f in files:
             abs_src = os.path.join(src_dir, root, f)
             filepart = abs_src[len(src_dir) + 1:]
             abs_dst = os.path.join(dst_dir, filepart)
             if os.path.isdir(abs_dst):
                 print('Tried to copy file %s but a directory of that name already exists.' % abs_dst)
-            if os.path.exists(abs_dst):
-                os.unlink(abs_dst)
-            parent_dir = os.path.split(abs_dst)[0]
-            if not os.path.isdir(parent_dir):
-                os.mkdir(parent_dir)
-                shutil.copystat(os.path.split(abs_src)[0], parent_dir)
-            shutil.copy2(abs_src, abs_dst, follow_symlinks=False)
-            append_to_log(abs_dst)
+            plan.add_dir(os.path.dirname(abs_dst), os.path.dirname(abs_src))
+            plan.add_file(do_copy_tree_file, abs_src, abs_dst)
 
 def get_destdir_path(d, path):
     if os.path.isabs(path):
@@ -120,63 +329,74 @@ def do_install(datafilename):
         d = pickle.load(ifile)
     d.destdir = os.environ.get('DESTDIR', '')
     d.fullprefix = destdir_join(d.destdir, d.prefix)
+    compare = os.environ.get('MESON_INSTALL_COMPARE', 'stat')
+    if compare not in compare_modes:
+        raise RuntimeError('Invalid MESON_INSTALL_COMPARE value {!r}, must be one of {}.'
+                           ''.format(compare, ', '.join(compare_modes)))
+    manifest_file = os.path.join(os.path.dirname(datafilename), 'install_manifest.dat')
+    (old_destdir, manifest) = load_manifest(manifest_file)
 
-    install_subdirs(d) # Must be first, because it needs to delete the old subtree.
-    install_targets(d)
-    install_headers(d)
-    install_man(d)
-    install_data(d)
+    # Everything that is copied verbatim is collected first and copied in
+    # one go, targets need further processing once they are in place.
+    plan = CopyPlan(compare, manifest)
+    install_subdirs(d, plan)
+    targets = install_targets(d, plan)
+    install_headers(d, plan)
+    install_man(d, plan)
+    install_data(d, plan)
+    plan.execute()
+    fix_targets(d, targets, plan.unchanged)
+    if old_destdir == d.destdir:
+        for f in sorted(set(manifest) - set(plan.installed)):
+            if os.path.exists(f):
+                print('Previously installed file %s is no longer part of the install.' % f)
+    save_manifest(manifest_file, d.destdir, plan.installed)
     run_install_script(d)
 
-def install_subdirs(data):
+def install_subdirs(data, plan):
     for (src_dir, inst_dir, dst_dir, mode) in data.install_subdirs:
         if src_dir.endswith('/') or src_dir.endswith('\\'):
             src_dir = src_dir[:-1]
         src_prefix = os.path.join(src_dir, inst_dir)
         print('Installing subdir %s to %s.' % (src_prefix, dst_dir))
         dst_dir = get_destdir_path(data, dst_dir)
-        if not os.path.exists(dst_dir):
-            os.makedirs(dst_dir)
-        do_copydir(src_prefix, src_dir, dst_dir)
         dst_prefix = os.path.join(dst_dir, inst_dir)
-        set_mode(dst_prefix, mode)
+        plan.add_dir(dst_dir)
+        plan.add_dir(dst_prefix, src_prefix)
+        do_copydir(plan, src_prefix, src_dir, dst_dir)
+        plan.set_dir_mode(dst_prefix, mode)
 
-def install_data(d):
+def install_data(d, plan):
     for i in d.data:
         fullfilename = i[0]
         outfilename = get_destdir_path(d, i[1])
         mode = i[2]
         outdir = os.path.split(outfilename)[0]
-        os.makedirs(outdir, exist_ok=True)
         print('Installing %s to %s.' % (fullfilename, outdir))
-        do_copyfile(fullfilename, outfilename)
-        set_mode(outfilename, mode)
+        check_copyfile(fullfilename, outfilename)
+        plan.add_file(do_copyfile, fullfilename, outfilename, mode)
 
-def install_man(d):
+def install_man(d, plan):
     for m in d.man:
         full_source_filename = m[0]
         outfilename = get_destdir_path(d, m[1])
         outdir = os.path.split(outfilename)[0]
-        os.makedirs(outdir, exist_ok=True)
         print('Installing %s to %s.' % (full_source_filename, outdir))
+        check_copyfile(full_source_filename, outfilename)
         if outfilename.endswith('.gz') and not full_source_filename.endswith('.gz'):
-            with open(outfilename, 'wb') as of:
-                with open(full_source_filename, 'rb') as sf:
-                    of.write(gzip.compress(sf.read()))
-            shutil.copystat(full_source_filename, outfilename)
-            append_to_log(outfilename)
+            plan.add_file(do_gzipfile, full_source_filename, outfilename)
         else:
-            do_copyfile(full_source_filename, outfilename)
+            plan.add_file(do_copyfile, full_source_filename, outfilename)
 
-def install_headers(d):
+def install_headers(d, plan):
     for t in d.headers:
         fullfilename = t[0]
         fname = os.path.split(fullfilename)[1]
         outdir = get_destdir_path(d, t[1])
         outfilename = os.path.join(outdir, fname)
         print('Installing %s to %s' % (fname, outdir))
-        os.makedirs(outdir, exist_ok=True)
-        do_copyfile(fullfilename, outfilename)
+        check_copyfile(fullfilename, outfilename)
+        plan.add_file(do_copyfile, fullfilename, outfilename)
 
 def run_install_script(d):
     env = {'MESON_SOURCE_ROOT': d.source_dir,
@@ -231,41 +451,59 @@ def check_for_stampfile(fname):
                 return files[0]
     return fname
 
-def install_targets(d):
+def install_targets(d, plan):
+    installed = []
     for t in d.targets:
         fname = check_for_stampfile(t[0])
         outdir = get_destdir_path(d, t[1])
         outname = os.path.join(outdir, os.path.split(fname)[-1])
-        aliases = t[2]
         should_strip = t[3]
         install_rpath = t[4]
         print('Installing %s to %s' % (fname, outname))
-        os.makedirs(outdir, exist_ok=True)
+        plan.add_dir(outdir)
         if not os.path.exists(fname):
             raise RuntimeError('File {!r} could not be found'.format(fname))
         elif os.path.isfile(fname):
-            do_copyfile(fname, outname)
-            if should_strip and d.strip_bin is not None:
-                if fname.endswith('.jar'):
-                    print('Not stripping jar target:', os.path.split(fname)[1])
-                    continue
-                print('Stripping target {!r}'.format(fname))
-                ps, stdo, stde = Popen_safe(d.strip_bin + [outname])
-                if ps.returncode != 0:
-                    print('Could not strip file.\n')
-                    print('Stdout:\n%s\n' % stdo)
-                    print('Stderr:\n%s\n' % stde)
-                    sys.exit(1)
+            check_copyfile(fname, outname)
+            # Everything fix_targets() does to the file once it is copied
+            strip_bin = tuple(d.strip_bin) if should_strip and d.strip_bin is not None else None
+            plan.add_file(do_copyfile, fname, outname, post=(strip_bin, install_rpath))
             pdb_filename = os.path.splitext(fname)[0] + '.pdb'
             if not should_strip and os.path.exists(pdb_filename):
                 pdb_outname = os.path.splitext(outname)[0] + '.pdb'
                 print('Installing pdb file %s to %s.' % (pdb_filename, pdb_outname))
-                do_copyfile(pdb_filename, pdb_outname)
+                check_copyfile(pdb_filename, pdb_outname)
+                plan.add_file(do_copyfile, pdb_filename, pdb_outname)
         elif os.path.isdir(fname):
             fname = os.path.join(d.build_dir, fname.rstrip('/'))
-            do_copydir(fname, os.path.dirname(fname), outdir)
+            do_copydir(plan, fname, os.path.dirname(fname), outdir)
         else:
             raise RuntimeError('Unknown file type for {!r}'.format(fname))
+        installed.append((t, fname, outdir, outname))
+    return installed
+
+def fix_targets(d, installed, unchanged):
+    '''
+    Strips the installed targets, creates their aliases and fixes their
+    rpaths. Must be run after the targets have been copied. Targets in
+    unchanged were already processed by a previous install.
+    '''
+    for (t, fname, outdir, outname) in installed:
+        aliases = t[2]
+        should_strip = t[3]
+        install_rpath = t[4]
+        up_to_date = outname in unchanged
+        if os.path.isfile(fname) and should_strip and d.strip_bin is not None and not up_to_date:
+            if fname.endswith('.jar'):
+                print('Not stripping jar target:', os.path.split(fname)[1])
+                continue
+            print('Stripping target {!r}'.format(fname))
+            ps, stdo, stde = Popen_safe(d.strip_bin + [outname])
+            if ps.returncode != 0:
+                print('Could not strip file.\n')
+                print('Stdout:\n%s\n' % stdo)
+                print('Stderr:\n%s\n' % stde)
+                sys.exit(1)
         printed_symlink_error = False
         for alias, to in aliases.items():
             try:
@@ -281,10 +519,10 @@ def install_targets(d):
                     print("Symlink creation does not work on this platform. "
                           "Skipping all symlinking.")
                     printed_symlink_error = True
-        if is_elf_platform() and os.path.isfile(outname):
+        if is_elf_platform() and os.path.isfile(outname) and not up_to_date:
             try:
-                e = depfixer.Elf(outname, False)
-                e.fix_rpath(install_rpath)
+                with depfixer.Elf(outname, False) as e:
+                    e.fix_rpath(install_rpath)
             except SystemExit as e:
                 if isinstance(e.code, int) and e.code == 0:
                     pass
@@ -292,19 +530,19 @@ def install_targets(d):
                     raise
 
 def run(args):
-    global install_log_file
     if len(args) != 1:
         print('Installer script for Meson. Do not run on your own, mmm\'kay?')
         print('meson_install.py [install info file]')
     datafilename = args[0]
     private_dir = os.path.split(datafilename)[0]
     log_dir = os.path.join(private_dir, '../meson-logs')
-    with open(os.path.join(log_dir, 'install-log.txt'), 'w') as lf:
-        install_log_file = lf
-        append_to_log('# List of files installed by Meson')
-        append_to_log('# Does not contain files installed by custom scripts.')
+    del install_log[:]
+    append_to_log('# List of files installed by Meson')
+    append_to_log('# Does not contain files installed by custom scripts.')
+    try:
         do_install(datafilename)
-    install_log_file = None
+    finally:
+        write_log(os.path.join(log_dir, 'install-log.txt'))
     return 0
 
 if __name__ == '__main__':
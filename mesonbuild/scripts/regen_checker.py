@@ -14,6 +14,7 @@
 
 import sys, os
 import pickle, subprocess
+from .. import coredata
 
 # This could also be used for XCode.
 
@@ -44,15 +45,14 @@ def regen(regeninfo, mesonscript, backend):
 def run(args):
     private_dir = args[0]
     dumpfile = os.path.join(private_dir, 'regeninfo.dump')
-    coredata = os.path.join(private_dir, 'coredata.dat')
     with open(dumpfile, 'rb') as f:
         regeninfo = pickle.load(f)
-    with open(coredata, 'rb') as f:
-        coredata = pickle.load(f)
-    mesonscript = coredata.meson_script_launcher
-    backend = coredata.get_builtin_option('backend')
     regen_timestamp = os.stat(dumpfile).st_mtime
     if need_regen(regeninfo, regen_timestamp):
+        # Only the timestamps are needed in the common up-to-date case.
+        cdata = coredata.load(os.path.join(private_dir, 'coredata.dat'))
+        mesonscript = cdata.meson_script_launcher
+        backend = cdata.get_builtin_option('backend')
         regen(regeninfo, mesonscript, backend)
     sys.exit(0)
 
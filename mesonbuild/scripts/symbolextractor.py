@@ -20,9 +20,10 @@
 # This file is basically a reimplementation of
 # http://cgit.freedesktop.org/libreoffice/core/commit/?id=3213cd54b76bc80a6f0516aac75a48ff3b2ad67c
 
-import os, sys
+import sys
 from .. import mesonlib
 from ..mesonlib import Popen_safe
+from . import depfixer
 import argparse
 
 parser = argparse.ArgumentParser()
@@ -48,27 +49,19 @@ def write_if_changed(text, outfilename):
         f.write(text)
 
 def linux_syms(libfilename, outfilename):
-    evar = 'READELF'
-    if evar in os.environ:
-        readelfbin = os.environ[evar].strip()
-    else:
-        readelfbin = 'readelf'
-    evar = 'NM'
-    if evar in os.environ:
-        nmbin = os.environ[evar].strip()
-    else:
-        nmbin = 'nm'
-    pe, output = Popen_safe([readelfbin, '-d', libfilename])[0:2]
-    if pe.returncode != 0:
-        raise RuntimeError('Readelf does not work')
-    result = [x for x in output.split('\n') if 'SONAME' in x]
-    assert(len(result) <= 1)
-    pnm, output = Popen_safe([nmbin, '--dynamic', '--extern-only',
-                              '--defined-only', '--format=posix',
-                              libfilename])[0:2]
-    if pnm.returncode != 0:
-        raise RuntimeError('nm does not work.')
-    result += [' '.join(x.split()[0:2]) for x in output.split('\n') if len(x) > 0]
+    # Read the soname and the exported symbols directly instead of
+    # running readelf and nm on every link.
+    try:
+        with depfixer.Elf(libfilename, verbose=False, readonly=True) as elf:
+            soname = elf.get_soname()
+            symbols = elf.get_dynamic_symbols()
+    except SystemExit:
+        # Not an ELF file after all
+        return dummy_syms(outfilename)
+    result = []
+    if soname is not None:
+        result.append('SONAME ' + soname.decode('utf-8', 'replace'))
+    result += ['{} {}'.format(name, stype) for (name, stype) in sorted(symbols)]
     write_if_changed('\n'.join(result) + '\n', outfilename)
 
 def osx_syms(libfilename, outfilename):
@@ -23,7 +23,7 @@ from mesonbuild import build
 from mesonbuild import environment
 
 import time, datetime, multiprocessing, json
-import concurrent.futures as conc
+import collections, selectors, tempfile, hashlib, zlib
 import platform
 import signal
 import random
@@ -32,6 +32,10 @@ import random
 # mean that the test should be skipped.
 GNU_SKIP_RETURNCODE = 77
 
+# How often to check on tests whose exit can not be waited for with
+# select(), e.g. on Windows or when their output is not captured.
+POLL_INTERVAL = 0.05
+
 def is_windows():
     platname = platform.system().lower()
     return platname == 'windows' or 'mingw' in platname
@@ -57,6 +61,15 @@ def determine_worker_count():
             num_workers = 1
     return num_workers
 
+def parse_shard(value):
+    try:
+        (index, count) = [int(x) for x in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('shard must be of the form K/N')
+    if count < 1 or not 1 <= index <= count:
+        raise argparse.ArgumentTypeError('shard %s does not exist' % value)
+    return index, count
+
 parser = argparse.ArgumentParser()
 parser.add_argument('--repeat', default=1, dest='repeat', type=int,
                     help='Number of times to run the tests.')
@@ -94,6 +107,16 @@ parser.add_argument('-t', '--timeout-multiplier', type=float, default=None,
                     ' more time to execute.')
 parser.add_argument('--setup', default=None, dest='setup',
                     help='Which test setup to use.')
+parser.add_argument('--memory-limit', default=None, type=int, metavar='MB',
+                    help='Do not run tests at the same time whose declared memory use exceeds MB megabytes in total.')
+parser.add_argument('--skip-unchanged', default=False, action='store_true',
+                    help='Do not rerun tests that passed last time if their inputs have not changed.')
+parser.add_argument('--shard', default=None, type=parse_shard, metavar='K/N',
+                    help='Only run the Kth of N parts of the tests. The parts are balanced '
+                    'using the durations of earlier runs, which must be the same for all parts.')
+parser.add_argument('--merge-logs', default=None, metavar='OUTPUT',
+                    help='Merge the JSON test logs given as arguments into OUTPUT '
+                    'and print a summary of them instead of running tests.')
 parser.add_argument('--test-args', default=[], type=shlex.split,
                     help='Arguments to pass to the specified test(s) or all tests')
 parser.add_argument('args', nargs='*',
@@ -138,6 +161,38 @@ def decode(stream):
     except UnicodeDecodeError:
         return stream.decode('iso-8859-1', errors='ignore')
 
+class TestProcess:
+    '''A test that has been started but whose result is not known yet.'''
+    def __init__(self, test, index, name, cmd):
+        self.test = test
+        self.index = index
+        self.name = name
+        self.cmd = cmd
+        self.popen = None
+        self.starttime = None
+        self.deadline = None
+        self.timed_out = False
+        # Whether the test runs in a session of its own that can be killed
+        # as a whole
+        self.own_group = False
+        self.open_pipes = 0
+        self.stdo_file = None
+        self.stde_file = None
+        self.digest = None
+
+    def read_output(self, f):
+        if f is None:
+            return ''
+        f.seek(0)
+        data = f.read()
+        f.close()
+        return decode(data)
+
+    def close(self):
+        for f in (self.stdo_file, self.stde_file):
+            if f is not None:
+                f.close()
+
 def write_json_log(jsonlogfile, test_name, result):
     jresult = {'name': test_name,
                'stdout': result.stdo,
@@ -153,6 +208,22 @@ def write_json_log(jsonlogfile, test_name, result):
         jresult['stderr'] = result.stde
     jsonlogfile.write(json.dumps(jresult) + '\n')
 
+def load_durations(historyfile):
+    try:
+        with open(historyfile) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_durations(historyfile, durations):
+    tempfilename = historyfile + '~'
+    try:
+        with open(tempfilename, 'w') as f:
+            json.dump(durations, f, sort_keys=True)
+        os.replace(tempfilename, historyfile)
+    except OSError:
+        pass
+
 def run_with_mono(fname):
     if fname.endswith('.exe') and not (is_windows() or is_cygwin()):
         return True
@@ -166,15 +237,23 @@ class TestHarness:
         self.success_count = 0
         self.skip_count = 0
         self.timeout_count = 0
+        self.cached_count = 0
         self.is_run = False
         self.tests = None
         self.suites = None
+        self.resultsfile = None
+        self.passed = {}
+        self.file_digests = {}
         if self.options.benchmark:
             self.load_datafile(os.path.join(options.wd, 'meson-private', 'meson_benchmark_setup.dat'))
+            self.load_history(os.path.join(options.wd, 'meson-private', 'meson_benchmark_history.json'))
         else:
             self.load_datafile(os.path.join(options.wd, 'meson-private', 'meson_test_setup.dat'))
+            self.load_history(os.path.join(options.wd, 'meson-private', 'meson_test_history.json'))
+            if self.options.skip_unchanged:
+                self.load_results(os.path.join(options.wd, 'meson-private', 'meson_test_results.json'))
 
-    def run_single_test(self, wrap, test):
+    def get_test_cmd(self, wrap, test):
         if test.fname[0].endswith('.jar'):
             cmd = ['java', '-jar'] + test.fname
         elif not test.is_cross and run_with_mono(test.fname[0]):
@@ -184,95 +263,226 @@ class TestHarness:
                 if test.exe_runner is None:
                     # Can not run test on cross compiled executable
                     # because there is no execute wrapper.
-                    cmd = None
+                    return None
                 else:
                     cmd = [test.exe_runner] + test.fname
             else:
                 cmd = test.fname
-
+        return wrap + cmd + test.cmd_args + self.options.test_args
+
+    def get_test_env(self, test):
+        child_env = os.environ.copy()
+        child_env.update(self.options.global_env.get_env(child_env))
+        if isinstance(test.env, build.EnvironmentVariables):
+            test.env = test.env.get_env(child_env)
+
+        child_env.update(test.env)
+        if len(test.extra_paths) > 0:
+            child_env['PATH'] += os.pathsep.join([''] + test.extra_paths)
+
+        # If MALLOC_PERTURB_ is not set, or if it is set to an empty value,
+        # (i.e., the test or the environment don't explicitly set it), set
+        # it ourselves. We do this unconditionally because it is extremely
+        # useful to have in tests.
+        # Setting MALLOC_PERTURB_="0" will completely disable this feature.
+        if 'MALLOC_PERTURB_' not in child_env or not child_env['MALLOC_PERTURB_']:
+            child_env['MALLOC_PERTURB_'] = str(random.randint(1, 255))
+        return child_env
+
+    def start_test(self, wrap, test, index, name):
+        cmd = self.get_test_cmd(wrap, test)
         if cmd is None:
+            self.skip_count += 1
+            return TestRun('SKIP', GNU_SKIP_RETURNCODE, test.should_fail, 0.0,
+                           'Not run because can not execute cross compiled binaries.',
+                           None, None, test.env)
+        child_env = self.get_test_env(test)
+        proc = TestProcess(test, index, name, cmd)
+        if self.resultsfile is not None:
+            proc.digest = self.get_test_digest(test, cmd)
+            previous = self.passed.get(self.history_key(test))
+            if previous is not None and previous[0] == proc.digest:
+                self.cached_count += 1
+                return TestRun('CACHED', previous[1], test.should_fail, 0.0,
+                               'Not run because it passed before and its inputs have not changed.',
+                               None, cmd, test.env)
+        setsid = None
+        stdout = None
+        stderr = None
+        if not self.options.verbose:
+            # The output goes to temporary files so that the harness does
+            # not need to keep it in memory while the test runs. On
+            # Windows the child writes to them directly because pipes
+            # can not be waited on there.
+            proc.stdo_file = tempfile.TemporaryFile()
+            if self.options.split:
+                proc.stde_file = tempfile.TemporaryFile()
+            if is_windows():
+                stdout = proc.stdo_file
+                stderr = proc.stde_file if proc.stde_file else subprocess.STDOUT
+            else:
+                stdout = subprocess.PIPE
+                stderr = subprocess.PIPE if proc.stde_file else subprocess.STDOUT
+                setsid = os.setsid
+
+        proc.starttime = time.time()
+        proc.popen = subprocess.Popen(cmd,
+                                      stdout=stdout,
+                                      stderr=stderr,
+                                      env=child_env,
+                                      cwd=test.workdir,
+                                      preexec_fn=setsid)
+        proc.own_group = setsid is not None
+        if test.timeout is not None:
+            proc.deadline = proc.starttime + test.timeout * self.options.timeout_multiplier
+        return proc
+
+    def kill_test(self, proc):
+        # Python does not provide multiplatform support for
+        # killing a process and all its children so we need
+        # to roll our own.
+        if is_windows():
+            subprocess.call(['taskkill', '/F', '/T', '/PID', str(proc.popen.pid)])
+        elif proc.own_group:
+            try:
+                os.killpg(os.getpgid(proc.popen.pid), signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        else:
+            # Verbose tests share our process group
+            proc.popen.kill()
+
+    def finish_test(self, proc):
+        p = proc.popen
+        p.wait()
+        duration = time.time() - proc.starttime
+        self.durations[self.history_key(proc.test)] = duration
+        stdo = proc.read_output(proc.stdo_file)
+        stde = proc.read_output(proc.stde_file)
+        self.passed.pop(self.history_key(proc.test), None)
+        if proc.timed_out:
+            res = 'TIMEOUT'
+            self.timeout_count += 1
+            self.fail_count += 1
+        elif p.returncode == GNU_SKIP_RETURNCODE:
             res = 'SKIP'
-            duration = 0.0
-            stdo = 'Not run because can not execute cross compiled binaries.'
-            stde = None
-            returncode = GNU_SKIP_RETURNCODE
+            self.skip_count += 1
+        elif proc.test.should_fail == bool(p.returncode):
+            res = 'OK'
+            self.success_count += 1
+            if proc.digest is not None:
+                self.passed[self.history_key(proc.test)] = [proc.digest, p.returncode]
         else:
-            cmd = wrap + cmd + test.cmd_args + self.options.test_args
-            starttime = time.time()
-            child_env = os.environ.copy()
-            child_env.update(self.options.global_env.get_env(child_env))
-            if isinstance(test.env, build.EnvironmentVariables):
-                test.env = test.env.get_env(child_env)
-
-            child_env.update(test.env)
-            if len(test.extra_paths) > 0:
-                child_env['PATH'] += os.pathsep.join([''] + test.extra_paths)
-
-            # If MALLOC_PERTURB_ is not set, or if it is set to an empty value,
-            # (i.e., the test or the environment don't explicitly set it), set
-            # it ourselves. We do this unconditionally because it is extremely
-            # useful to have in tests.
-            # Setting MALLOC_PERTURB_="0" will completely disable this feature.
-            if 'MALLOC_PERTURB_' not in child_env or not child_env['MALLOC_PERTURB_']:
-                child_env['MALLOC_PERTURB_'] = str(random.randint(1, 255))
-
-            setsid = None
-            stdout = None
-            stderr = None
-            if not self.options.verbose:
-                stdout = subprocess.PIPE
-                stderr = subprocess.PIPE if self.options and self.options.split else subprocess.STDOUT
-
-                if not is_windows():
-                    setsid = os.setsid
-
-            p = subprocess.Popen(cmd,
-                                 stdout=stdout,
-                                 stderr=stderr,
-                                 env=child_env,
-                                 cwd=test.workdir,
-                                 preexec_fn=setsid)
-            timed_out = False
-            if test.timeout is None:
+            res = 'FAIL'
+            self.fail_count += 1
+        return TestRun(res, p.returncode, proc.test.should_fail, duration, stdo, stde,
+                       proc.cmd, proc.test.env)
+
+    def run_single_test(self, wrap, test):
+        results = []
+        self.run_batch([(0, test, test.name)], wrap, lambda i, name, res: results.append(res))
+        return results[0]
+
+    def stop_requested(self):
+        return self.options.repeat > 1 and self.fail_count > 0
+
+    def get_weight(self, test):
+        # A test that needs more than there is runs on its own
+        return min(test.weight, self.options.num_processes)
+
+    def get_memory(self, test):
+        if self.options.memory_limit is None:
+            return 0
+        return min(test.memory, self.options.memory_limit)
+
+    def take_job(self, pending, running):
+        '''Remove and return the first pending job that fits into the CPUs
+        and memory left over by the running tests, or None if none does.'''
+        cpus = self.options.num_processes - sum(self.get_weight(p.test) for p in running)
+        if self.options.memory_limit is None:
+            memory = None
+        else:
+            memory = self.options.memory_limit - sum(self.get_memory(p.test) for p in running)
+        for job in pending:
+            test = job[1]
+            if self.get_weight(test) <= cpus and \
+                    (memory is None or self.get_memory(test) <= memory):
+                pending.remove(job)
+                return job
+        return None
+
+    def run_batch(self, jobs, wrap, report):
+        '''Run the given (index, test, name) jobs with the weights of the
+        running tests adding up to at most num_processes, and their memory
+        to at most the memory limit, and call report() for each one as
+        soon as it has finished, regardless of the order they were started
+        in.'''
+        pending = collections.deque(jobs)
+        running = []
+        sel = selectors.DefaultSelector()
+        try:
+            while pending or running:
+                while pending:
+                    if self.stop_requested():
+                        pending.clear()
+                        break
+                    job = self.take_job(pending, running)
+                    if job is None:
+                        break
+                    (i, test, name) = job
+                    proc = self.start_test(wrap, test, i, name)
+                    if isinstance(proc, TestRun):
+                        report(i, name, proc)
+                        continue
+                    for (pipe, out) in ((proc.popen.stdout, proc.stdo_file),
+                                        (proc.popen.stderr, proc.stde_file)):
+                        if pipe is not None:
+                            sel.register(pipe, selectors.EVENT_READ, (proc, out))
+                            proc.open_pipes += 1
+                    running.append(proc)
+                if not running:
+                    continue
+
                 timeout = None
-            else:
-                timeout = test.timeout * self.options.timeout_multiplier
-            try:
-                (stdo, stde) = p.communicate(timeout=timeout)
-            except subprocess.TimeoutExpired:
-                if self.options.verbose:
-                    print("%s time out (After %d seconds)" % (test.name, timeout))
-                timed_out = True
-                # Python does not provide multiplatform support for
-                # killing a process and all its children so we need
-                # to roll our own.
-                if is_windows():
-                    subprocess.call(['taskkill', '/F', '/T', '/PID', str(p.pid)])
+                now = time.time()
+                for proc in running:
+                    if proc.open_pipes == 0:
+                        # Nothing to wait on but the process itself
+                        timeout = POLL_INTERVAL
+                    elif proc.deadline is not None and not proc.timed_out:
+                        left = max(proc.deadline - now, 0)
+                        timeout = left if timeout is None else min(timeout, left)
+                if sel.get_map():
+                    events = sel.select(timeout)
                 else:
-                    os.killpg(os.getpgid(p.pid), signal.SIGKILL)
-                (stdo, stde) = p.communicate()
-            endtime = time.time()
-            duration = endtime - starttime
-            stdo = decode(stdo)
-            if stde:
-                stde = decode(stde)
-            if timed_out:
-                res = 'TIMEOUT'
-                self.timeout_count += 1
-                self.fail_count += 1
-            elif p.returncode == GNU_SKIP_RETURNCODE:
-                res = 'SKIP'
-                self.skip_count += 1
-            elif test.should_fail == bool(p.returncode):
-                res = 'OK'
-                self.success_count += 1
-            else:
-                res = 'FAIL'
-                self.fail_count += 1
-            returncode = p.returncode
-        result = TestRun(res, returncode, test.should_fail, duration, stdo, stde, cmd, test.env)
-
-        return result
+                    time.sleep(timeout)
+                    events = []
+                for (key, mask) in events:
+                    (proc, out) = key.data
+                    data = os.read(key.fd, 65536)
+                    if data:
+                        out.write(data)
+                    else:
+                        sel.unregister(key.fileobj)
+                        key.fileobj.close()
+                        proc.open_pipes -= 1
+
+                now = time.time()
+                for proc in running[:]:
+                    if proc.open_pipes == 0 and proc.popen.poll() is not None:
+                        running.remove(proc)
+                        report(proc.index, proc.name, self.finish_test(proc))
+                    elif proc.deadline is not None and now >= proc.deadline and not proc.timed_out:
+                        if self.options.verbose:
+                            print("%s time out (After %d seconds)" % (proc.test.name, proc.deadline - proc.starttime))
+                        proc.timed_out = True
+                        self.kill_test(proc)
+        finally:
+            for proc in running:
+                self.kill_test(proc)
+                proc.popen.wait()
+                proc.close()
+            sel.close()
 
     def print_stats(self, numlen, tests, name, result, i, logfile, jsonlogfile):
         startpad = ' ' * (numlen - len('%d' % (i + 1)))
@@ -281,7 +491,7 @@ class TestHarness:
         padding2 = ' ' * (8 - len(result.res))
         result_str = '%s %s  %s%s%s%5.2f s' % \
             (num, name, padding1, result.res, padding2, result.duration)
-        if not self.options.quiet or result.res != 'OK':
+        if not self.options.quiet or result.res not in ('OK', 'CACHED'):
             print(result_str)
         result_str += "\n\n" + result.get_log()
         if (result.returncode != GNU_SKIP_RETURNCODE) \
@@ -300,6 +510,8 @@ FAIL:    %4d
 SKIP:    %4d
 TIMEOUT: %4d
 ''' % (self.success_count, self.fail_count, self.skip_count, self.timeout_count)
+        if self.resultsfile is not None:
+            msg += 'CACHED:  %4d\n' % self.cached_count
         print(msg)
         if logfile:
             logfile.write(msg)
@@ -367,6 +579,96 @@ TIMEOUT: %4d
         with open(self.datafile, 'rb') as f:
             self.tests = pickle.load(f)
 
+    def load_history(self, historyfile):
+        # Durations of previous runs, the same ones that end up in
+        # testlog.json, used to start the longest tests first.
+        self.historyfile = historyfile
+        self.durations = load_durations(historyfile)
+
+    def save_history(self):
+        save_durations(self.historyfile, self.durations)
+
+    def load_results(self, resultsfile):
+        # Tests that passed, with a digest of everything that went into
+        # running them, and the digests of the files involved so that
+        # only files whose timestamp or size changed are read again.
+        self.resultsfile = resultsfile
+        try:
+            with open(resultsfile) as f:
+                data = json.load(f)
+            self.passed = data['tests']
+            self.file_digests = data['files']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    def save_results(self):
+        if self.resultsfile is None:
+            return
+        tempfilename = self.resultsfile + '~'
+        try:
+            with open(tempfilename, 'w') as f:
+                json.dump({'tests': self.passed, 'files': self.file_digests}, f, sort_keys=True)
+            os.replace(tempfilename, self.resultsfile)
+        except OSError:
+            pass
+
+    def get_file_digest(self, fname):
+        try:
+            st = os.stat(fname)
+        except OSError:
+            return None
+        stamp = [st.st_mtime_ns, st.st_size]
+        cached = self.file_digests.get(fname)
+        if cached is not None and cached[:2] == stamp:
+            return cached[2]
+        h = hashlib.sha256()
+        with open(fname, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(chunk)
+        self.file_digests[fname] = stamp + [h.hexdigest()]
+        return h.hexdigest()
+
+    def get_test_digest(self, test, cmd):
+        global_env = self.options.global_env.get_env(os.environ.copy())
+        ident = [cmd, test.should_fail, test.workdir, test.extra_paths,
+                 sorted(test.env.items()), sorted(global_env.items())]
+        for fname in cmd + test.depends:
+            fname = os.path.join(self.options.wd, fname)
+            if os.path.isfile(fname):
+                ident.append([fname, self.get_file_digest(fname)])
+        if test.workdir is not None and os.path.isdir(test.workdir):
+            # Data files the test may read from its working directory
+            for entry in sorted(os.listdir(test.workdir)):
+                fname = os.path.join(test.workdir, entry)
+                if os.path.isfile(fname):
+                    st = os.stat(fname)
+                    ident.append([entry, st.st_mtime_ns, st.st_size])
+        return hashlib.sha256(json.dumps(ident).encode('utf-8')).hexdigest()
+
+    def history_key(self, test):
+        # The name the test has in testlog.json
+        return self.get_pretty_suite(test, self.tests)
+
+    def schedule_tests(self, tests):
+        '''Split the tests into the ones that can run concurrently, longest
+        expected duration first, and the ones that have to run on their
+        own. The latter all run after the parallel ones so that the pool
+        only has to be drained once.'''
+        parallel = []
+        serial = []
+        for i, test in enumerate(tests):
+            job = (i, test, self.get_pretty_suite(test, tests))
+            if self.options.gdb:
+                test.timeout = None
+            if not test.is_parallel or self.options.gdb:
+                serial.append(job)
+            else:
+                parallel.append(job)
+        # Tests without a history keep their order in front of the rest
+        # since nothing is known about them.
+        parallel.sort(key=lambda job: -self.durations.get(self.history_key(job[1]), float('inf')))
+        return parallel, serial
+
     def load_datafile(self, datafile):
         self.datafile = datafile
         self.load_tests()
@@ -388,6 +690,9 @@ TIMEOUT: %4d
         if self.options.args:
             tests = [t for t in tests if t.name in self.options.args]
 
+        if self.options.shard:
+            tests = self.get_shard(tests)
+
         if not tests:
             print('No suitable tests defined.')
             return []
@@ -397,6 +702,26 @@ TIMEOUT: %4d
 
         return tests
 
+    def get_shard(self, tests):
+        '''Split the tests into parts that take about the same time to run
+        and return the requested one. Tests with a known duration are
+        handed out longest first to the part with the least work so far,
+        the others are assigned by a hash of their name.'''
+        (index, count) = self.options.shard
+        loads = [0.0] * count
+        assigned = {}
+        known = [t for t in tests if self.history_key(t) in self.durations]
+        known.sort(key=lambda t: (-self.durations[self.history_key(t)], self.history_key(t)))
+        for t in known:
+            part = loads.index(min(loads))
+            loads[part] += self.durations[self.history_key(t)]
+            assigned[self.history_key(t)] = part
+        for t in tests:
+            key = self.history_key(t)
+            if key not in assigned:
+                assigned[key] = zlib.crc32(key.encode('utf-8')) % count
+        return [t for t in tests if assigned[self.history_key(t)] == index - 1]
+
     def open_log_files(self):
         if not self.options.logbase or self.options.verbose:
             return None, None, None, None
@@ -447,37 +772,30 @@ TIMEOUT: %4d
 
     def run_tests(self, tests):
         try:
-            executor = None
             logfile = None
             jsonlogfile = None
-            futures = []
             numlen = len('%d' % len(tests))
             (logfile, logfilename, jsonlogfile, jsonlogfilename) = self.open_log_files()
             wrap = self.get_wrapper()
 
-            for i in range(self.options.repeat):
-                for i, test in enumerate(tests):
-                    visible_name = self.get_pretty_suite(test, tests)
-
-                    if self.options.gdb:
-                        test.timeout = None
+            def report(i, name, result):
+                self.print_stats(numlen, tests, name, result, i, logfile, jsonlogfile)
 
-                    if not test.is_parallel or self.options.gdb:
-                        self.drain_futures(futures, logfile, jsonlogfile)
-                        futures = []
-                        res = self.run_single_test(wrap, test)
-                        self.print_stats(numlen, tests, visible_name, res, i, logfile, jsonlogfile)
-                    else:
-                        if not executor:
-                            executor = conc.ThreadPoolExecutor(max_workers=self.options.num_processes)
-                        f = executor.submit(self.run_single_test, wrap, test)
-                        futures.append((f, numlen, tests, visible_name, i, logfile, jsonlogfile))
-                    if self.options.repeat > 1 and self.fail_count:
+            for i in range(self.options.repeat):
+                (parallel, serial) = self.schedule_tests(tests)
+                self.run_batch(parallel, wrap, report)
+                for job in serial:
+                    if self.stop_requested():
                         break
-                if self.options.repeat > 1 and self.fail_count:
+                    self.run_batch([job], wrap, report)
+                if self.stop_requested():
                     break
 
-            self.drain_futures(futures, logfile, jsonlogfile)
+            if not self.options.shard:
+                # Keep the split the same for all shards, merging their
+                # logs records the new durations.
+                self.save_history()
+            self.save_results()
             self.print_summary(logfile, jsonlogfile)
             self.print_collected_logs()
 
@@ -489,15 +807,6 @@ TIMEOUT: %4d
             if logfile:
                 logfile.close()
 
-    def drain_futures(self, futures, logfile, jsonlogfile):
-        for i in futures:
-            (result, numlen, tests, name, i, logfile, jsonlogfile) = i
-            if self.options.repeat > 1 and self.fail_count:
-                result.cancel()
-            if self.options.verbose:
-                result.result()
-            self.print_stats(numlen, tests, name, result.result(), i, logfile, jsonlogfile)
-
     def run_special(self):
         'Tests run by the user, usually something like "under gdb 1000 times".'
         if self.is_run:
@@ -516,11 +825,48 @@ def list_tests(th):
     for t in tests:
         print(th.get_pretty_suite(t, tests))
 
+def merge_logs(outfilename, logfilenames, wd):
+    '''Combine the JSON logs of several runs, such as the shards of one
+    test suite, into one and print the summary of all of them. The test
+    durations are recorded in the build directory, if there is one, to
+    balance the next sharded run.'''
+    counts = collections.Counter()
+    failed = []
+    durations = {}
+    with open(outfilename, 'w') as outfile:
+        for logfilename in logfilenames:
+            with open(logfilename) as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    result = json.loads(line)
+                    counts[result['result']] += 1
+                    if result['result'] != 'CACHED':
+                        durations[result['name']] = result['duration']
+                    if result['result'] in ('FAIL', 'TIMEOUT'):
+                        failed.append(result['name'])
+                    outfile.write(json.dumps(result) + '\n')
+    for name in failed:
+        print('Failed: %s' % name)
+    print('''
+OK:      %4d
+FAIL:    %4d
+SKIP:    %4d
+TIMEOUT: %4d
+CACHED:  %4d
+''' % (counts['OK'], counts['FAIL'] + counts['TIMEOUT'], counts['SKIP'],
+       counts['TIMEOUT'], counts['CACHED']))
+    historyfile = os.path.join(wd, 'meson-private', 'meson_test_history.json')
+    if os.path.isdir(os.path.dirname(historyfile)):
+        history = load_durations(historyfile)
+        history.update(durations)
+        save_durations(historyfile, history)
+    return len(failed)
+
 def merge_suite_options(options):
     buildfile = os.path.join(options.wd, 'meson-private/build.dat')
-    with open(buildfile, 'rb') as f:
-        build = pickle.load(f)
-    setups = build.test_setups
+    # Only the section holding the test setups gets unpickled.
+    setups = build.load(buildfile).test_setups
     if options.setup not in setups:
         sys.exit('Unknown test setup: %s' % options.setup)
     current = setups[options.setup]
@@ -558,6 +904,9 @@ def rebuild_all(wd):
 def run(args):
     options = parser.parse_args(args)
 
+    if options.merge_logs:
+        return merge_logs(options.merge_logs, options.args, os.path.abspath(options.wd))
+
     if options.benchmark:
         options.num_processes = 1
 
@@ -16,14 +16,22 @@
 import stat
 import shlex
 import subprocess
-import re, json
+import re, json, pickle, io
 import tempfile
 import unittest, os, sys, shutil, time
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 from pathlib import PurePath
+import mesonbuild.build
 import mesonbuild.compilers
+import mesonbuild.dependencies
+import mesonbuild.coredata
 import mesonbuild.environment
 import mesonbuild.mesonlib
+import mesonbuild.mlog
+import mesonbuild.mparser
+import mesonbuild.pcresolver
 from mesonbuild.mesonlib import is_windows, is_osx, is_cygwin
 from mesonbuild.environment import detect_ninja, Environment
 from mesonbuild.dependencies import PkgConfigDependency, ExternalProgram
@@ -161,6 +169,123 @@ class InternalTests(unittest.TestCase):
         a = ['-Ldir', '-Lbah'] + a
         self.assertEqual(a, ['-Ibar', '-Ifoo', '-Ibaz', '-I..', '-I.', '-Ldir', '-Lbah', '-Werror', '-O3', '-O2', '-Wall'])
 
+        ## Test de-dup corner cases
+        # Args that are present only once are not added again, not even
+        # when added twice in one go
+        a = cargsfunc(['-pipe', '-O2'], c)
+        a += ['-pthread', '-pipe', '-pthread']
+        self.assertEqual(a, ['-pipe', '-O2', '-pthread'])
+        # Overridden args are moved to their last position
+        a = cargsfunc(['-DFOO', '-O2', '-DBAR'], c)
+        a += ['-DFOO', '-Wall', '-DBAR', '-DFOO']
+        self.assertEqual(a, ['-O2', '-Wall', '-DBAR', '-DFOO'])
+        # Every new occurrence removes one old occurrence
+        a = cargsfunc(['-I.', '-I.', '-I.'], c)
+        a += ['-I.', '-I.']
+        self.assertEqual(a, ['-I.', '-I.'])
+
+    def test_lexer(self):
+        def lex(code):
+            return [(t.tid, t.lineno, t.colno, t.value) for t in mesonbuild.mparser.Lexer(code).lex('')]
+        self.assertEqual(lex("x += ['a', 2] # comment\n"),
+                         [('id', 1, 0, 'x'), ('plusassign', 1, 2, None),
+                          ('lbracket', 1, 5, None), ('string', 1, 6, 'a'),
+                          ('comma', 1, 9, None), ('number', 1, 11, 2),
+                          ('rbracket', 1, 12, None), ('eol', 1, 23, None)])
+        # Keywords, and longer operators taking precedence over shorter ones
+        self.assertEqual([t[0] for t in lex('if not a == b and c <= d\nendif')],
+                         ['if', 'not', 'id', 'equal', 'id', 'and', 'id', 'le',
+                          'id', 'eol', 'endif'])
+        # Newlines inside parentheses are not tokens, multiline strings
+        # advance the line counter
+        self.assertEqual(lex("f(\n'''a\nb''', 'it\\'s')\ny"),
+                         [('id', 1, 0, 'f'), ('lparen', 1, 1, None),
+                          ('string', 2, 0, 'a\nb'), ('comma', 3, 4, None),
+                          ('string', 3, 6, "it's"), ('rparen', 3, 13, None),
+                          ('eol', 3, 14, None), ('id', 4, 0, 'y')])
+        with self.assertRaises(mesonbuild.mparser.ParseException):
+            lex('x = "a"')
+        with self.assertRaises(mesonbuild.mparser.ParseException):
+            lex('x = $')
+
+    def test_ast_cache_root_file(self):
+        from mesonbuild.interpreterbase import InterpreterBase, InvalidCode
+        AstCache = mesonbuild.mparser.AstCache
+        with tempfile.TemporaryDirectory() as d:
+            cachefile = os.path.join(d, 'ast_cache.dat')
+            os.mkdir(os.path.join(d, 'sub'))
+            mesonfile = os.path.join(d, 'meson.build')
+            for (code, msg) in (('  \n\n', 'Builder file is empty.'),
+                                ('# Just a comment\n', 'No statements in code.')):
+                with open(mesonfile, 'w') as f:
+                    f.write(code)
+                # The cached and uncached paths fail the same way
+                for cache in (None, AstCache(cachefile)):
+                    intr = InterpreterBase(d, '')
+                    intr.ast_cache = cache
+                    with self.assertRaises(InvalidCode) as cm:
+                        intr.load_root_meson_file()
+                        intr.sanity_check_ast()
+                    self.assertEqual(str(cm.exception), msg)
+            # Entries of build files not parsed during a run are pruned
+            with open(os.path.join(d, 'sub', 'meson.build'), 'w') as f:
+                f.write("message('sub')\n")
+            cache = AstCache(cachefile)
+            cache.parse(mesonfile, '')
+            cache.parse(os.path.join(d, 'sub', 'meson.build'), 'sub')
+            cache.save()
+            cache = AstCache(cachefile)
+            self.assertEqual(len(cache.entries), 2)
+            cache.parse(mesonfile, '')
+            cache.prune()
+            cache.save()
+            self.assertEqual([k[1] for k in AstCache(cachefile).entries], [''])
+
+    def test_section_pickler(self):
+        SectionPickler = mesonbuild.coredata.SectionPickler
+        stored = mesonbuild.build.ConfigurationData()
+        other = mesonbuild.build.ConfigurationData()
+        earlier = {id(stored): (stored, ('first', 3))}
+        pickler = SectionPickler(io.BytesIO(), earlier)
+        # Objects stored in an earlier section are referenced
+        self.assertEqual(pickler.persistent_id(stored), ('first', 3))
+        self.assertIsNone(pickler.persistent_id(other))
+        # An id recorded for another object, as happens when the ids of
+        # freed objects are reused, is not a reference to this one
+        earlier[id(other)] = (stored, ('first', 4))
+        self.assertIsNone(pickler.persistent_id(other))
+
+    def test_install_manifest_post_processing(self):
+        from mesonbuild.scripts import meson_install
+        self.addCleanup(meson_install.install_log.clear)
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, 'prog')
+            dst = os.path.join(d, 'inst', 'prog')
+            manifest_file = os.path.join(d, 'install_manifest.dat')
+            with open(src, 'w') as f:
+                f.write('program')
+
+            def install(post):
+                (_, manifest) = meson_install.load_manifest(manifest_file)
+                plan = meson_install.CopyPlan('stat', manifest)
+                plan.add_file(meson_install.do_copyfile, src, dst, post=post)
+                plan.execute()
+                # Pretend to strip the file like fix_targets() would
+                if post[0] is not None and dst not in plan.unchanged:
+                    with open(dst, 'w') as f:
+                        f.write('stripped')
+                meson_install.save_manifest(manifest_file, '', plan.installed)
+                return plan.unchanged
+            strip = (('strip',), '')
+            self.assertEqual(install(strip), set())
+            self.assertEqual(install(strip), {dst})
+            # Files processed differently than last time are installed again
+            self.assertEqual(install((None, '')), set())
+            with open(dst) as f:
+                self.assertEqual(f.read(), 'program')
+            self.assertEqual(install((None, '')), {dst})
+            self.assertEqual(install((None, '$ORIGIN')), set())
+
     def test_commonpath(self):
         from os.path import sep
         commonpath = mesonbuild.mesonlib.commonpath
@@ -181,6 +306,208 @@ class InternalTests(unittest.TestCase):
         libdir = '/some/path/to/prefix/libdir'
         self.assertEqual(commonpath([prefix, libdir]), str(PurePath(prefix)))
 
+    def test_pkgconfig_resolver(self):
+        pcresolver = mesonbuild.pcresolver
+        pcdir = os.path.join(os.path.dirname(__file__), 'test cases', 'unit', '7 pkgconfig resolver')
+        r = pcresolver.PkgConfigResolver([pcdir], system_include_dirs=['/usr/include'],
+                                         system_library_dirs=['/usr/lib', '/lib'])
+        self.assertEqual(r.get_modversion('a'), '1.2.3')
+        # Requires.private contributes cflags, system dirs are dropped
+        self.assertEqual(r.get_cflags('a'),
+                         ['-I/opt/a/include', '-DA_FLAG', '-I/opt/b/include', '-DB',
+                          '-I/opt/d/include', '-I/opt/c/include'])
+        self.assertEqual(r.get_libs('a'),
+                         ['-L/opt/a/lib', '-la', '-L/opt/b/lib', '-lb', '-L/opt/c/lib',
+                          '-lc2', '-lm'])
+        # Every library stays after the ones that need it
+        self.assertEqual(r.get_libs('a', static=True),
+                         ['-L/opt/a/lib', '-la', '-L/opt/b/lib', '-lb', '-lpthread',
+                          '-L/opt/d/lib', '-ld', '-ldl', '-L/opt/c/lib', '-lc2', '-lm'])
+        self.assertEqual(r.get_variable('a', 'tag'), 'a#1')
+        self.assertEqual(r.get_variable('a', 'pcfiledir'), pcdir)
+        self.assertEqual(r.get_variable('a', 'nonexisting'), '')
+        for name in ('e', 'f', 'nonexisting'):
+            with self.assertRaises(pcresolver.PkgConfigNotFound):
+                r.get_modversion(name)
+        with self.assertRaises(pcresolver.PkgConfigUnsupported):
+            r.get_modversion('g')
+        r = pcresolver.PkgConfigResolver([pcdir], sysroot='/sysroot')
+        self.assertEqual(r.get_cflags('c'), ['-I/sysroot/opt/c/include', '-DA_FLAG'])
+        self.assertEqual(r.get_libs('c'), ['-L/sysroot/opt/c/lib', '-lc2', '-lm'])
+        self.assertEqual(pcresolver.version_cmp('1.10', '1.9'), 1)
+        self.assertEqual(pcresolver.version_cmp('1.0a', '1.0'), 1)
+        self.assertEqual(pcresolver.version_cmp('2.0', '2.0'), 0)
+
+    @unittest.skipIf(not shutil.which('pkg-config'), 'pkg-config not found')
+    def test_pkgconfig_resolver_positional_flags(self):
+        '''
+        Test that linker flags which only make sense in pairs, around the
+        libraries they apply to, come out exactly as pkg-config puts them.
+        '''
+        pcdir = os.path.join(os.path.dirname(__file__), 'test cases', 'unit', '7 pkgconfig resolver')
+        dep = PkgConfigDependency.__new__(PkgConfigDependency)
+        dep.pkgbin = shutil.which('pkg-config')
+        dep.want_cross = False
+        queries = [('get_cflags', ['--cflags']), ('get_libs', ['--libs'], False),
+                   ('get_libs', ['--libs', '--static'], True)]
+        with mock.patch.dict(os.environ, {'PKG_CONFIG_LIBDIR': pcdir}):
+            for name in ('h', 'i'):
+                dep.name = name
+                for (method, args, *method_args) in queries:
+                    expected = subprocess.check_output([dep.pkgbin] + args + [name],
+                                                       universal_newlines=True)
+                    (ret, out) = dep._query(method, args + [name], *method_args)
+                    self.assertEqual(ret, 0)
+                    self.assertEqual(out.split(), expected.split())
+            resolver = mesonbuild.pcresolver.get_resolver(dep.pkgbin)
+            if resolver is not None:
+                with self.assertRaises(mesonbuild.pcresolver.PkgConfigUnsupported):
+                    resolver.get_libs('h')
+
+    @unittest.skipIf(not shutil.which('pkg-config'), 'pkg-config not found')
+    def test_dependency_cache(self):
+        DependencyCache = mesonbuild.dependencies.DependencyCache
+        find = mesonbuild.dependencies.find_external_dependency
+        pcdir = os.path.join(os.path.dirname(__file__), 'test cases', 'unit', '7 pkgconfig resolver')
+        with tempfile.TemporaryDirectory() as d:
+            libdir = os.path.join(d, 'pkgconfig')
+            os.mkdir(libdir)
+            for f in ('b.pc', 'c.pc'):
+                shutil.copy(os.path.join(pcdir, f), libdir)
+            cachefile = os.path.join(d, 'cache', 'dependency_cache.dat')
+            env = FakeEnvironment()
+            kwargs = {'required': False, 'silent': True}
+            with mock.patch.dict(os.environ, {'PKG_CONFIG_LIBDIR': libdir}):
+                env.dep_cache = DependencyCache(cachefile)
+                self.assertEqual(find('b', env, kwargs).get_version(), '1.1')
+                self.assertFalse(find('a', env, kwargs).found())
+                self.assertEqual(env.dep_cache.misses, 2)
+                env.dep_cache.save()
+                # Another build directory
+                env.dep_cache = DependencyCache(cachefile)
+                self.assertEqual(find('b', env, kwargs).get_link_args(),
+                                 ['-L/opt/b/lib', '-lb', '-L/opt/c/lib', '-lc2', '-lm'])
+                self.assertFalse(find('a', env, kwargs).found())
+                self.assertEqual(env.dep_cache.hits, 2)
+                # A changed requirement and a new package are noticed
+                with open(os.path.join(libdir, 'c.pc'), 'a') as f:
+                    f.write('Requires: d\n')
+                shutil.copy(os.path.join(pcdir, 'd.pc'), libdir)
+                shutil.copy(os.path.join(pcdir, 'a.pc'), libdir)
+                self.assertEqual(find('b', env, kwargs).get_link_args(),
+                                 ['-L/opt/b/lib', '-lb', '-L/opt/c/lib', '-lc2', '-lm',
+                                  '-L/opt/d/lib', '-ld'])
+                self.assertTrue(find('a', env, kwargs).found())
+                self.assertEqual(env.dep_cache.hits, 2)
+
+    def test_log_writer(self):
+        mlog = mesonbuild.mlog
+        for threaded in (False, True):
+            with tempfile.TemporaryDirectory() as d:
+                fname = os.path.join(d, 'meson-log.txt')
+                writer = mlog.LogWriter(fname, threaded)
+                writer.flush_interval = 3600
+                for i in range(100):
+                    print('line', i, file=writer)
+                # Nothing reaches the file until a threshold is hit
+                self.assertEqual(os.path.getsize(fname), 0)
+                writer.flush()
+                with open(fname) as f:
+                    self.assertEqual(len(f.readlines()), 100)
+                writer.flush_size = 10
+                print('x' * 20, file=writer)
+                writer.flush()
+                print('unflushed', file=writer)
+                writer.close()
+                with open(fname) as f:
+                    lines = f.read().splitlines()
+                self.assertEqual(lines[-2:], ['x' * 20, 'unflushed'])
+
+    def test_log_capture(self):
+        mlog = mesonbuild.mlog
+
+        def check(i):
+            mlog.start_capture()
+            for j in range(3):
+                mlog.debug('check', i, 'line', j)
+                time.sleep(0.001)
+            return mlog.stop_capture()
+        with tempfile.TemporaryDirectory() as d:
+            mlog.initialize(d)
+            try:
+                with ThreadPoolExecutor(max_workers=4) as executor:
+                    records = list(executor.map(check, range(8)))
+                # Nothing is written while capturing
+                mlog.flush()
+                self.assertEqual(os.path.getsize(os.path.join(d, 'meson-log.txt')), 0)
+                for r in records:
+                    mlog.replay(r)
+            finally:
+                mlog.shutdown()
+            with open(os.path.join(d, 'meson-log.txt')) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(lines, ['check %d line %d' % (i, j) for i in range(8) for j in range(3)])
+
+    def test_conf_file(self):
+        ConfigurationData = mesonbuild.build.ConfigurationData
+        cdata = ConfigurationData()
+        cdata.values = {'NAME': ('@VERSION@', None), 'VERSION': (3, None),
+                        'HAVE_FOO': (True, None), 'HAVE_BAR': (False, None)}
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, 'config.h.in')
+            dst = os.path.join(d, 'config.h')
+            with open(src, 'w') as f:
+                f.write('#define NAME "@NAME@" /* @VERSION@@VERSION@ @UNSET@ */\n'
+                        '#mesondefine HAVE_FOO\n#mesondefine HAVE_BAR\n#mesondefine HAVE_BAZ\n')
+            mesonbuild.mesonlib.do_conf_file(src, dst, cdata)
+            with open(dst) as f:
+                self.assertEqual(f.read(), '#define NAME "@VERSION@" /* 33  */\n'
+                                 '#define HAVE_FOO\n#undef HAVE_BAR\n/* #undef HAVE_BAZ */\n')
+            # An unchanged output is not rewritten
+            os.utime(dst, (0, 0))
+            mesonbuild.mesonlib.do_conf_file(src, dst, cdata)
+            self.assertEqual(os.stat(dst).st_mtime, 0)
+            cdata.values['VERSION'] = (4, None)
+            mesonbuild.mesonlib.do_conf_file(src, dst, cdata)
+            self.assertNotEqual(os.stat(dst).st_mtime, 0)
+            self.assertFalse(os.path.exists(dst + '~'))
+            # A failure partway through leaves neither output behind
+            with open(src, 'a') as f:
+                f.write('#mesondefine\n')
+            with self.assertRaises(mesonbuild.mesonlib.MesonException):
+                mesonbuild.mesonlib.do_conf_file(src, dst, cdata)
+            self.assertFalse(os.path.exists(dst + '~'))
+            with open(dst) as f:
+                self.assertIn('#define HAVE_FOO', f.read())
+
+    @unittest.skipIf(not shutil.which('cc') or is_windows() or is_osx(), 'Needs an ELF toolchain')
+    def test_elf_readonly(self):
+        from mesonbuild.scripts import depfixer
+        with tempfile.TemporaryDirectory() as d:
+            src = os.path.join(d, 'lib.c')
+            lib = os.path.join(d, 'libfoo.so')
+            with open(src, 'w') as f:
+                f.write('int foo(void) { return 0; }\n')
+            subprocess.check_call(['cc', '-shared', '-fPIC', '-Wl,-soname,libfoo.so.1', '-o', lib, src])
+            os.chmod(lib, stat.S_IRUSR)
+            with depfixer.Elf(lib, verbose=False, readonly=True) as elf:
+                self.assertEqual(elf.get_soname(), b'libfoo.so.1')
+                self.assertIn(('foo', 'T'), elf.get_dynamic_symbols())
+            # Root can open the file for writing regardless
+            if not os.access(lib, os.W_OK):
+                with self.assertRaises(PermissionError):
+                    depfixer.Elf(lib, verbose=False)
+
+    @unittest.skipIf(is_windows(), 'POSIX quoting only')
+    def test_ninja_compdb_command(self):
+        from mesonbuild.backend.ninjabackend import NinjaBuildElement
+        elem = NinjaBuildElement({}, 'foo@exe/a.c.o', 'c_COMPILER', 'src dir/a.c')
+        elem.add_item('DEPFILE', 'foo@exe/a.c.o.d')
+        elem.add_item('ARGS', ['-DX=a b', '-I.', '-DC=d:e'])
+        cmd = elem.evaluate_command("cc $ARGS '-MF' '$DEPFILE' -o $out -c $in $$HOME")
+        self.assertEqual(cmd, "cc '-DX=a b' '-I.' '-DC=d:e' '-MF' 'foo@exe/a.c.o.d' "
+                              "-o 'foo@exe/a.c.o' -c 'src dir/a.c' $HOME")
+
     def test_string_templates_substitution(self):
         dictfunc = mesonbuild.mesonlib.get_filenames_templates_dict
         substfunc = mesonbuild.mesonlib.substitute_values
@@ -433,20 +760,7 @@ class BasePlatformTests(unittest.TestCase):
 
     def get_compdb(self):
         with open(os.path.join(self.builddir, 'compile_commands.json')) as ifile:
-            contents = json.load(ifile)
-        # If Ninja is using .rsp files, generate them, read their contents, and
-        # replace it as the command for all compile commands in the parsed json.
-        if len(contents) > 0 and contents[0]['command'].endswith('.rsp'):
-            # Pretend to build so that the rsp files are generated
-            self.build(['-d', 'keeprsp', '-n'])
-            for each in contents:
-                # Extract the actual command from the rsp file
-                compiler, rsp = each['command'].split(' @')
-                rsp = os.path.join(self.builddir, rsp)
-                # Replace the command with its contents
-                with open(rsp, 'r', encoding='utf-8') as f:
-                    each['command'] = compiler + ' ' + f.read()
-        return contents
+            return json.load(ifile)
 
     def get_meson_log(self):
         with open(os.path.join(self.builddir, 'meson-logs', 'meson-log.txt')) as f:
@@ -631,6 +945,37 @@ class AllPlatformTests(BasePlatformTests):
         self.uninstall()
         self.assertFalse(os.path.exists(exename))
 
+    def test_incremental_install(self):
+        '''
+        Test that installing again only copies files that changed, and that
+        files are still checked even if the manifest is out of date.
+        '''
+        exename = os.path.join(self.installdir, 'usr/bin/prog' + exe_suffix)
+        libname = os.path.join(self.installdir + self.libdir, 'libstat.a')
+        testdir = os.path.join(self.common_test_dir, '8 install')
+        self.init(testdir)
+        self.install()
+        # Copying creates a new file, which changes its ctime
+        lib_ctime = os.stat(libname).st_ctime_ns
+        with open(exename, 'rb') as f:
+            exe_contents = f.read()
+        with open(exename, 'ab') as f:
+            f.write(b'garbage')
+        self.install()
+        self.assertEqual(os.stat(libname).st_ctime_ns, lib_ctime)
+        with open(exename, 'rb') as f:
+            self.assertEqual(f.read(), exe_contents)
+        # Without a manifest files are compared with the ones to install
+        os.unlink(os.path.join(self.privatedir, 'install_manifest.dat'))
+        self.install()
+        self.assertEqual(os.stat(libname).st_ctime_ns, lib_ctime)
+        os.environ['MESON_INSTALL_COMPARE'] = 'copy'
+        try:
+            self.install()
+        finally:
+            del os.environ['MESON_INSTALL_COMPARE']
+        self.assertNotEqual(os.stat(libname).st_ctime_ns, lib_ctime)
+
     def test_testsetups(self):
         if not shutil.which('valgrind'):
                 raise unittest.SkipTest('Valgrind not installed.')
@@ -714,6 +1059,49 @@ class AllPlatformTests(BasePlatformTests):
 
         self.assertFailedTestCount(1, self.mtest_command + ['--no-suite', 'subprjfail:fail', '--no-suite', 'subprjmix:fail'])
 
+    def test_skip_unchanged(self):
+        testdir = os.path.join(self.unit_test_dir, '4 suite selection')
+        self.init(testdir)
+        self.build()
+
+        def get_results():
+            with open(os.path.join(self.logdir, 'testlog.json')) as f:
+                return [json.loads(line)['result'] for line in f]
+
+        command = self.mtest_command + ['--skip-unchanged']
+        self.assertFailedTestCount(3, command)
+        self.assertNotIn('CACHED', get_results())
+        # Only the failing tests are run again
+        self.assertFailedTestCount(3, command)
+        self.assertEqual(sorted(set(get_results())), ['CACHED', 'FAIL'])
+        # A different command line means different inputs
+        self.assertFailedTestCount(3, command + ['--test-args=--foo'])
+        self.assertNotIn('CACHED', get_results())
+
+    def test_sharding(self):
+        testdir = os.path.join(self.unit_test_dir, '4 suite selection')
+        self.init(testdir)
+        self.build()
+
+        def list_tests(*args):
+            output = self._run(self.mtest_command + ['--no-rebuild', '--list'] + list(args))
+            return [l for l in output.splitlines() if l != 'No suitable tests defined.']
+
+        alltests = list_tests()
+        shards = [list_tests('--shard', '%d/3' % k) for k in (1, 2, 3)]
+        # Every test is in exactly one shard
+        self.assertEqual(sorted(sum(shards, [])), sorted(alltests))
+        # Merging the logs of all shards gives the same summary as one run
+        logs = []
+        for k in (1, 2, 3):
+            self.assertFailedTestCount(len([t for t in shards[k - 1] if 'failing_test' in t]),
+                                       self.mtest_command + ['--shard', '%d/3' % k, '--logbase', 'shard%d' % k])
+            logs.append(os.path.join(self.logdir, 'shard%d.json' % k))
+        merged = os.path.join(self.logdir, 'merged.json')
+        self.assertFailedTestCount(3, self.mtest_command + ['--merge-logs', merged] + logs)
+        with open(merged) as f:
+            self.assertEqual(len(f.readlines()), len(alltests))
+
     def test_build_by_default(self):
         testdir = os.path.join(self.common_test_dir, '137 build by default')
         self.init(testdir)
@@ -725,6 +1113,16 @@ class AllPlatformTests(BasePlatformTests):
         self._run(self.ninja_command + ['fooprog' + exe_suffix])
         self.assertTrue(os.path.exists(exe))
 
+    def test_unity_size(self):
+        testdir = os.path.join(self.unit_test_dir, '8 unity chunks')
+        self.init(testdir, extra_args=['--unity', '--unity-size=2'])
+        unity_files = glob(os.path.join(self.builddir, '*', 'lib-unity*.c'))
+        self.assertEqual(sorted(os.path.basename(f) for f in unity_files),
+                         ['lib-unity0.c', 'lib-unity1.c', 'lib-unity2.c'])
+        # The executable gets all the objects of the extracted unity files
+        self.build()
+        self.run_tests()
+
     def test_internal_include_order(self):
         testdir = os.path.join(self.common_test_dir, '138 include order')
         self.init(testdir)
@@ -964,6 +1362,141 @@ class AllPlatformTests(BasePlatformTests):
         os.environ['CFLAGS'] = '-DMESON_FAIL_VALUE=cflags-read'.format(define)
         self.init(testdir, ['-D{}={}'.format(define, value)])
 
+    def test_compiler_check_cache(self):
+        '''
+        Test that compiler check results are reused when reconfiguring and
+        that clearing the cache makes the checks run again.
+        '''
+        testdir = os.path.join(self.common_test_dir, '37 has header')
+        self.init(testdir)
+        checks = self.get_meson_log_compiler_checks()
+        self.assertNotEqual(len(checks), 0)
+        self.assertTrue(os.path.isfile(os.path.join(self.privatedir, 'check_cache.dat')))
+        # Reconfiguring answers every check from the cache
+        self.build(['reconfigure'])
+        self.assertEqual(self.get_meson_log_compiler_checks(), [])
+        self.assertTrue(any(l.startswith('Using cached compile result') for l in self.get_meson_log()))
+        # Until the cache is cleared, which also triggers a regeneration
+        self.setconf('--clearcache')
+        self.build()
+        self.assertEqual(len(self.get_meson_log_compiler_checks()), len(checks))
+
+    def test_ast_cache(self):
+        '''
+        Test that parsed build files are cached and that changed build files
+        are parsed again when regenerating.
+        '''
+        testdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, testdir)
+        os.mkdir(os.path.join(testdir, 'sub'))
+        with open(os.path.join(testdir, 'meson.build'), 'w') as f:
+            f.write("project('ast cache', 'c')\nsubdir('sub')\n")
+        subfile = os.path.join(testdir, 'sub', 'meson.build')
+        with open(subfile, 'w') as f:
+            f.write("message('first version')\n")
+        self.init(testdir)
+        cache = mesonbuild.mparser.AstCache(os.path.join(self.privatedir, 'ast_cache.dat'))
+        self.assertEqual({os.path.basename(k[0]) for k in cache.entries}, {'meson.build'})
+        self.assertEqual({k[1] for k in cache.entries}, {'', 'sub'})
+        # Touching a build file without changing it reuses the cached AST
+        time.sleep(1)
+        os.utime(subfile)
+        self.build()
+        self.assertIn('first version', ''.join(self.get_meson_log()))
+        # Changed build files are parsed again
+        time.sleep(1)
+        with open(subfile, 'w') as f:
+            f.write("message('second version')\n")
+        self.build()
+        log = ''.join(self.get_meson_log())
+        self.assertIn('second version', log)
+        self.assertNotIn('first version', log)
+
+    def test_unchanged_build_definition(self):
+        '''
+        Test that build.ninja is kept when regenerating gives the same build
+        definition and rewritten when the build definition changes.
+        '''
+        testdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, testdir)
+        with open(os.path.join(testdir, 'prog.c'), 'w') as f:
+            f.write('int main(int argc, char **argv) { return 0; }\n')
+        buildfile = os.path.join(testdir, 'meson.build')
+        with open(buildfile, 'w') as f:
+            f.write("project('unchanged', 'c')\nexecutable('prog', 'prog.c')\n")
+        self.init(testdir)
+        build_ninja = os.path.join(self.builddir, 'build.ninja')
+        mtime = os.path.getmtime(build_ninja)
+        # Only a comment changes
+        time.sleep(1)
+        with open(buildfile, 'a') as f:
+            f.write('# comment\n')
+        self.build()
+        self.assertIn('Build definition unchanged', ''.join(self.get_meson_log()))
+        self.assertEqual(os.path.getmtime(build_ninja), mtime)
+        # Ninja does not regenerate again
+        self.assertNotIn('Regenerating', self._run(self.ninja_command + ['-n']))
+        time.sleep(1)
+        with open(buildfile, 'a') as f:
+            f.write("executable('prog2', 'prog.c')\n")
+        self.build()
+        self.assertNotIn('Build definition unchanged', ''.join(self.get_meson_log()))
+        with open(build_ninja) as f:
+            self.assertIn('prog2', f.read())
+
+    def test_regenerate_fortran_module_use(self):
+        '''
+        Test that regenerating picks up a module used by a Fortran source
+        even if the build files themselves do not change what is built.
+        '''
+        if not shutil.which('gfortran'):
+            raise unittest.SkipTest('gfortran not installed.')
+        testdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, testdir)
+        srcdir = os.path.join(self.src_root, 'test cases/fortran/2 modules')
+        for f in ('meson.build', 'stuff.f90'):
+            shutil.copy(os.path.join(srcdir, f), testdir)
+        progfile = os.path.join(testdir, 'prog.f90')
+        with open(progfile, 'w') as f:
+            f.write('PROGRAM prog\nIMPLICIT NONE\nEND PROGRAM prog\n')
+        self.init(testdir)
+        self.build()
+        build_ninja = os.path.join(self.builddir, 'build.ninja')
+        with open(build_ninja) as f:
+            self.assertNotIn('| modprog@exe/circle.mod', f.read())
+        time.sleep(1)
+        with open(progfile, 'w') as f:
+            f.write('PROGRAM prog\nuse Circle\nIMPLICIT NONE\nEND PROGRAM prog\n')
+        with open(os.path.join(testdir, 'meson.build'), 'a') as f:
+            f.write('# comment\n')
+        self.build()
+        self.assertNotIn('Build definition unchanged', ''.join(self.get_meson_log()))
+        with open(build_ninja) as f:
+            self.assertIn('| modprog@exe/circle.mod', f.read())
+
+    def test_data_file_sections(self):
+        '''
+        Test that coredata.dat and build.dat are loaded section by section and
+        that objects shared between sections keep their identity.
+        '''
+        testdir = os.path.join(self.common_test_dir, '1 trivial')
+        self.init(testdir)
+        b = mesonbuild.build.load(os.path.join(self.privatedir, 'build.dat'))
+        self.assertEqual(list(b.test_setups), [])
+        self.assertEqual(set(b._data_reader.loaded), {'test_setups'})
+        test = b.tests[0]
+        self.assertIn('targets', b._data_reader.loaded)
+        self.assertNotIn('install', b._data_reader.loaded)
+        self.assertIs(test.exe, b.targets[test.exe.get_id()])
+        self.assertIs(test.exe.environment, b.environment)
+        cd = mesonbuild.coredata.load(os.path.join(self.privatedir, 'coredata.dat'))
+        self.assertEqual(cd.get_builtin_option('backend'), 'ninja')
+        self.assertEqual(set(cd._data_reader.loaded), {'options'})
+        # Pickling forces all sections to be loaded
+        cd = pickle.loads(pickle.dumps(cd))
+        self.assertEqual(cd.deps, {})
+        self.assertIn('c', cd.compilers)
+
 
 class WindowsTests(BasePlatformTests):
     '''
@@ -1041,6 +1574,26 @@ class LinuxlikeTests(BasePlatformTests):
         soname = get_soname(lib1)
         self.assertEqual(soname, 'prefixsomelib.suffix')
 
+    def test_symbol_extractor(self):
+        '''
+        Test that the symbols are read from the shared library itself the
+        same way nm lists them, and that the soname is included.
+        '''
+        from mesonbuild.scripts import symbolextractor
+        testdir = os.path.join(self.common_test_dir, '4 shared')
+        self.init(testdir)
+        self.build()
+        lib1 = os.path.join(self.builddir, 'libmylib.so')
+        symfile = os.path.join(self.builddir, 'symbols.txt')
+        symbolextractor.linux_syms(lib1, symfile)
+        with open(symfile) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines[0], 'SONAME libmylib.so')
+        nm = subprocess.check_output(['nm', '--dynamic', '--extern-only', '--defined-only',
+                                      '--format=posix', lib1], universal_newlines=True)
+        expected = sorted(' '.join(l.split()[0:2]) for l in nm.splitlines() if l)
+        self.assertEqual(lines[1:], expected)
+
     def test_pic(self):
         '''
         Test that -fPIC is correctly added to static libraries when b_staticpic
@@ -1365,6 +1918,106 @@ class LinuxlikeTests(BasePlatformTests):
         self.assertIn('-Werror', plain_comp)
         self.assertNotIn('-Werror', c03_comp)
 
+class TestHarnessTests(unittest.TestCase):
+    '''
+    Tests of mesontest.py that need no build, the tests are Python one-liners.
+    '''
+    def setUp(self):
+        super().setUp()
+        self.wd = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.wd)
+        os.mkdir(os.path.join(self.wd, 'meson-private'))
+        os.mkdir(os.path.join(self.wd, 'meson-logs'))
+        src_root = os.path.dirname(__file__)
+        self.mtest_command = [sys.executable, os.path.join(src_root, 'mesontest.py'),
+                              '--no-rebuild', '-C', self.wd]
+
+    def write_tests(self, tests):
+        from mesonbuild.backend.backends import TestSerialisation
+        serialised = []
+        for (name, code, timeout) in tests:
+            serialised.append(TestSerialisation(name, ['unit'], [sys.executable, '-c', code], False,
+                                                None, True, [], mesonbuild.build.EnvironmentVariables(),
+                                                False, timeout, None, [], [], 1, 0))
+        with open(os.path.join(self.wd, 'meson-private', 'meson_test_setup.dat'), 'wb') as f:
+            pickle.dump(serialised, f)
+
+    def run_mtest(self, *args):
+        p = subprocess.Popen(self.mtest_command + list(args), stdout=subprocess.PIPE,
+                             universal_newlines=True)
+        return p.communicate()[0]
+
+    def get_results(self, out):
+        '''Returns the test names in the order their results were printed.'''
+        names = []
+        for line in out.splitlines():
+            m = re.match(r'^ *\d+/\d+ (\S+) ', line)
+            if m:
+                names.append(m.group(1))
+        return names
+
+    def get_json_log(self):
+        with open(os.path.join(self.wd, 'meson-logs', 'testlog.json')) as f:
+            return {r['name']: r for r in map(json.loads, f)}
+
+    def test_run_batch(self):
+        '''
+        Test that results are reported as tests finish, that timeouts fire
+        while no test writes anything, and that output larger than a pipe
+        buffer is captured completely.
+        '''
+        self.write_tests([('slow', 'import time; time.sleep(4)', 30),
+                          ('hang', 'import time; time.sleep(60)', 1),
+                          ('big', 'print("x" * 200000)', 30),
+                          ('err', 'import sys; sys.stderr.write("e" * 100000); sys.exit(1)', 30)])
+        start = time.time()
+        out = self.run_mtest('--num-processes', '4')
+        self.assertLess(time.time() - start, 30)
+        results = self.get_results(out)
+        self.assertEqual(sorted(results[:2]), ['big', 'err'])
+        self.assertEqual(results[2:], ['hang', 'slow'])
+        log = self.get_json_log()
+        self.assertEqual(log['hang']['result'], 'TIMEOUT')
+        self.assertLess(log['hang']['duration'], 4)
+        self.assertEqual(log['slow']['result'], 'OK')
+        self.assertEqual(log['big']['stdout'], 'x' * 200000 + '\n')
+        self.assertEqual(log['err']['result'], 'FAIL')
+        self.assertEqual(log['err']['stdout'], '')
+        self.assertEqual(log['err']['stderr'], 'e' * 100000)
+        # Without splitting, stderr ends up in stdout
+        self.run_mtest('--no-stdsplit', 'big', 'err')
+        log = self.get_json_log()
+        self.assertEqual(log['err']['stdout'], 'e' * 100000)
+        self.assertNotIn('stderr', log['err'])
+        self.assertEqual(log['big']['stdout'], 'x' * 200000 + '\n')
+        # Verbose runs leave the output of the tests alone
+        out = self.run_mtest('--verbose', 'big', 'hang')
+        self.assertIn('x' * 200000 + '\n', out)
+        self.assertIn('hang time out', out)
+        self.assertEqual(sorted(self.get_results(out)), ['big', 'hang'])
+
+    def test_history_order(self):
+        '''
+        Test that test durations are recorded and that parallel tests start
+        longest first, with tests of unknown duration ahead of them.
+        '''
+        names = ['short', 'long', 'new', 'medium']
+        self.write_tests([(name, 'pass', 30) for name in names])
+        self.run_mtest()
+        historyfile = os.path.join(self.wd, 'meson-private', 'meson_test_history.json')
+        with open(historyfile) as f:
+            self.assertEqual(sorted(json.load(f)), sorted(names))
+        with open(historyfile, 'w') as f:
+            json.dump({'short': 1.0, 'long': 30.0, 'medium': 10.0}, f)
+        # With one process the tests finish in the order they start
+        out = self.run_mtest('--num-processes', '1')
+        self.assertEqual(self.get_results(out), ['new', 'long', 'medium', 'short'])
+        with open(historyfile) as f:
+            history = json.load(f)
+        self.assertEqual(sorted(history), sorted(names))
+        self.assertLess(history['long'], 30.0)
+
+
 class RewriterTests(unittest.TestCase):
 
     def setUp(self):
@@ -0,0 +1 @@
+int f1(void); int main(void) { return f1() - 1; }
@@ -0,0 +1 @@
+int f3(void) { return 3; }
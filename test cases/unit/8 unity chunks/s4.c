@@ -0,0 +1 @@
+int f4(void) { return 4; }
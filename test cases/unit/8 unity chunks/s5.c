@@ -0,0 +1 @@
+int f5(void) { return 5; }
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Microbenchmark for compilers.CompilerArgs.
+
+Builds command lines the way the Ninja backend does for a target with many
+include directories and defines: prepended -I arguments, overridden -D
+arguments (dedup 2) and repeated -pipe style arguments (dedup 1). Results
+are compared against a reference implementation that searches the lists
+for every argument, which is also timed.'''
+
+import sys, os, time, random, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from mesonbuild import compilers
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--args', type=int, default=500,
+                    help='Number of -I and -D arguments each (default: 500).')
+parser.add_argument('--sources', type=int, default=50,
+                    help='Number of command lines to build (default: 50).')
+parser.add_argument('--no-compare', action='store_false', dest='compare', default=True,
+                    help='Do not run the reference implementation.')
+
+class ReferenceCompilerArgs(compilers.CompilerArgs):
+    def __iadd__(self, args):
+        pre = []
+        post = []
+        for arg in args:
+            dedup = self._can_dedup(arg)
+            if dedup == 1:
+                if arg in self or arg in pre or arg in post:
+                    continue
+            if dedup == 2:
+                if arg in self:
+                    self.remove(arg)
+                if arg in pre:
+                    pre.remove(arg)
+                if arg in post:
+                    post.remove(arg)
+            if self._should_prepend(arg):
+                pre.append(arg)
+            else:
+                post.append(arg)
+        self[:0] = pre
+        list.__iadd__(self, post)
+        return self
+
+    def __add__(self, args):
+        new = ReferenceCompilerArgs(self, self.compiler)
+        new += args
+        return new
+
+def make_chunks(nargs, rng):
+    incdirs = ['-I/path/to/some/include/dir{}'.format(i) for i in range(nargs)]
+    defines = ['-DDEFINE_{}=1'.format(i) for i in range(nargs)]
+    flags = ['-pipe', '-c', '-Wall', '-O2', '-fPIC', '-pthread', '-g']
+    chunks = []
+    # Target include dirs, then dependency include dirs that overlap
+    chunks.append(incdirs[:nargs // 2] + flags)
+    chunks.append(defines + flags)
+    chunks.append(incdirs[nargs // 4:] + ['-pipe', '-pthread'])
+    # Per-source arguments that override some of the earlier ones
+    chunks.append(rng.sample(defines, nargs // 10) + rng.sample(incdirs, nargs // 10))
+    for _ in range(20):
+        chunks.append(rng.sample(incdirs + defines + flags, 5))
+    return chunks
+
+def build(cls, compiler, chunks, sources):
+    result = None
+    for _ in range(sources):
+        commands = cls(compiler)
+        for chunk in chunks:
+            commands += chunk
+        for arg in ['-MD', '-MQ', 'foo.o', '-MF', 'foo.o.d', '-o', 'foo.o', '-c', 'foo.c']:
+            commands.append(arg)
+        result = commands
+    return result
+
+def run(args):
+    options = parser.parse_args(args)
+    compiler = compilers.GnuCCompiler(['cc'], '1.0', compilers.GCC_STANDARD, False)
+    chunks = make_chunks(options.args, random.Random(42))
+    impls = [('CompilerArgs', compilers.CompilerArgs)]
+    if options.compare:
+        impls.append(('Reference', ReferenceCompilerArgs))
+    results = []
+    for (name, cls) in impls:
+        start = time.perf_counter()
+        res = build(cls, compiler, chunks, options.sources)
+        elapsed = time.perf_counter() - start
+        results.append(list(res))
+        print('{:14} {:8.3f}s {:6} arguments'.format(name + ':', elapsed, len(res)))
+    if options.compare and results[0] != results[1]:
+        print('Results differ from the reference implementation.')
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv[1:]))
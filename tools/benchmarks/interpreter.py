@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Benchmark for the interpreter on large synthetic build files.
+
+Every workload is a generated meson.build that does not use any compiler,
+so only parsing and evaluation of the build definition is measured.'''
+
+import sys, os, time, shutil, tempfile, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from mesonbuild import environment, build, interpreter, mlog
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--size', type=int, default=10000,
+                    help='Number of array elements / loop iterations (default: 10000).')
+parser.add_argument('--depth', type=int, default=25,
+                    help='Nesting depth of the if tree (default: 25).')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='Number of runs of every workload, the best is reported (default: 3).')
+parser.add_argument('workloads', nargs='*',
+                    help='Workloads to run (default: all).')
+
+def gen_foreach(options):
+    elements = ', '.join("'item{}'".format(i) for i in range(options.size))
+    return '''items = [{}]
+count = 0
+names = []
+foreach i : items
+  if i.startswith('item') and not i.endswith('x')
+    count += 1
+  endif
+  names += i.to_upper()
+endforeach
+assert(count == {}, 'foreach count mismatch')
+'''.format(elements, options.size)
+
+def gen_arithmetic(options):
+    return '''nums = []
+foreach i : range_input
+  nums += (i * 3 + 7) % 5 - (i / 2)
+endforeach
+total = 0
+foreach n : nums
+  total += n
+endforeach
+'''.replace('range_input', '[{}]'.format(', '.join(str(i) for i in range(options.size))))
+
+def gen_if_tree(options):
+    lines = ['v = 0', 'foreach i : [{}]'.format(', '.join(str(i) for i in range(options.size // 10)))]
+    for d in range(options.depth):
+        lines.append('  ' * (d + 1) + 'if i >= {} or i == {}'.format(d, d))
+        lines.append('  ' * (d + 2) + 'v += 1')
+    for d in reversed(range(options.depth)):
+        lines.append('  ' * (d + 1) + 'elif i == -1')
+        lines.append('  ' * (d + 2) + "error('unreachable')")
+        lines.append('  ' * (d + 1) + 'else')
+        lines.append('  ' * (d + 2) + 'v += 2')
+        lines.append('  ' * (d + 1) + 'endif')
+    lines.append('endforeach')
+    return '\n'.join(lines) + '\n'
+
+def gen_strings(options):
+    return '''parts = []
+foreach i : [{}]
+  s = '@0@-@1@'.format(i, 'suffix')
+  parts += s.split('-')
+  joined = '/'.join([parts[-2], parts[-1]])
+  x = i.is_even() ? joined.underscorify() : joined.strip()
+endforeach
+'''.format(', '.join(str(i) for i in range(options.size // 2)))
+
+workloads = {
+    'foreach': gen_foreach,
+    'arithmetic': gen_arithmetic,
+    'iftree': gen_if_tree,
+    'strings': gen_strings,
+}
+
+def get_options(prefix):
+    opts = argparse.Namespace()
+    opts.cross_file = None
+    opts.wrap_mode = None
+    opts.prefix = prefix
+    return opts
+
+def run_workload(code, repeat):
+    srcdir = tempfile.mkdtemp()
+    builddir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(srcdir, 'meson.build'), 'w') as f:
+            f.write("project('interpreter benchmark')\n")
+            f.write(code)
+        best = None
+        for _ in range(repeat):
+            env = environment.Environment(srcdir, builddir, sys.argv[0], get_options('/usr'), [])
+            # Parsing happens in the constructor, so time it too
+            start = time.perf_counter()
+            intr = interpreter.Interpreter(build.Build(env), None)
+            intr.run()
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+    finally:
+        shutil.rmtree(srcdir)
+        shutil.rmtree(builddir)
+
+def run(args):
+    options = parser.parse_args(args)
+    names = options.workloads or sorted(workloads.keys())
+    for name in names:
+        if name not in workloads:
+            print('Unknown workload', name)
+            return 1
+    # Keep the console quiet, we only want the timings
+    mlog.log = lambda *args, **kwargs: None
+    for name in names:
+        code = workloads[name](options)
+        elapsed = run_workload(code, options.repeat)
+        print('{:12} {:8.3f}s {:10} lines'.format(name + ':', elapsed, code.count('\n') + 1))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv[1:]))
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Microbenchmark for mparser.Lexer over all meson.build files of a tree.
+
+By default the "test cases" directory of the Meson source tree is used as
+the corpus. The token stream of every file is also compared against a
+reference lexer that tries every token pattern in turn, the way the lexer
+used to work, and the speed of both is reported.'''
+
+import sys, os, re, time, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from mesonbuild import mparser
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--repeat', type=int, default=5,
+                    help='Number of times every file is lexed (default: 5).')
+parser.add_argument('--no-compare', action='store_false', dest='compare', default=True,
+                    help='Do not run the reference lexer.')
+parser.add_argument('corpus', nargs='?',
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'test cases'),
+                    help='Directory to search for meson.build files.')
+
+class ReferenceLexer(mparser.Lexer):
+    '''Matches one token pattern after the other at every position.'''
+    specs = [(tid, re.compile(regex)) for (tid, regex) in mparser.Lexer.token_specification]
+
+    def lex(self, subdir):
+        code = self.code
+        line_start = 0
+        lineno = 1
+        loc = 0
+        par_count = 0
+        bracket_count = 0
+        while loc < len(code):
+            for (tid, reg) in self.specs:
+                mo = reg.match(code, loc)
+                if mo:
+                    break
+            else:
+                raise mparser.ParseException('lexer', self.getline(line_start), lineno, 0)
+            curline = lineno
+            curline_start = line_start
+            col = loc - line_start
+            bytespan = (loc, mo.end())
+            loc = mo.end()
+            match_text = mo.group()
+            value = None
+            if tid in ('ignore', 'comment'):
+                continue
+            elif tid in ('eol', 'eol_cont'):
+                lineno += 1
+                line_start = loc
+                if par_count > 0 or bracket_count > 0:
+                    continue
+            elif tid == 'lparen':
+                par_count += 1
+            elif tid == 'rparen':
+                par_count -= 1
+            elif tid == 'lbracket':
+                bracket_count += 1
+            elif tid == 'rbracket':
+                bracket_count -= 1
+            elif tid == 'string':
+                value = match_text[1:-1].replace(r"\'", "'").replace('\\\\', '\\').replace('\\n', '\n')
+            elif tid == 'multiline_string':
+                tid = 'string'
+                value = match_text[3:-3]
+                lines = match_text.split('\n')
+                if len(lines) > 1:
+                    lineno += len(lines) - 1
+                    line_start = loc - len(lines[-1])
+            elif tid == 'number':
+                value = int(match_text)
+            elif tid == 'id':
+                if match_text in self.keywords:
+                    tid = match_text
+                else:
+                    value = match_text
+            yield mparser.Token(tid, subdir, curline_start, curline, col, bytespan, value)
+
+def token_tuple(t):
+    return (t.tid, t.line_start, t.lineno, t.colno, t.bytespan, t.value)
+
+def load_corpus(topdir):
+    corpus = []
+    for root, _, files in os.walk(topdir):
+        if 'meson.build' in files:
+            with open(os.path.join(root, 'meson.build'), encoding='utf8') as f:
+                corpus.append((root, f.read()))
+    return corpus
+
+def time_lexer(lexer_class, corpus, repeat):
+    ntokens = 0
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for (fname, code) in corpus:
+            for _ in lexer_class(code).lex(''):
+                ntokens += 1
+    return time.perf_counter() - start, ntokens
+
+def lex_all(lexer_class, code):
+    try:
+        return [token_tuple(t) for t in lexer_class(code).lex('')]
+    except mparser.ParseException as e:
+        return str(e).split('\n')[0]
+
+def run(args):
+    options = parser.parse_args(args)
+    corpus = load_corpus(options.corpus)
+    if not corpus:
+        print('No meson.build files found in', options.corpus)
+        return 1
+    nbytes = sum(len(code) for (_, code) in corpus)
+    print('Corpus: {} files, {} bytes'.format(len(corpus), nbytes))
+    mismatches = 0
+    if options.compare:
+        for (fname, code) in corpus:
+            if lex_all(mparser.Lexer, code) != lex_all(ReferenceLexer, code):
+                print('Token stream mismatch:', fname)
+                mismatches += 1
+    lexers = [('Lexer', mparser.Lexer)]
+    if options.compare:
+        lexers.append(('Reference lexer', ReferenceLexer))
+    for (name, lexer_class) in lexers:
+        elapsed, ntokens = time_lexer(lexer_class, corpus, options.repeat)
+        print('{:16} {:8.3f}s {:12.0f} tokens/s {:10.2f} MB/s'.format(
+            name + ':', elapsed, ntokens / elapsed,
+            nbytes * options.repeat / elapsed / 1024 / 1024))
+    return 1 if mismatches else 0
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv[1:]))
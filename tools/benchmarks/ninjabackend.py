@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+# Copyright 2017 The Meson development team
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+
+#     http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+'''Benchmark for build.ninja generation on a large synthetic project.
+
+The project has the given number of static library targets spread over
+subdirectories, each with a few sources and a shared set of include
+directories. The interpreter runs once; only NinjaBackend.generate is
+timed. Unless disabled, the build statements are also written with a
+reference implementation of NinjaBuildElement.write that formats and
+writes every line separately, the way it used to, and the output of
+both is compared.'''
+
+import sys, os, time, shutil, tempfile, argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from mesonbuild import environment, build, interpreter, mesonmain, mlog
+from mesonbuild.backend import ninjabackend
+from mesonbuild.backend.ninjabackend import ninja_quote, quote_char
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--targets', type=int, default=50000,
+                    help='Number of targets (default: 50000).')
+parser.add_argument('--sources', type=int, default=2,
+                    help='Number of sources per target (default: 2).')
+parser.add_argument('--subdirs', type=int, default=500,
+                    help='Number of subdirectories to spread the targets over (default: 500).')
+parser.add_argument('--incdirs', type=int, default=20,
+                    help='Number of include directories used by every target (default: 20).')
+parser.add_argument('--repeat', type=int, default=3,
+                    help='Number of generation runs, the best is reported (default: 3).')
+parser.add_argument('--no-compare', action='store_false', dest='compare', default=True,
+                    help='Do not run the reference implementation.')
+
+def reference_write(self, outfile):
+    self.check_outputs()
+    line = 'build %s: %s %s' % (
+        ' '.join([ninja_quote(i) for i in self.outfilenames]),
+        self.rule,
+        ' '.join([ninja_quote(i) for i in self.infilenames]))
+    if len(self.deps) > 0:
+        line += ' | ' + ' '.join([ninja_quote(x) for x in self.deps])
+    if len(self.orderdeps) > 0:
+        line += ' || ' + ' '.join([ninja_quote(x) for x in self.orderdeps])
+    line += '\n'
+    line = line.replace('\\', '/')
+    outfile.write(line)
+    for e in self.elems:
+        (name, elems) = e
+        should_quote = True
+        if name == 'DEPFILE' or name == 'DESC' or name == 'pool':
+            should_quote = False
+        line = ' %s = ' % name
+        q_templ = quote_char + "%s" + quote_char
+        noq_templ = "%s"
+        newelems = []
+        for i in elems:
+            if not should_quote or i == '&&':
+                templ = noq_templ
+            else:
+                templ = q_templ
+            i = i.replace('\\', '\\\\')
+            if quote_char == '"':
+                i = i.replace('"', '\\"')
+            newelems.append(templ % ninja_quote(i))
+        line += ' '.join(newelems)
+        line += '\n'
+        outfile.write(line)
+    outfile.write('\n')
+
+def create_project(srcdir, options):
+    incdirs = ['include/dir{}'.format(i) for i in range(options.incdirs)]
+    for d in incdirs:
+        os.makedirs(os.path.join(srcdir, d))
+    per_subdir = max(1, options.targets // options.subdirs)
+    subdirs = []
+    for first in range(0, options.targets, per_subdir):
+        subdir = 'sub{}'.format(len(subdirs))
+        subdirs.append(subdir)
+        os.mkdir(os.path.join(srcdir, subdir))
+        sources = ['src{}.c'.format(i) for i in range(options.sources)]
+        for s in sources:
+            open(os.path.join(srcdir, subdir, s), 'w').close()
+        names = ["'t{}'".format(i) for i in range(first, min(first + per_subdir, options.targets))]
+        with open(os.path.join(srcdir, subdir, 'meson.build'), 'w') as f:
+            f.write('foreach n : [{}]\n'.format(', '.join(names)))
+            f.write('  static_library(n, {}, include_directories : incdirs,\n'.format(sources))
+            f.write("                 c_args : ['-DTARGET_' + n, '-DSUBDIR=\"@0@\"'.format(n)])\n")
+            f.write('endforeach\n')
+    with open(os.path.join(srcdir, 'meson.build'), 'w') as f:
+        f.write("project('ninja backend benchmark', 'c')\n")
+        f.write('incdirs = include_directories({})\n'.format(', '.join("'{}'".format(d) for d in incdirs)))
+        for subdir in subdirs:
+            f.write("subdir('{}')\n".format(subdir))
+
+def time_generate(b, intr, repeat):
+    best = None
+    for _ in range(repeat):
+        backend = ninjabackend.NinjaBackend(b)
+        start = time.perf_counter()
+        backend.generate(intr)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def run(args):
+    options = parser.parse_args(args)
+    # Keep the console quiet, we only want the timings
+    mlog.log = lambda *args, **kwargs: None
+    srcdir = tempfile.mkdtemp()
+    builddir = tempfile.mkdtemp()
+    try:
+        create_project(srcdir, options)
+        meson_options = mesonmain.parser.parse_args([srcdir, builddir])
+        env = environment.Environment(srcdir, builddir, sys.argv[0], meson_options, [])
+        b = build.Build(env)
+        intr = interpreter.Interpreter(b, ninjabackend.NinjaBackend(b))
+        intr.run()
+        ninja_file = os.path.join(builddir, 'build.ninja')
+        elapsed = time_generate(b, intr, options.repeat)
+        size = os.path.getsize(ninja_file)
+        print('{:12} {:8.3f}s {:10} targets {:8.1f} MiB'.format('generate:', elapsed, len(b.get_targets()),
+                                                              size / 1024 / 1024))
+        if options.compare:
+            with open(ninja_file, 'rb') as f:
+                contents = f.read()
+            write = ninjabackend.NinjaBuildElement.write
+            ninjabackend.NinjaBuildElement.write = reference_write
+            try:
+                elapsed = time_generate(b, intr, options.repeat)
+            finally:
+                ninjabackend.NinjaBuildElement.write = write
+            print('{:12} {:8.3f}s'.format('reference:', elapsed))
+            with open(ninja_file, 'rb') as f:
+                if f.read() != contents:
+                    print('Output of the reference implementation differs.')
+                    return 1
+        return 0
+    finally:
+        shutil.rmtree(srcdir)
+        shutil.rmtree(builddir)
+
+if __name__ == '__main__':
+    sys.exit(run(sys.argv[1:]))